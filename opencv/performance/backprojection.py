@@ -0,0 +1,253 @@
+"""
+Histogram back-projection tracker on the H-S histogram.
+
+`2d_hist_cv.py` and `2d_hist_np.py` compute the 180x256 hue-saturation
+histogram only to show it, and `object_tracking.py` follows a fixed `inRange`
+box that breaks as soon as the lighting changes. Here the H-S histogram of a
+selected region becomes the target's color model:
+
+- `ColorModel` is the normalized H-S histogram of the region, ignoring
+  pixels too dark or too unsaturated to have a reliable hue
+- the model is turned once into a lookup table indexed by quantized BGR
+  (`bits` per channel), so back-projection is one table lookup per pixel
+  instead of `cvtColor` + `calcBackProject`, with the dark/gray rejection
+  folded in
+- `BackProjectionTracker` back-projects only a search window around the last
+  position and runs CamShift (or mean shift) there, so the per-frame cost
+  follows the window size rather than the frame size; a lost target is
+  searched for again over the whole frame
+
+Usage:
+
+    python backprojection.py                       # synthetic scene with lighting changes
+    python backprojection.py --video 0             # select the target with the mouse
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+from roi_views import Rect, clip_rect, rect_slices
+
+# pixels below these are too dark or too gray for their hue to mean anything
+MIN_SATURATION = 60
+MIN_VALUE = 32
+
+TERM_CRITERIA = (cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 1)
+
+
+class ColorModel:
+    def __init__(self, hist, bits=5):
+        """
+        `hist`: H-S histogram scaled to 0..255, shape (h_bins, s_bins)
+
+        `bits`: bits kept per BGR channel for the lookup table, 5 gives 32^3 entries
+        """
+        self.hist = hist
+        self.bits = bits
+        self.lut = self.build_lut(hist, bits)
+        self.quantize = (np.arange(256) >> (8 - bits)).astype(np.uint8)
+
+    @classmethod
+    def from_region(cls, frame, rect, h_bins=30, s_bins=32, bits=5):
+        ys, xs = rect_slices(Rect(*rect))
+        hsv = cv2.cvtColor(frame[ys, xs], cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, (0, MIN_SATURATION, MIN_VALUE), (180, 255, 255))
+        hist = cv2.calcHist([hsv], [0, 1], mask, [h_bins, s_bins], [0, 180, 0, 256])
+        # spread each bin to its neighbours, so that small color shifts (lighting,
+        # the lookup table's quantization) do not fall into an empty bin
+        hist = cv2.GaussianBlur(hist, (3, 3), 0, borderType=cv2.BORDER_REPLICATE)
+        cv2.normalize(hist, hist, 0, 255, cv2.NORM_MINMAX)
+        return cls(hist, bits)
+
+    @staticmethod
+    def build_lut(hist, bits):
+        """Back-projection value for the center of every quantized BGR cell."""
+        shift = 8 - bits
+        levels = (np.arange(1 << bits) << shift) + (1 << shift >> 1)
+        b, g, r = np.meshgrid(levels, levels, levels, indexing='ij')
+        colors = np.stack([b, g, r], axis=-1).reshape(-1, 1, 3).astype(np.uint8)
+        hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV).reshape(-1, 3).astype(np.int64)
+
+        h_bins, s_bins = hist.shape
+        values = hist[hsv[:, 0] * h_bins // 180, hsv[:, 1] * s_bins // 256]
+        values[(hsv[:, 1] < MIN_SATURATION) | (hsv[:, 2] < MIN_VALUE)] = 0
+        return np.clip(values, 0, 255).astype(np.uint8)
+
+    def back_project(self, image):
+        """Probability image (uint8) of `image` belonging to the target."""
+        q = cv2.LUT(image, self.quantize)
+        index = q[:, :, 0].astype(np.int32) << (2 * self.bits)
+        index |= q[:, :, 1].astype(np.int32) << self.bits
+        index |= q[:, :, 2]
+        return np.take(self.lut, index)
+
+
+def expand_rect(rect, margin, shape):
+    """`rect` grown by `margin` times its size on every side, clipped to the frame."""
+    dx = int(rect.width * margin)
+    dy = int(rect.height * margin)
+    return clip_rect(Rect(rect.x - dx, rect.y - dy, rect.width + 2 * dx, rect.height + 2 * dy), shape)
+
+
+class BackProjectionTracker:
+    def __init__(self, model, rect, method='camshift', margin=1.0, min_mass=0.05):
+        """
+        `rect`: initial (x, y, w, h) of the target
+
+        `margin`: search window size around the last position, in target sizes per side
+
+        `min_mass`: mean back-projection inside the window below which the
+        target counts as lost (as a fraction of 255)
+        """
+        self.model = model
+        self.rect = Rect(*rect)
+        self.method = method
+        self.margin = margin
+        self.min_mass = min_mass
+        self.lost = False
+        self.box = None
+
+    def update(self, frame):
+        """Track into `frame`; returns the new (x, y, w, h) or None while the target is lost."""
+        search = expand_rect(self.rect, self.margin, frame.shape) if not self.lost else None
+        if search is None:
+            search = Rect(0, 0, frame.shape[1], frame.shape[0])
+        ys, xs = rect_slices(search)
+        prob = self.model.back_project(frame[ys, xs])
+
+        # the window in search-region coordinates
+        window = clip_rect(Rect(self.rect.x - search.x, self.rect.y - search.y, self.rect.width, self.rect.height),
+                           prob.shape)
+        if window is None or self.lost:
+            window = Rect(0, 0, search.width, search.height)
+
+        if self.method == 'camshift':
+            box, window = cv2.CamShift(prob, tuple(window), TERM_CRITERIA)
+            self.box = ((box[0][0] + search.x, box[0][1] + search.y), box[1], box[2])
+        else:
+            _, window = cv2.meanShift(prob, tuple(window), TERM_CRITERIA)
+        window = Rect(*window)
+
+        inside = prob[rect_slices(window)] if window.width and window.height else prob[:0]
+        if inside.size == 0 or inside.mean() < self.min_mass * 255:
+            self.lost = True
+            return None
+
+        self.lost = False
+        self.rect = Rect(window.x + search.x, window.y + search.y, window.width, window.height)
+        return self.rect
+
+
+class SyntheticScene:
+    """A colored disc moving over `synthetic_image`, with the brightness drifting up and down."""
+
+    def __init__(self, size, radius=40, color=(40, 200, 60), seed=0):
+        self.background = synthetic_image(size, seed=seed)
+        self.radius = radius
+        self.color = color
+
+    def center(self, index):
+        height, width = self.background.shape[:2]
+        t = index / 40.0
+        return (int(width * (0.5 + 0.35 * np.cos(t))), int(height * (0.5 + 0.3 * np.sin(1.3 * t))))
+
+    def frame(self, index):
+        frame = self.background.copy()
+        cv2.circle(frame, self.center(index), self.radius, self.color, -1)
+        # lighting change: scale brightness between 0.6 and 1.3
+        gain = 0.95 + 0.35 * np.sin(index / 25.0)
+        return cv2.convertScaleAbs(frame, alpha=gain)
+
+    def initial_rect(self):
+        x, y = self.center(0)
+        r = self.radius
+        return Rect(x - r, y - r, 2 * r, 2 * r)
+
+
+def full_frame_camshift(model_hist, frame, window):
+    """What a tracker without the search window and lookup table does every frame."""
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    prob = cv2.calcBackProject([hsv], [0, 1], model_hist, [0, 180, 0, 256], 1)
+    _, window = cv2.CamShift(prob, tuple(window), TERM_CRITERIA)
+    return Rect(*window)
+
+
+def center_of(rect):
+    return np.array([rect.x + rect.width / 2.0, rect.y + rect.height / 2.0])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='camera index or video file, default is a synthetic scene')
+    parser.add_argument('--size', choices=list(SIZES), default='1080p')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--method', choices=['camshift', 'meanshift'], default='camshift')
+    parser.add_argument('--show', action='store_true')
+    args = parser.parse_args()
+
+    if args.video is not None:
+        cap = cv2.VideoCapture(int(args.video) if args.video.isdigit() else args.video)
+        ok, frame = cap.read()
+        if not ok:
+            parser.error('cannot read from %s' % args.video)
+        rect = Rect(*cv2.selectROI('select target', frame))
+        cv2.destroyWindow('select target')
+        if rect.width == 0 or rect.height == 0:
+            # selectROI returns an empty rectangle when the selection is cancelled
+            parser.error('no target selected')
+        tracker = BackProjectionTracker(ColorModel.from_region(frame, rect), rect, args.method)
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            found = tracker.update(frame)
+            if found is not None:
+                cv2.rectangle(frame, (found.x, found.y), (found.x + found.width, found.y + found.height), (0, 0, 255), 2)
+            cv2.imshow('tracking', frame)
+            if cv2.waitKey(1) & 0xff == 27:
+                break
+        cv2.destroyAllWindows()
+        return
+
+    scene = SyntheticScene(SIZES[args.size])
+    rect = scene.initial_rect()
+    model = ColorModel.from_region(scene.frame(0), rect)
+    tracker = BackProjectionTracker(model, rect, args.method)
+    full_window = rect
+    frames = [scene.frame(i) for i in range(args.frames)]
+
+    errors = []
+    lost = 0
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        found = tracker.update(frame)
+        if found is None:
+            lost += 1
+        else:
+            errors.append(np.linalg.norm(center_of(found) - scene.center(i)))
+        if args.show:
+            if found is not None:
+                cv2.rectangle(frame, (found.x, found.y), (found.x + found.width, found.y + found.height), (0, 0, 255), 2)
+            cv2.imshow('tracking', frame)
+            cv2.waitKey(1)
+    windowed = (time.perf_counter() - start) / len(frames)
+
+    full_errors = []
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        full_window = full_frame_camshift(model.hist, frame, full_window)
+        full_errors.append(np.linalg.norm(center_of(full_window) - scene.center(i)))
+    full = (time.perf_counter() - start) / len(frames)
+
+    print('%s frames, %s' % (args.size, args.method))
+    print('%-36s %10s %18s %6s' % ('', 'ms/frame', 'median error px', 'lost'))
+    print('%-36s %10.2f %18.1f %6d' % ('full frame, cvtColor + calcBackProject', full * 1e3, np.median(full_errors), 0))
+    print('%-36s %10.2f %18.1f %6d' % ('search window, lookup table', windowed * 1e3,
+                                       np.median(errors) if errors else float('nan'), lost))
+
+
+if __name__ == '__main__':
+    main()
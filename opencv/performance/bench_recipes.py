@@ -0,0 +1,374 @@
+"""
+Headless benchmark of the core operation of every recipe.
+
+Runs each operation on synthetic images of several sizes and dtypes without
+opening a window, and reports ops/sec, latency percentiles and peak memory.
+The results are written as JSON so two runs can be compared:
+
+    python bench_recipes.py --json before.json
+    python bench_recipes.py --json after.json --compare before.json
+
+`--compare` prints the speed ratio of every common case and exits with
+status 1 when one of them got slower than `--tolerance`.
+
+Peak memory is measured with `tracemalloc`, which sees the NumPy arrays
+OpenCV returns but not its internal scratch buffers.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+SIZES = {
+    'vga': (640, 480),
+    '1080p': (1920, 1080),
+    '4k': (3840, 2160),
+    '8k': (7680, 4320),
+}
+
+DTYPES = {
+    'uint8': np.uint8,
+    'uint16': np.uint16,
+    'float32': np.float32,
+}
+
+MAX_VALUES = {
+    np.uint8: 255,
+    np.uint16: 65535,
+    np.float32: 1.0,
+}
+
+
+def synthetic_image(size, dtype=np.uint8, channels=3, seed=0):
+    """
+    Deterministic test image: a smooth gradient with noise, filled shapes and
+    straight lines, so that edge detectors, Hough and histograms have
+    something to find.
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = 0.5 + 0.25 * np.sin(x / width * 6.0) * np.cos(y / height * 4.0)
+    image = np.repeat(base[:, :, None], 3, axis=2)
+    image[:, :, 1] *= 0.8
+    image[:, :, 2] = 1.0 - image[:, :, 2]
+
+    scale = max(width, height) / 640.0
+    for _ in range(12):
+        center = (int(rng.integers(width)), int(rng.integers(height)))
+        radius = int(rng.integers(10, 60) * scale)
+        color = rng.random(3).tolist()
+        cv2.circle(image, center, radius, color, -1)
+    for i in range(1, 10):
+        thickness = max(1, int(2 * scale))
+        cv2.line(image, (0, i * height // 10), (width - 1, i * height // 10), (0.0, 0.0, 0.0), thickness)
+        cv2.line(image, (i * width // 10, 0), (i * width // 10, height - 1), (0.0, 0.0, 0.0), thickness)
+
+    image += rng.normal(0, 0.03, image.shape).astype(np.float32)
+    np.clip(image, 0, 1, out=image)
+
+    if channels == 1:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    if dtype == np.float32:
+        return np.ascontiguousarray(image)
+    return (image * MAX_VALUES[dtype]).astype(dtype)
+
+
+# Every entry: name -> (channels, supported dtypes, setup)
+# `setup(image)` does the one-off work (kernels, matrices, objects) and
+# returns the zero-argument call that is timed.
+
+def _threshold(image):
+    thresh = MAX_VALUES[image.dtype.type] / 2
+    maxval = MAX_VALUES[image.dtype.type]
+    return lambda: cv2.threshold(image, thresh, maxval, cv2.THRESH_BINARY)
+
+
+def _adaptive_threshold(image):
+    return lambda: cv2.adaptiveThreshold(image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2)
+
+
+def _otsu(image):
+    return lambda: cv2.threshold(image, 0, MAX_VALUES[image.dtype.type], cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+
+
+def _blur(image):
+    return lambda: cv2.blur(image, (3, 3))
+
+
+def _gaussian_blur(image):
+    return lambda: cv2.GaussianBlur(image, (5, 5), 0)
+
+
+def _median_blur(image):
+    return lambda: cv2.medianBlur(image, 5)
+
+
+def _bilateral(image):
+    return lambda: cv2.bilateralFilter(image, 9, 24, 35)
+
+
+def _morphology(op):
+    def setup(image):
+        kernel = np.ones((5, 5), np.uint8)
+        return lambda: cv2.morphologyEx(image, op, kernel)
+    return setup
+
+
+def _canny(image):
+    return lambda: cv2.Canny(image, 100, 200)
+
+
+def _hough_lines(image):
+    edges = cv2.Canny(image, 50, 150, apertureSize=3)
+    return lambda: cv2.HoughLines(edges, 1, np.pi / 180, 200)
+
+
+def _hough_lines_p(image):
+    edges = cv2.Canny(image, 50, 150, apertureSize=3)
+    return lambda: cv2.HoughLinesP(edges, 1, np.pi / 180, 80, minLineLength=100, maxLineGap=10)
+
+
+def _warp_affine(image):
+    height, width = image.shape[:2]
+    M = cv2.getRotationMatrix2D((width / 2, height / 2), 30, 1.0)
+    return lambda: cv2.warpAffine(image, M, (width, height))
+
+
+def _warp_perspective(image):
+    height, width = image.shape[:2]
+    src = np.float32([[0.1 * width, 0.2 * height], [0.9 * width, 0.2 * height],
+                      [0.3 * width, 0.9 * height], [0.7 * width, 0.9 * height]])
+    dst = np.float32([[0, 0], [width, 0], [0, height], [width, height]])
+    M = cv2.getPerspectiveTransform(src, dst)
+    return lambda: cv2.warpPerspective(image, M, (width, height))
+
+
+def _resize(image):
+    return lambda: cv2.resize(image, None, fx=2, fy=2, interpolation=cv2.INTER_CUBIC)
+
+
+def _pyr_down(image):
+    return lambda: cv2.pyrDown(image)
+
+
+def _pyr_up(image):
+    small = cv2.pyrDown(image)
+    height, width = image.shape[:2]
+    return lambda: cv2.pyrUp(small, dstsize=(width, height))
+
+
+def _calc_hist(image):
+    upper = MAX_VALUES[image.dtype.type] + (1 if image.dtype != np.float32 else 0)
+    return lambda: cv2.calcHist([image], [0], None, [256], [0, upper])
+
+
+def _calc_hist_hs(image):
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    return lambda: cv2.calcHist([hsv], [0, 1], None, [180, 256], [0, 180, 0, 256])
+
+
+def _equalize_hist(image):
+    return lambda: cv2.equalizeHist(image)
+
+
+def _clahe(image):
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    return lambda: clahe.apply(image)
+
+
+def _cvt_color(code):
+    def setup(image):
+        return lambda: cv2.cvtColor(image, code)
+    return setup
+
+
+U8 = ('uint8',)
+U8_F32 = ('uint8', 'float32')
+ALL = ('uint8', 'uint16', 'float32')
+
+OPERATIONS = {
+    # image-thresholding
+    'threshold': (1, ALL, _threshold),
+    'adaptive_threshold': (1, U8, _adaptive_threshold),
+    'otsu': (1, ('uint8', 'uint16'), _otsu),
+    # smoothing-image
+    'blur': (3, ALL, _blur),
+    'gaussian_blur': (3, ALL, _gaussian_blur),
+    'median_blur': (3, ALL, _median_blur),
+    'bilateral': (3, U8_F32, _bilateral),
+    # morphology
+    'erode': (1, ALL, _morphology(cv2.MORPH_ERODE)),
+    'dilate': (1, ALL, _morphology(cv2.MORPH_DILATE)),
+    'morph_open': (1, ALL, _morphology(cv2.MORPH_OPEN)),
+    'morph_gradient': (1, ALL, _morphology(cv2.MORPH_GRADIENT)),
+    # canny-edge, hough-line
+    'canny': (1, U8, _canny),
+    'hough_lines': (1, U8, _hough_lines),
+    'hough_lines_p': (1, U8, _hough_lines_p),
+    # geometric-transform
+    'warp_affine': (3, ALL, _warp_affine),
+    'warp_perspective': (3, ALL, _warp_perspective),
+    'resize_cubic': (3, ALL, _resize),
+    # pyramids
+    'pyr_down': (3, ALL, _pyr_down),
+    'pyr_up': (3, ALL, _pyr_up),
+    # histograms
+    'calc_hist': (1, U8_F32, _calc_hist),
+    'calc_hist_hs': (3, U8, _calc_hist_hs),
+    'equalize_hist': (1, U8, _equalize_hist),
+    'clahe': (1, ('uint8', 'uint16'), _clahe),
+    # colorspaces
+    'bgr2gray': (3, ALL, _cvt_color(cv2.COLOR_BGR2GRAY)),
+    'bgr2hsv': (3, U8_F32, _cvt_color(cv2.COLOR_BGR2HSV)),
+}
+
+
+def measure(fn, min_time=0.5, min_iterations=3, max_iterations=1000, warmup=1):
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    start = time.perf_counter()
+    while len(timings) < max_iterations:
+        t0 = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - t0)
+        if len(timings) >= min_iterations and time.perf_counter() - start >= min_time:
+            break
+    return np.array(timings)
+
+
+def peak_memory(fn):
+    """Peak bytes allocated through the Python allocator (NumPy included) during one call."""
+    tracemalloc.start()
+    try:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak - before
+
+
+def run(operations, sizes, dtypes, min_time, seed=0):
+    results = []
+    images = {}
+
+    for size_name in sizes:
+        for dtype_name in dtypes:
+            for op_name in operations:
+                channels, supported, setup = OPERATIONS[op_name]
+                if dtype_name not in supported:
+                    continue
+
+                key = (size_name, dtype_name, channels)
+                if key not in images:
+                    images[key] = synthetic_image(SIZES[size_name], DTYPES[dtype_name], channels, seed)
+                fn = setup(images[key])
+                timings = measure(fn, min_time)
+                result = {
+                    'op': op_name,
+                    'size': size_name,
+                    'dtype': dtype_name,
+                    'channels': channels,
+                    'iterations': len(timings),
+                    'mean_ms': float(timings.mean() * 1e3),
+                    'p50_ms': float(np.percentile(timings, 50) * 1e3),
+                    'p90_ms': float(np.percentile(timings, 90) * 1e3),
+                    'p99_ms': float(np.percentile(timings, 99) * 1e3),
+                    'ops_per_sec': float(1.0 / timings.mean()),
+                    'peak_bytes': int(peak_memory(fn)),
+                }
+                results.append(result)
+                print('%-18s %-6s %-8s %10.3f ms p50 %10.3f ms p99 %10.1f ops/s %8.1f MiB' % (
+                    op_name, size_name, dtype_name, result['p50_ms'], result['p99_ms'],
+                    result['ops_per_sec'], result['peak_bytes'] / 2**20), flush=True)
+
+        # free the large images before the next size
+        images.clear()
+
+    return results
+
+
+def environment():
+    return {
+        'opencv': cv2.__version__,
+        'numpy': np.__version__,
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'opencv_threads': cv2.getNumThreads(),
+        'opencv_optimized': cv2.useOptimized(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def result_key(result):
+    return result['op'], result['size'], result['dtype']
+
+
+def compare(results, baseline, tolerance):
+    """Print old/new p50 ratios and return the cases slower than `1 + tolerance`."""
+    old = {result_key(r): r for r in baseline['results']}
+    regressions = []
+
+    print('%-18s %-6s %-8s %12s %12s %8s' % ('op', 'size', 'dtype', 'before ms', 'after ms', 'speedup'))
+    for result in results:
+        key = result_key(result)
+        if key not in old:
+            continue
+        speedup = old[key]['p50_ms'] / result['p50_ms']
+        flag = ''
+        if speedup < 1 / (1 + tolerance):
+            regressions.append(key)
+            flag = '  REGRESSION'
+        print('%-18s %-6s %-8s %12.3f %12.3f %7.2fx%s' % (
+            key[0], key[1], key[2], old[key]['p50_ms'], result['p50_ms'], speedup, flag))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', nargs='+', choices=sorted(OPERATIONS), default=list(OPERATIONS))
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=list(SIZES))
+    parser.add_argument('--dtypes', nargs='+', choices=list(DTYPES), default=['uint8', 'float32'])
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds spent timing each case')
+    parser.add_argument('--threads', type=int, help='cv2.setNumThreads')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='baseline JSON file from an earlier run')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='allowed slowdown before a case is flagged')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    results = run(args.ops, args.sizes, args.dtypes, args.min_time)
+    report = {'environment': environment(), 'results': results}
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print('%d case(s) slower than the baseline by more than %d%%' % (len(regressions), args.tolerance * 100))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
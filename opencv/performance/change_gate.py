@@ -0,0 +1,315 @@
+"""
+Skip the work for frames, or parts of frames, that did not change.
+
+`capture_camera.py` and `object_tracking.py` run `cvtColor`, `inRange` and
+`bitwise_and` on every camera frame, although a fixed camera mostly sees the
+same scene. `ChangeGate` compares every frame against what was last
+processed, at low resolution, and `GatedStage` runs the expensive chain only
+where something changed:
+
+- the frame is shrunk `downsample` times with INTER_AREA (which also averages
+  out sensor noise) and converted to gray; a cell changed when it differs
+  from the reference by more than `threshold` gray levels
+- the frame is split into `tile_size` tiles; a tile changed when more than
+  `min_changed` of its cells did
+- the reference of a tile is only updated when the tile is reported as
+  changed, so slow drift (lighting) accumulates until it crosses the
+  threshold instead of creeping through frame by frame
+- per tile, `GatedStage` reruns its function on the horizontal runs of
+  changed tiles (grown by `halo` pixels for neighbourhood operators such as
+  blur) and keeps the previous results everywhere else; per frame, it reruns
+  on the whole frame if any tile changed
+
+The outputs are buffers `GatedStage` reuses, copy them to keep a frame's
+results. `reset()` forces a full recompute, e.g. after a parameter change.
+The benchmark's mask mismatch against recomputing every frame is mostly
+sensor noise: pixels close to the `inRange` bounds flicker from frame to
+frame when recomputed, and keep their last value when gated.
+
+Usage:
+
+    python change_gate.py --size 1080p --frames 300     # synthetic fixed camera
+    python change_gate.py --video 0 --show
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+from roi_views import Rect, clip_rect, rect_slices
+
+
+class ChangeGate:
+    def __init__(self, tile_size=64, downsample=4, threshold=10, min_changed=0.02):
+        """
+        `tile_size`: side of the tiles in pixels, a multiple of `downsample`
+
+        `downsample`: shrink factor of the frames that are compared
+
+        `threshold`: gray level difference of a downsampled cell that counts as a change
+
+        `min_changed`: fraction of a tile's cells that must change for the tile to count as changed
+        """
+        if tile_size % downsample:
+            raise ValueError('tile_size %d is not a multiple of downsample %d' % (tile_size, downsample))
+        self.tile_size = tile_size
+        self.downsample = downsample
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.reference = None
+
+    def reset(self):
+        self.reference = None
+
+    def signature(self, frame):
+        """The downsampled gray frame that is compared."""
+        height, width = frame.shape[:2]
+        size = (max(width // self.downsample, 1), max(height // self.downsample, 1))
+        small = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    def grid_shape(self, shape):
+        height, width = shape[:2]
+        return -(-height // self.tile_size), -(-width // self.tile_size)
+
+    def _per_tile(self, cells):
+        """Sum of a cell-level array over every tile, shape `grid_shape`."""
+        cell = self.tile_size // self.downsample
+        rows, cols = -(-cells.shape[0] // cell), -(-cells.shape[1] // cell)
+        padded = np.zeros((rows * cell, cols * cell), np.float32)
+        padded[:cells.shape[0], :cells.shape[1]] = cells
+        return padded.reshape(rows, cell, cols, cell).sum(axis=(1, 3))
+
+    def update(self, frame):
+        """
+        Boolean array of `grid_shape(frame.shape)`, True for the tiles that
+        changed. Their reference becomes this frame. Every tile of the first
+        frame (or of a frame with a new size) counts as changed.
+        """
+        small = self.signature(frame)
+        rows, cols = self.grid_shape(frame.shape)
+        if self.reference is None or self.reference.shape != small.shape:
+            self.reference = small
+            # cells in each tile, edge tiles can be partial
+            self.cells_per_tile = self._per_tile(np.ones(small.shape, np.float32))
+            return np.ones((rows, cols), bool)
+
+        different = cv2.absdiff(small, self.reference) > self.threshold
+        changed = self._per_tile(different) > self.min_changed * self.cells_per_tile
+        if changed.shape != (rows, cols):
+            # the frame's last pixels, cut off by the downsampling, go with the tiles next to them
+            changed = np.pad(changed, ((0, rows - changed.shape[0]), (0, cols - changed.shape[1])), mode='edge')
+
+        if changed.any():
+            cell = self.tile_size // self.downsample
+            cell_mask = np.repeat(np.repeat(changed, cell, axis=0), cell, axis=1)
+            np.copyto(self.reference, small, where=cell_mask[:small.shape[0], :small.shape[1]])
+        return changed
+
+    def changed_rects(self, changed, shape):
+        """Rectangles covering the changed tiles, one per horizontal run of them."""
+        rects = []
+        for row in range(changed.shape[0]):
+            # starts and ends of the runs of True in this row
+            edges = np.flatnonzero(np.diff(np.concatenate(([0], changed[row].astype(np.int8), [0]))))
+            for start, end in zip(edges[::2], edges[1::2]):
+                rect = Rect(start * self.tile_size, row * self.tile_size,
+                            (end - start) * self.tile_size, self.tile_size)
+                rects.append(clip_rect(rect, shape))
+        return rects
+
+
+class GatedStage:
+    def __init__(self, fn, gate=None, per_tile=True, halo=0):
+        """
+        `fn`: `fn(frame)` returning an array, or a tuple of arrays, with the
+        frame's height and width
+
+        `per_tile`: rerun `fn` on the changed tiles only; False reruns it on
+        the whole frame whenever any tile changed
+
+        `halo`: pixels around each region that `fn` reads besides the region
+        itself, e.g. `ksize // 2` for a blur
+        """
+        self.fn = fn
+        self.gate = gate if gate is not None else ChangeGate()
+        self.per_tile = per_tile
+        self.halo = halo
+        self.outputs = None
+        self.single = False
+
+        self.frames = 0
+        self.skipped_frames = 0
+        self.pixels = 0
+        self.processed_pixels = 0
+
+    def reset(self):
+        self.gate.reset()
+        self.outputs = None
+
+    def __call__(self, frame):
+        height, width = frame.shape[:2]
+        changed = self.gate.update(frame)
+        self.frames += 1
+        self.pixels += height * width
+
+        if self.outputs is None or self.outputs[0].shape[:2] != (height, width) or changed.all():
+            self._store(self.fn(frame))
+            self.processed_pixels += height * width
+        elif not changed.any():
+            self.skipped_frames += 1
+        elif not self.per_tile:
+            self._store(self.fn(frame))
+            self.processed_pixels += height * width
+        else:
+            for rect in self.gate.changed_rects(changed, frame.shape):
+                self._run_region(frame, rect)
+        return self.outputs[0] if self.single else self.outputs
+
+    def _store(self, results):
+        self.single = not isinstance(results, tuple)
+        self.outputs = (results,) if self.single else results
+
+    def _run_region(self, frame, rect):
+        h = self.halo
+        grown = clip_rect(Rect(rect.x - h, rect.y - h, rect.width + 2 * h, rect.height + 2 * h), frame.shape)
+        results = self.fn(frame[rect_slices(grown)])
+        if self.single:
+            results = (results,)
+        # the region inside the grown region's results
+        inner = rect_slices(Rect(rect.x - grown.x, rect.y - grown.y, rect.width, rect.height))
+        target = rect_slices(rect)
+        for output, result in zip(self.outputs, results):
+            output[target] = result[inner]
+        self.processed_pixels += grown.width * grown.height
+
+    @property
+    def skipped_fraction(self):
+        """Fraction of the pixels the stage did not have to process (halos count as processed)."""
+        return 1.0 - self.processed_pixels / self.pixels if self.pixels else 0.0
+
+    def report(self):
+        return {
+            'frames': self.frames,
+            'skipped_frames': self.skipped_frames,
+            'skipped_fraction': self.skipped_fraction,
+        }
+
+
+def hsv_mask(frame, lower=(10, 100, 100), upper=(245, 255, 255), blur=0):
+    """`object_tracking.py`'s chain, optionally after a `blur` x `blur` Gaussian. Returns (mask, res)."""
+    if blur:
+        frame = cv2.GaussianBlur(frame, (blur, blur), 0)
+    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    mask = cv2.inRange(hsv, lower, upper)
+    return mask, cv2.bitwise_and(frame, frame, mask=mask)
+
+
+class StaticCamera:
+    """
+    A fixed camera: a static scene with sensor noise, a disc that moves
+    through part of the frames, and a slow brightness drift.
+    """
+
+    def __init__(self, size, noise=2.0, seed=0):
+        self.background = synthetic_image(size, seed=seed)
+        rng = np.random.default_rng(seed)
+        height, width = self.background.shape[:2]
+        # a few noise frames, cycled, generating fresh noise would dominate the timing
+        self.noise = [rng.normal(0, noise, (height, width, 3)).astype(np.int16) for _ in range(4)]
+
+    def frame(self, index):
+        height, width = self.background.shape[:2]
+        frame = cv2.add(self.background.astype(np.int16), self.noise[index % len(self.noise)])
+        # the disc crosses the frame during 40 of every 100 frames
+        phase = index % 100
+        if phase < 40:
+            center = (int(width * (0.1 + 0.8 * phase / 40.0)), height // 2)
+            cv2.circle(frame, center, height // 12, (30, 160, 220), -1)
+        # brightness drifts by up to 8 gray levels
+        gain = 1.0 + 0.03 * np.sin(index / 150.0)
+        return cv2.convertScaleAbs(frame, alpha=gain)
+
+
+def run(stage, frames):
+    """Seconds per frame and the mask of every frame (copied)."""
+    masks = []
+    seconds = 0.0
+    for frame in frames:
+        start = time.perf_counter()
+        mask, _ = stage(frame)
+        seconds += time.perf_counter() - start
+        masks.append(mask.copy())
+    return seconds / len(frames), masks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--video', help='camera index or video file, default is a synthetic fixed camera')
+    parser.add_argument('--size', choices=list(SIZES), default='1080p')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--tile-size', type=int, default=64)
+    parser.add_argument('--downsample', type=int, default=4)
+    parser.add_argument('--threshold', type=int, default=10, help='gray levels')
+    parser.add_argument('--min-changed', type=float, default=0.02, help='fraction of a tile')
+    parser.add_argument('--blur', type=int, default=5, help='Gaussian kernel before the HSV mask, 0 for none')
+    parser.add_argument('--show', action='store_true')
+    args = parser.parse_args()
+
+    def make_gate():
+        return ChangeGate(args.tile_size, args.downsample, args.threshold, args.min_changed)
+
+    def chain(frame):
+        return hsv_mask(frame, blur=args.blur)
+
+    halo = args.blur // 2
+
+    if args.video is not None:
+        cap = cv2.VideoCapture(int(args.video) if args.video.isdigit() else args.video)
+        stage = GatedStage(chain, make_gate(), halo=halo)
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            mask, res = stage(frame)
+            if args.show:
+                cv2.imshow('mask', mask)
+                cv2.imshow('res', res)
+                if cv2.waitKey(1) & 0xff == 27:
+                    break
+        cap.release()
+        cv2.destroyAllWindows()
+        print('%d frames, %d skipped entirely, %.1f%% of the work skipped' % (
+            stage.frames, stage.skipped_frames, 100 * stage.skipped_fraction))
+        return
+
+    camera = StaticCamera(SIZES[args.size])
+    frames = [camera.frame(i) for i in range(args.frames)]
+
+    reference_seconds, reference_masks = run(chain, frames)
+    print('%s, %d frames, tiles %d px, downsample %d, threshold %d, min changed %.2f' % (
+        args.size, args.frames, args.tile_size, args.downsample, args.threshold, args.min_changed))
+    print('%-10s %10s %9s %15s %14s %16s' % ('gating', 'ms/frame', 'speedup', 'frames skipped', 'work skipped',
+                                            'mask mismatch %'))
+    print('%-10s %10.2f %8.2fx %15s %14s %16s' % ('none', reference_seconds * 1e3, 1.0, '-', '-', '-'))
+    for name, per_tile in (('per frame', False), ('per tile', True)):
+        stage = GatedStage(chain, make_gate(), per_tile=per_tile, halo=halo)
+        seconds, masks = run(stage, frames)
+        # pixels where the reused results differ from computing every frame
+        mismatch = np.mean([np.count_nonzero(a != b) / a.size for a, b in zip(masks, reference_masks)])
+        print('%-10s %10.2f %8.2fx %15d %13.1f%% %16.3f' % (
+            name, seconds * 1e3, reference_seconds / seconds, stage.skipped_frames,
+            100 * stage.skipped_fraction, 100 * mismatch))
+        if args.show:
+            cv2.imshow(name, masks[-1])
+    if args.show:
+        cv2.waitKey(0)
+        cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
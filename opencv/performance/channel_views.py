@@ -0,0 +1,187 @@
+"""
+Channel access without copies.
+
+`02_core-operations/basic-operations/split_n_merge.py` uses `cv2.split` and
+three `img.copy()` calls to zero one channel each, and `access_modify.py`
+reads and writes pixels one at a time with `item`/`itemset`. The helpers here
+do the same through NumPy views, broadcasting and fancy indexing:
+
+- `channel`/`channels` return strided views instead of the copies `cv2.split` makes
+- `zero_channels`/`scale_channels` modify an image in place
+- `without_channels` writes into a reusable output buffer when the original must stay intact
+- `get_pixels`/`set_pixels` read and write many pixels at once by coordinate arrays
+
+Usage (copy and allocation savings):
+
+    python channel_views.py --size 4k
+"""
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+BLUE = 0
+GREEN = 1
+RED = 2
+
+
+def channel(img, index):
+    """View of one channel, writes go to `img`."""
+    return img[:, :, index]
+
+
+def channels(img):
+    """Views of all channels, what `cv2.split` returns but without copying."""
+    return tuple(img[:, :, i] for i in range(img.shape[2]))
+
+
+def zero_channels(img, indices):
+    """Set the given channel(s) of `img` to 0 in place."""
+    img[:, :, indices] = 0
+    return img
+
+
+def scale_channels(img, factors):
+    """
+    Multiply every channel by its factor in place, `factors` broadcasts over
+    the last axis. Integer results are rounded and saturated like cv2
+    arithmetic (200 * 1.5 is 255 in uint8, not 44).
+    """
+    num_channels = img.shape[2] if img.ndim == 3 else 1
+    factors = np.broadcast_to(np.asarray(factors, dtype=np.float64), (num_channels,))
+    if (num_channels <= 4 and img.flags.c_contiguous
+            and img.dtype in (np.uint8, np.int8, np.uint16, np.int16, np.int32, np.float32, np.float64)):
+        # a Scalar holds up to four per-channel factors; cv2 cannot write into
+        # strided views such as `channel(img, 1)`, those take the NumPy path
+        cv2.multiply(img, tuple(factors) + (0.0,) * (4 - num_channels), dst=img)
+    elif np.issubdtype(img.dtype, np.integer):
+        info = np.iinfo(img.dtype)
+        img[...] = np.clip(np.rint(img * factors), info.min, info.max)
+    else:
+        np.multiply(img, factors, out=img, casting='unsafe')
+    return img
+
+
+def without_channels(img, indices, out=None):
+    """
+    Copy of `img` with the given channel(s) zeroed. Pass the previous result
+    as `out` to reuse its buffer instead of allocating a new image.
+    """
+    if out is None:
+        out = np.empty_like(img)
+    np.copyto(out, img)
+    out[:, :, indices] = 0
+    return out
+
+
+def get_pixels(img, ys, xs, channel_index=None):
+    """Values at `(ys[i], xs[i])`, one row per coordinate (or one value if `channel_index` is given)."""
+    if channel_index is None:
+        return img[ys, xs]
+    return img[ys, xs, channel_index]
+
+
+def set_pixels(img, ys, xs, values, channel_index=None):
+    """Write `values` at `(ys[i], xs[i])`; `values` can be one value, one per pixel or one per channel."""
+    if channel_index is None:
+        img[ys, xs] = values
+    else:
+        img[ys, xs, channel_index] = values
+
+
+def check_scale_channels():
+    """`scale_channels` saturates the same on whole images and on the strided views `channel` returns."""
+    img = np.full((4, 4, 3), 200, np.uint8)
+    scale_channels(img, 1.5)
+    assert (img == 255).all()
+
+    img = np.full((4, 4, 3), 200, np.uint8)
+    scale_channels(channel(img, GREEN), 1.5)
+    assert (img[:, :, GREEN] == 255).all() and (img[:, :, [BLUE, RED]] == 200).all()
+    scale_channels(img[:, :, :2], (0.5, 2.0))
+    assert (img[:, :, BLUE] == 100).all() and (img[:, :, GREEN] == 255).all() and (img[:, :, RED] == 200).all()
+
+
+def measure(fn, repeat=20):
+    fn()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat, peak - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=list(SIZES), default='4k')
+    parser.add_argument('--num-pixels', type=int, default=10000)
+    args = parser.parse_args()
+
+    check_scale_channels()
+    rng = np.random.default_rng(0)
+    width, height = SIZES[args.size]
+    img = synthetic_image(SIZES[args.size])
+    out = np.empty_like(img)
+
+    def split_and_copy():
+        b, g, r = cv2.split(img)
+        no_red = img.copy()
+        no_red[:, :, 2] = 0
+        no_blue = img.copy()
+        no_blue[:, :, 0] = 0
+        no_green = img.copy()
+        no_green[:, :, 1] = 0
+
+    outputs = [np.empty_like(img) for _ in range(3)]
+
+    def views_and_reused_buffers():
+        b, g, r = channels(img)
+        without_channels(img, RED, out=outputs[0])
+        without_channels(img, BLUE, out=outputs[1])
+        without_channels(img, GREEN, out=outputs[2])
+
+    def in_place():
+        out[:] = img
+        zero_channels(out, RED)
+
+    cases = [
+        ('cv2.split + 3 copies', split_and_copy),
+        ('views + reused buffers', views_and_reused_buffers),
+        ('zero one channel in place', in_place),
+    ]
+
+    ys = rng.integers(height, size=args.num_pixels)
+    xs = rng.integers(width, size=args.num_pixels)
+
+    def per_pixel():
+        for y, x in zip(ys.tolist(), xs.tolist()):
+            v = img[y, x, 2]
+            out[y, x, 2] = v
+
+    def fancy_index():
+        set_pixels(out, ys, xs, get_pixels(img, ys, xs, RED), RED)
+
+    cases += [
+        ('%d pixels one by one' % args.num_pixels, per_pixel),
+        ('%d pixels fancy indexing' % args.num_pixels, fancy_index),
+    ]
+
+    print('%s image (%dx%d)' % (args.size, width, height))
+    print('%-32s %12s %16s' % ('case', 'ms', 'allocated MiB'))
+    for name, fn in cases:
+        seconds, allocated = measure(fn)
+        print('%-32s %12.3f %16.2f' % (name, seconds * 1e3, allocated / 2**20))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+`cv2.filter2D` front end that picks the convolution method from the kernel.
+
+`03_image-processing/smoothing-image/filter_2d.py` convolves with a dense
+`np.ones((4, 4)) / 25` through `cv2.filter2D`. `filter2d` takes the same
+arguments and looks at the kernel first:
+
+- 'separable': a rank-1 kernel (box, Gaussian, Sobel, ...), found through its
+  SVD, runs as two 1D passes with `cv2.sepFilter2D`, O(kh + kw) per pixel
+  instead of O(kh * kw)
+- 'fft': kernels of `FFT_MIN_KERNEL_SIZE` and more are correlated with the
+  padded image in the frequency domain, one `cv2.dft` per channel
+- 'direct': everything else goes to `cv2.filter2D`; 8-bit images with
+  kernels of `FLOAT_MIN_KERNEL_SIZE` and more are filtered as float32 first,
+  which is faster than cv2's own 8-bit path for large kernels
+
+Results agree with `cv2.filter2D` up to float rounding (at most 1 for
+integer images). cv2.filter2D itself already switches to a tiled DFT for
+kernels from about 11x11 on, so the whole-image FFT only pays off for very
+large kernels; the benchmark prints every method's time per kernel and image
+size, and where each one starts to win on this machine.
+
+Usage:
+
+    python convolution.py --sizes vga 1080p --kernels 3 7 15 31 63 127 201
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+# larger kernel side from which the whole-image DFT beat cv2.filter2D on a
+# 1080p float image, measured with this script's benchmark
+FFT_MIN_KERNEL_SIZE = 201
+# larger kernel side from which filtering 8-bit 1080p images as float32 was faster
+FLOAT_MIN_KERNEL_SIZE = 15
+# second singular value relative to the first below which a kernel counts as rank 1
+SEPARABLE_TOLERANCE = 1e-6
+
+DEPTHS = {
+    cv2.CV_8U: np.uint8,
+    cv2.CV_16U: np.uint16,
+    cv2.CV_16S: np.int16,
+    cv2.CV_32F: np.float32,
+    cv2.CV_64F: np.float64,
+}
+
+
+def separable_factors(kernel, tolerance=SEPARABLE_TOLERANCE):
+    """(kernel_x, kernel_y) with `kernel = outer(kernel_y, kernel_x)`, or None if the kernel is not rank 1."""
+    kernel = np.asarray(kernel, dtype=np.float64)
+    if kernel.shape[0] == 1:
+        return kernel[0], np.ones(1)
+    if kernel.shape[1] == 1:
+        return np.ones(1), kernel[:, 0]
+    u, s, vt = np.linalg.svd(kernel)
+    if s[0] == 0 or s[1] > tolerance * s[0]:
+        return None
+    scale = np.sqrt(s[0])
+    return vt[0] * scale, u[:, 0] * scale
+
+
+def choose_method(kernel, separable=None):
+    if separable is None:
+        separable = separable_factors(kernel)
+    if separable is not None:
+        return 'separable'
+    if max(kernel.shape) >= FFT_MIN_KERNEL_SIZE:
+        return 'fft'
+    return 'direct'
+
+
+def output_dtype(src, ddepth):
+    return src.dtype if ddepth < 0 else np.dtype(DEPTHS[ddepth])
+
+
+def convert_result(result, dtype):
+    """Round and saturate like cv2 when the output is an integer type."""
+    if np.issubdtype(dtype, np.integer):
+        info = np.iinfo(dtype)
+        return np.clip(np.rint(result), info.min, info.max).astype(dtype)
+    return result.astype(dtype, copy=False)
+
+
+def fft_filter2d(src, kernel, anchor=(-1, -1), border_type=cv2.BORDER_DEFAULT):
+    """Correlation of `src` with `kernel` (what filter2D computes) through `cv2.dft`, as float32/float64."""
+    kernel_height, kernel_width = kernel.shape
+    anchor_x = kernel_width // 2 if anchor[0] < 0 else anchor[0]
+    anchor_y = kernel_height // 2 if anchor[1] < 0 else anchor[1]
+
+    work_dtype = np.float64 if src.dtype == np.float64 else np.float32
+    image = src.astype(work_dtype, copy=False)
+    padded = cv2.copyMakeBorder(image, anchor_y, kernel_height - 1 - anchor_y,
+                                anchor_x, kernel_width - 1 - anchor_x, border_type)
+    if padded.ndim == 2:
+        padded = padded[:, :, None]
+    padded_height, padded_width, num_channels = padded.shape
+    dft_height = cv2.getOptimalDFTSize(padded_height)
+    dft_width = cv2.getOptimalDFTSize(padded_width)
+
+    kernel_padded = np.zeros((dft_height, dft_width), work_dtype)
+    kernel_padded[:kernel_height, :kernel_width] = kernel
+    kernel_spectrum = cv2.dft(kernel_padded, flags=cv2.DFT_COMPLEX_OUTPUT, nonzeroRows=kernel_height)
+
+    height, width = src.shape[:2]
+    out = np.empty((height, width, num_channels), work_dtype)
+    buffer = np.zeros((dft_height, dft_width), work_dtype)
+    for c in range(num_channels):
+        buffer[:padded_height, :padded_width] = padded[:, :, c]
+        spectrum = cv2.dft(buffer, flags=cv2.DFT_COMPLEX_OUTPUT, nonzeroRows=padded_height)
+        # multiplying by the conjugate turns the convolution into a correlation
+        product = cv2.mulSpectrums(spectrum, kernel_spectrum, 0, conjB=True)
+        result = cv2.idft(product, flags=cv2.DFT_SCALE | cv2.DFT_REAL_OUTPUT)
+        out[:, :, c] = result[:height, :width]
+    return out[:, :, 0] if src.ndim == 2 else out
+
+
+def filter2d(src, ddepth, kernel, anchor=(-1, -1), delta=0, borderType=cv2.BORDER_DEFAULT, method=None):
+    """
+    Drop-in for `cv2.filter2D(src, ddepth, kernel, anchor=..., delta=...,
+    borderType=...)`. `method` forces 'separable', 'fft' or 'direct'.
+    """
+    kernel = np.asarray(kernel, dtype=np.float32 if src.dtype != np.float64 else np.float64)
+    anchor = tuple(anchor)
+    separable = separable_factors(kernel) if method in (None, 'separable') else None
+    if method is None:
+        method = choose_method(kernel, separable)
+    # cv2.copyMakeBorder has no BORDER_ISOLATED, leave those to cv2
+    if method == 'fft' and borderType & cv2.BORDER_ISOLATED:
+        method = 'direct'
+
+    if method == 'separable':
+        if separable is None:
+            raise ValueError('kernel is not separable')
+        kernel_x, kernel_y = separable
+        return cv2.sepFilter2D(src, ddepth, kernel_x.astype(kernel.dtype), kernel_y.astype(kernel.dtype),
+                               anchor=anchor, delta=delta, borderType=borderType)
+
+    dtype = output_dtype(src, ddepth)
+    if method == 'fft':
+        return convert_result(fft_filter2d(src, kernel, anchor, borderType) + delta, dtype)
+
+    if src.dtype == np.uint8 and max(kernel.shape) >= FLOAT_MIN_KERNEL_SIZE:
+        return float_filter2d(src, ddepth, kernel, anchor, delta, borderType)
+    return cv2.filter2D(src, ddepth, kernel, anchor=anchor, delta=delta, borderType=borderType)
+
+
+def float_filter2d(src, ddepth, kernel, anchor=(-1, -1), delta=0, borderType=cv2.BORDER_DEFAULT):
+    """`cv2.filter2D` on a float32 copy of `src`, converted back to the output depth."""
+    result = cv2.filter2D(src.astype(np.float32), -1, kernel, anchor=anchor, delta=delta, borderType=borderType)
+    return convert_result(result, output_dtype(src, ddepth))
+
+
+def gaussian_2d(size):
+    kernel = cv2.getGaussianKernel(size, -1)
+    return (kernel * kernel.T).astype(np.float32)
+
+
+def random_kernel(size, seed=0):
+    kernel = np.random.default_rng(seed).random((size, size), dtype=np.float32)
+    return kernel / kernel.sum()
+
+
+def timed(fn, repeat):
+    result = fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat, result
+
+
+def max_difference(a, b):
+    return float(np.abs(a.astype(np.float64) - b.astype(np.float64)).max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', nargs='+', choices=list(SIZES), default=['vga', '1080p'])
+    parser.add_argument('--kernels', nargs='+', type=int, default=[3, 7, 15, 31, 63, 127, 201])
+    parser.add_argument('--repeat', type=int, default=2)
+    args = parser.parse_args()
+
+    print('%-6s %-9s %7s %11s %11s %11s %11s %10s %9s' % (
+        'image', 'kernel', 'size', 'filter2D', 'separable', 'float32', 'fft', 'chosen', 'max diff'))
+    for size in args.sizes:
+        img = synthetic_image(SIZES[size])
+        # smallest kernel size from which each method won at every larger size tested
+        wins = {}
+        for kernel_size in args.kernels:
+            for kind, kernel in (('gaussian', gaussian_2d(kernel_size)), ('dense', random_kernel(kernel_size))):
+                reference_time, reference = timed(lambda: cv2.filter2D(img, -1, kernel), args.repeat)
+                times = {}
+                if kind == 'gaussian':
+                    times['separable'] = timed(lambda: filter2d(img, -1, kernel, method='separable'), args.repeat)[0]
+                else:
+                    times['float32'] = timed(lambda: float_filter2d(img, -1, kernel), args.repeat)[0]
+                    times['fft'] = timed(lambda: filter2d(img, -1, kernel, method='fft'), args.repeat)[0]
+                result = filter2d(img, -1, kernel)
+
+                for method, seconds in times.items():
+                    if seconds >= reference_time:
+                        wins[method] = None
+                    elif wins.get(method) is None:
+                        wins[method] = kernel_size
+                print('%-6s %-9s %7d %11.1f %11s %11s %11s %10s %9.3g' % (
+                    size, kind, kernel_size, reference_time * 1e3,
+                    *('%.1f' % (times[m] * 1e3) if m in times else '-' for m in ('separable', 'float32', 'fft')),
+                    choose_method(kernel), max_difference(reference, result)))
+        for method in ('separable', 'float32', 'fft'):
+            print('%s: %s faster than filter2D from kernel size %s' % (size, method, wins.get(method) or '- (not within the sizes tested)'))
+
+
+if __name__ == '__main__':
+    main()
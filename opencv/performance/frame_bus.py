@@ -0,0 +1,319 @@
+"""
+One camera, many consumer processes: a frame ring in shared memory.
+
+Tracking, recording (`save_video.py`) and display all want the same camera
+frames, and separate processes would otherwise each open
+`cv2.VideoCapture(0)` or receive pickled frames over a pipe. Here a single
+producer publishes into a `multiprocessing.shared_memory` ring of
+`num_slots` frames and consumers attach to it by name:
+
+- every frame gets a sequence number, written to its slot after the pixels,
+  so a consumer can tell which frame a slot holds and whether the producer
+  overwrote it while the consumer was reading
+- `read` returns a zero-copy NumPy view into the ring; `is_current(seq)`
+  tells whether that view still holds frame `seq` once the consumer is done
+  with it (copy the view first if the work takes longer than the ring lasts)
+- a consumer that falls `max_lag` frames behind (half the ring by default)
+  is a slow consumer: the frames it missed are counted in `dropped` and it
+  continues from the newest frame, so the frame it reads stays in the ring
+  for at least another half ring instead of being the next one overwritten
+- `SyntheticSource` stands in for `cv2.VideoCapture`, so everything runs
+  without a camera
+
+There are no locks, the producer never waits for consumers.
+
+Usage:
+
+    python frame_bus.py --consumers 3 --slow-consumer --frames 300
+    python frame_bus.py --camera 0
+"""
+import argparse
+import multiprocessing as mp
+import sys
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import cv2
+import numpy as np
+
+HEADER_FIELDS = ['last_seq', 'closed', 'num_slots', 'height', 'width', 'channels', 'dtype']
+HEADER_BYTES = 64
+ALIGNMENT = 64
+
+
+def _align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _layout(num_slots, frame_bytes):
+    slot_seq = HEADER_BYTES
+    slot_time = slot_seq + 8 * num_slots
+    frames = _align(slot_time + 8 * num_slots)
+    return slot_seq, slot_time, frames, frames + num_slots * _align(frame_bytes)
+
+
+class FrameBus:
+    """Use `FrameBus.create` in the producer and `FrameBus.attach` in consumers."""
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self.owner = owner
+        buf = shm.buf
+        self.header = np.ndarray(len(HEADER_FIELDS), np.int64, buf)
+        _, _, num_slots, height, width, channels, dtype = self.header
+        self.num_slots = int(num_slots)
+        self.dtype = np.dtype(chr(dtype))
+        self.shape = (int(height), int(width)) + ((int(channels),) if channels else ())
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+
+        slot_seq, slot_time, frames, _ = _layout(self.num_slots, frame_bytes)
+        self.slot_seq = np.ndarray(self.num_slots, np.int64, buf, slot_seq)
+        self.slot_time = np.ndarray(self.num_slots, np.float64, buf, slot_time)
+        stride = _align(frame_bytes)
+        self.slots = [np.ndarray(self.shape, self.dtype, buf, frames + i * stride) for i in range(self.num_slots)]
+
+        # consumer side
+        self.max_lag = max(1, self.num_slots // 2)
+        self.next_seq = None
+        self.read_count = 0
+        self.dropped = 0
+
+    @classmethod
+    def create(cls, name, shape, dtype=np.uint8, num_slots=8):
+        shape = tuple(shape)
+        dtype = np.dtype(dtype)
+        frame_bytes = int(np.prod(shape)) * dtype.itemsize
+        size = _layout(num_slots, frame_bytes)[-1]
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        header = np.ndarray(len(HEADER_FIELDS), np.int64, shm.buf)
+        channels = shape[2] if len(shape) == 3 else 0
+        header[:] = [-1, 0, num_slots, shape[0], shape[1], channels, ord(dtype.char)]
+        del header
+
+        bus = cls(shm, owner=True)
+        bus.slot_seq[:] = -1
+        return bus
+
+    @classmethod
+    def attach(cls, name):
+        if sys.version_info >= (3, 13):
+            return cls(shared_memory.SharedMemory(name=name, track=False), owner=False)
+
+        # before 3.13 attaching registers the segment with this process's
+        # resource tracker, which unlinks it when the process exits. Children
+        # started by multiprocessing share the producer's tracker (where the
+        # segment is registered already), other processes have their own and
+        # must unregister
+        own_tracker = getattr(resource_tracker._resource_tracker, '_fd', None) is None
+        shm = shared_memory.SharedMemory(name=name)
+        if own_tracker:
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def last_seq(self):
+        return int(self.header[0])
+
+    @property
+    def closed(self):
+        return bool(self.header[1])
+
+    # producer
+
+    def slot_for(self, seq):
+        return self.slots[seq % self.num_slots]
+
+    def begin(self):
+        """Writable view of the slot for the next frame, e.g. for `capture.read(view)`."""
+        seq = self.last_seq + 1
+        # readers of the frame about to be overwritten see that the slot changed
+        self.slot_seq[seq % self.num_slots] = -1
+        return seq, self.slot_for(seq)
+
+    def commit(self, seq):
+        slot = seq % self.num_slots
+        self.slot_time[slot] = time.time()
+        self.slot_seq[slot] = seq
+        self.header[0] = seq
+
+    def publish(self, frame):
+        seq, view = self.begin()
+        np.copyto(view, frame)
+        self.commit(seq)
+        return seq
+
+    def publish_from(self, capture):
+        """Read the next frame from `capture` straight into the ring. Returns its sequence number or None."""
+        seq, view = self.begin()
+        ok, frame = capture.read(view)
+        if not ok:
+            return None
+        if frame is not view and not np.shares_memory(frame, view):
+            np.copyto(view, frame)
+        self.commit(seq)
+        return seq
+
+    def close(self):
+        """Producer: tell consumers no more frames will come, then release the segment."""
+        if self.owner:
+            self.header[1] = 1
+        self.release()
+
+    def release(self):
+        del self.header, self.slot_seq, self.slot_time, self.slots
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    # consumer
+
+    def is_current(self, seq):
+        """True while the slot still holds frame `seq`."""
+        return int(self.slot_seq[seq % self.num_slots]) == seq
+
+    def read(self, timeout=None, poll_interval=0.0005):
+        """
+        Wait for the next frame and return `(seq, view, timestamp)`, or None
+        if the producer closed the bus or `timeout` seconds passed.
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while True:
+            last = self.last_seq
+            if self.next_seq is None and last >= 0:
+                # first read starts from the newest frame
+                self.next_seq = last
+            if self.next_seq is not None and last >= self.next_seq:
+                if last - self.next_seq >= self.max_lag:
+                    # slow consumer: the older frames are gone or about to be, skip to the newest
+                    self.dropped += last - self.next_seq
+                    self.next_seq = last
+                seq = self.next_seq
+                slot = seq % self.num_slots
+                timestamp = float(self.slot_time[slot])
+                if int(self.slot_seq[slot]) == seq:
+                    self.next_seq = seq + 1
+                    self.read_count += 1
+                    return seq, self.slots[slot], timestamp
+                # overwritten between the checks, catch up on the next pass
+                continue
+            if self.closed:
+                return None
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            time.sleep(poll_interval)
+
+
+class SyntheticSource:
+    """`cv2.VideoCapture` stand-in: a moving disc and the frame number, at `fps` frames per second."""
+
+    def __init__(self, width=640, height=480, fps=30.0, num_frames=None):
+        self.width = width
+        self.height = height
+        self.interval = 1.0 / fps if fps else 0.0
+        self.num_frames = num_frames
+        self.index = 0
+        self.next_time = time.perf_counter()
+
+    def isOpened(self):
+        return self.num_frames is None or self.index < self.num_frames
+
+    def read(self, image=None):
+        if not self.isOpened():
+            return False, None
+        wait = self.next_time - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        self.next_time = max(self.next_time + self.interval, time.perf_counter())
+
+        if image is None:
+            image = np.empty((self.height, self.width, 3), np.uint8)
+        image[:] = (40, 40, 40)
+        t = self.index / 30.0
+        center = (int(self.width * (0.5 + 0.35 * np.cos(t))), int(self.height * (0.5 + 0.35 * np.sin(t))))
+        cv2.circle(image, center, self.height // 10, (255, 0, 0), -1)
+        cv2.putText(image, str(self.index), (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (255, 255, 255), 2)
+        self.index += 1
+        return True, image
+
+    def release(self):
+        pass
+
+
+def consumer(name, label, work_seconds, results):
+    """Reads until the bus closes, spending `work_seconds` per frame, and reports its statistics."""
+    bus = FrameBus.attach(name)
+    latencies = []
+    overwritten = 0
+    while True:
+        item = bus.read(timeout=5.0)
+        if item is None:
+            break
+        seq, frame, timestamp = item
+        latencies.append(time.time() - timestamp)
+        frame.mean()
+        if work_seconds:
+            time.sleep(work_seconds)
+        if not bus.is_current(seq):
+            overwritten += 1
+    results.put((label, bus.read_count, bus.dropped, overwritten, np.median(latencies) * 1e3 if latencies else 0.0))
+    bus.release()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--camera', type=int, help='camera index, default is a synthetic source')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--fps', type=float, default=60.0)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--slots', type=int, default=8)
+    parser.add_argument('--consumers', type=int, default=3)
+    parser.add_argument('--slow-consumer', action='store_true', help='add a consumer that takes 50 ms per frame')
+    args = parser.parse_args()
+
+    if args.camera is not None:
+        source = cv2.VideoCapture(args.camera)
+        ok, first = source.read()
+        if not ok:
+            parser.error('cannot read from camera %d' % args.camera)
+        shape = first.shape
+    else:
+        source = SyntheticSource(args.width, args.height, args.fps, args.frames)
+        shape = (args.height, args.width, 3)
+
+    bus = FrameBus.create('frame_bus_%d' % mp.current_process().pid, shape, num_slots=args.slots)
+    context = mp.get_context('spawn')
+    results = context.Queue()
+    workers = [('consumer %d' % i, 0.0) for i in range(args.consumers)]
+    if args.slow_consumer:
+        workers.append(('slow consumer', 0.05))
+    processes = [context.Process(target=consumer, args=(bus.name, label, work, results)) for label, work in workers]
+    for p in processes:
+        p.start()
+    # give the consumers time to attach before the first frame
+    time.sleep(1.0)
+
+    start = time.perf_counter()
+    published = 0
+    while published < args.frames and bus.publish_from(source) is not None:
+        published += 1
+    seconds = time.perf_counter() - start
+    bus.close()
+    source.release()
+
+    print('published %d frames of %s in %.2f s (%.1f fps)' % (published, shape, seconds, published / seconds))
+    print('%-16s %8s %8s %12s %16s' % ('consumer', 'read', 'dropped', 'overwritten', 'median latency ms'))
+    for _ in processes:
+        label, read, dropped, overwritten, latency = results.get()
+        print('%-16s %8d %8d %12d %16.2f' % (label, read, dropped, overwritten, latency))
+    for p in processes:
+        p.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""
+Decoded-image cache shared between processes.
+
+Almost every recipe starts with `cv2.imread('shiroha.png')` or
+`cv2.imread('sudoku.png', 0)` and often resizes right after. When operators run
+in separate worker processes, each of them decodes the same file again and
+keeps its own copy. `ImageCache.imread` decodes an image once and stores the
+array as a `.npy` file in shared memory (`/dev/shm` where it exists). Every
+process then memory-maps that file, so they all read the same physical pages.
+
+- entries are keyed by absolute path, modification time, size, read flags and
+  downscale factor, so an edited file is decoded again
+- the cache is an LRU with a byte budget: a hit refreshes the entry's mtime,
+  and inserting evicts the least recently used entries until the total fits
+- `downscale` uses OpenCV's reduced decode (`IMREAD_REDUCED_*_2/4/8`) for the
+  largest power of two it covers and resizes the rest with INTER_AREA. JPEG
+  decodes at the reduced size directly, other formats decode fully first, so
+  for those the savings are only in the cache and in the callers' memory
+
+Cached images are read-only memory maps; copy one before drawing on it.
+Entries are written to a temporary file and renamed, so a reader never sees
+half an image, and removing an entry that another process has mapped is
+safe on POSIX systems.
+
+Usage (decode time and per-worker memory over a batch):
+
+    python image_cache.py --workers 4 --images 8 --rounds 5
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+DEFAULT_DIRECTORY = os.path.join('/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                                 'opencv-image-cache')
+
+REDUCED_FLAGS = {
+    (cv2.IMREAD_COLOR, 2): cv2.IMREAD_REDUCED_COLOR_2,
+    (cv2.IMREAD_COLOR, 4): cv2.IMREAD_REDUCED_COLOR_4,
+    (cv2.IMREAD_COLOR, 8): cv2.IMREAD_REDUCED_COLOR_8,
+    (cv2.IMREAD_GRAYSCALE, 2): cv2.IMREAD_REDUCED_GRAYSCALE_2,
+    (cv2.IMREAD_GRAYSCALE, 4): cv2.IMREAD_REDUCED_GRAYSCALE_4,
+    (cv2.IMREAD_GRAYSCALE, 8): cv2.IMREAD_REDUCED_GRAYSCALE_8,
+}
+
+
+def decode(path, flags=cv2.IMREAD_COLOR, downscale=1):
+    """`cv2.imread(path, flags)` shrunk by `downscale` (>= 1), None if the file cannot be read."""
+    reduction = 1
+    for factor in (8, 4, 2):
+        if factor <= downscale and (flags, factor) in REDUCED_FLAGS:
+            reduction = factor
+            break
+
+    image = cv2.imread(path, REDUCED_FLAGS[flags, reduction] if reduction > 1 else flags)
+    if image is None or downscale == reduction:
+        return image
+
+    height, width = image.shape[:2]
+    scale = reduction / downscale
+    size = (max(1, int(round(width * scale))), max(1, int(round(height * scale))))
+    return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+
+class ImageCache:
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=1 << 30):
+        """
+        `directory`: where the decoded arrays live, share it between the processes
+
+        `max_bytes`: budget for all entries together
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.decode_seconds = 0.0
+        os.makedirs(directory, exist_ok=True)
+
+    def entry_path(self, path, flags, downscale):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        key = json.dumps([path, stat.st_mtime_ns, stat.st_size, flags, downscale])
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.npy')
+
+    def imread(self, path, flags=cv2.IMREAD_COLOR, downscale=1):
+        """
+        Like `cv2.imread(path, flags)`, optionally `downscale` times smaller,
+        returned as a read-only array shared with other processes. None if
+        the file cannot be decoded.
+        """
+        try:
+            entry = self.entry_path(path, flags, downscale)
+        except FileNotFoundError:
+            return None
+
+        try:
+            image = np.load(entry, mmap_mode='r')
+            # another process may evict the entry between the load and the utime,
+            # either FileNotFoundError makes this a miss
+            os.utime(entry)
+            self.hits += 1
+            return image
+        except FileNotFoundError:
+            pass
+
+        start = time.perf_counter()
+        image = decode(path, flags, downscale)
+        self.decode_seconds += time.perf_counter() - start
+        self.misses += 1
+        if image is None:
+            return None
+
+        tmp = '%s.%d.tmp.npy' % (entry[:-len('.npy')], os.getpid())
+        np.save(tmp, image)
+        # map the file before publishing it: the map survives the rename and a
+        # later eviction by another process, the path does not
+        shared = np.load(tmp, mmap_mode='r')
+        # the rename is atomic, readers see either no entry or a complete one
+        os.replace(tmp, entry)
+        self.evict(keep=entry)
+        return shared
+
+    def entries(self):
+        """(mtime, bytes, path) of every entry, least recently used first."""
+        result = []
+        for item in os.scandir(self.directory):
+            if not item.name.endswith('.npy') or item.name.endswith('.tmp.npy'):
+                continue
+            try:
+                stat = item.stat()
+            except FileNotFoundError:
+                continue
+            result.append((stat.st_mtime_ns, stat.st_size, item.path))
+        return sorted(result)
+
+    @property
+    def nbytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another process evicted it first
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+def private_bytes():
+    """Memory only this process uses (Linux), None elsewhere."""
+    try:
+        with open('/proc/self/smaps_rollup') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+    except OSError:
+        return None
+    return sum(int(fields[name].split()[0]) * 1024 for name in ('Private_Clean', 'Private_Dirty') if name in fields)
+
+
+def worker(paths, rounds, mode, directory, max_bytes):
+    """Read every path `rounds` times and keep the images, like operators holding their inputs."""
+    cache = ImageCache(directory, max_bytes) if mode != 'imread' else None
+    downscale = 4 if mode == 'cache, downscale 4' else 1
+    before = private_bytes()
+    held = []
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for path in paths:
+            image = cache.imread(path, downscale=downscale) if cache else cv2.imread(path)
+            # one pixel per 64 columns reads every page of the image, as an operator would
+            held.append((image, int(image[:, ::64].sum())))
+        held = held[-len(paths):]
+    seconds = time.perf_counter() - start
+    after = private_bytes()
+    return seconds, None if before is None else after - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--images', type=int, default=8)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--size', choices=list(SIZES), default='4k')
+    parser.add_argument('--format', choices=['png', 'jpg'], default='jpg')
+    parser.add_argument('--max-bytes', type=int, default=1 << 30)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as images_dir:
+        paths = []
+        for i in range(args.images):
+            path = os.path.join(images_dir, 'image%03d.%s' % (i, args.format))
+            cv2.imwrite(path, synthetic_image(SIZES[args.size], seed=i))
+            paths.append(path)
+
+        cache_dir = os.path.join(DEFAULT_DIRECTORY, 'benchmark-%d' % os.getpid())
+        print('%d workers, %d %s %s images, %d rounds' % (args.workers, args.images, args.size, args.format, args.rounds))
+        print('%-20s %14s %22s' % ('mode', 'worker s', 'private MiB / worker'))
+        for mode in ('imread', 'cache', 'cache, downscale 4'):
+            ImageCache(cache_dir).clear()
+            with ProcessPoolExecutor(max_workers=args.workers) as executor:
+                results = list(executor.map(
+                    worker, *zip(*[(paths, args.rounds, mode, cache_dir, args.max_bytes)] * args.workers)))
+            seconds = np.mean([s for s, _ in results])
+            memory = [m for _, m in results if m is not None]
+            print('%-20s %14.2f %22s' % (
+                mode, seconds, '%.1f' % (np.mean(memory) / 2**20) if memory else '-'))
+
+        cache = ImageCache(cache_dir)
+        cache.clear()
+        os.rmdir(cache_dir)
+
+
+if __name__ == '__main__':
+    main()
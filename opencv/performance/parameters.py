@@ -0,0 +1,340 @@
+"""
+Parameter store for live-tuned pipelines.
+
+`trackbar.py` reads every trackbar with `getTrackbarPos` on each frame and
+`object_tracking.py` hard-codes its HSV bounds, so every tweak means either
+polling everything or restarting. Here parameters live in a `ParameterStore`
+that trackbars (`bind_trackbar`) and a local TCP socket (`ParameterServer`)
+write to. Each value carries a version, and a `Pipeline` stage declares the
+parameters it depends on:
+
+- `prepare(values)` builds whatever depends only on parameters (a lookup
+  table, a kernel) and runs again only when one of them changes
+- `run(frame, state)` runs again only when its input or its parameters change,
+  so tuning a still image redoes only the stages after the one being tuned
+
+Socket protocol, one command per line (`nc 127.0.0.1 PORT`):
+
+    set h_low 100
+    get h_low
+    list
+
+Usage:
+
+    python parameters.py --image ../02_core-operations/basic-operations/shiroha.png --port 5005
+    python parameters.py --video 0
+    python parameters.py --benchmark
+"""
+import argparse
+import json
+import numbers
+import socketserver
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+
+class ParameterStore:
+    def __init__(self, **defaults):
+        self.lock = threading.Lock()
+        self.values = dict(defaults)
+        self.versions = {name: 0 for name in defaults}
+        # every parameter keeps the type of its default
+        self.types = {name: type(value) for name, value in defaults.items()}
+
+    def get(self, name):
+        with self.lock:
+            return self.values[name]
+
+    def coerce(self, name, value):
+        """`value` converted to the type of the default of `name`, ValueError if it does not fit."""
+        kind = self.types[name]
+        numeric = isinstance(value, numbers.Real) and not isinstance(value, (bool, np.bool_))
+        if kind is int and numeric and float(value).is_integer():
+            return int(value)
+        if kind is float and numeric:
+            return float(value)
+        if kind not in (int, float) and isinstance(value, kind):
+            return value
+        raise ValueError('%s expects %s, got %r' % (name, kind.__name__, value))
+
+    def set(self, name, value):
+        """
+        Returns True if the value changed. Unknown names (KeyError) and values
+        that do not fit the default's type (ValueError) are rejected and the
+        old value is kept.
+        """
+        with self.lock:
+            if name not in self.values:
+                raise KeyError('unknown parameter: %s' % name)
+            value = self.coerce(name, value)
+            if self.values[name] == value:
+                return False
+            self.values[name] = value
+            self.versions[name] += 1
+            return True
+
+    def update(self, values):
+        return [name for name, value in values.items() if self.set(name, value)]
+
+    def snapshot(self, names):
+        """Versions and values of `names`, read consistently."""
+        with self.lock:
+            return tuple(self.versions[n] for n in names), {n: self.values[n] for n in names}
+
+    def as_dict(self):
+        with self.lock:
+            return dict(self.values)
+
+
+class Stage:
+    def __init__(self, name, run, params=(), prepare=None):
+        """
+        `run(frame, state)`: the per-frame work, `state` is what `prepare` returned
+
+        `params`: names of the parameters this stage depends on
+
+        `prepare(values)`: work that depends only on the parameters
+        """
+        self.name = name
+        self.run = run
+        self.params = tuple(params)
+        self.prepare = prepare
+
+
+class Pipeline:
+    def __init__(self, store, stages):
+        self.store = store
+        self.stages = stages
+        self.cache = {}  # stage name -> (key, state versions, state, output, output token)
+        self.next_token = 0
+        self.runs = {stage.name: 0 for stage in stages}
+        self.prepares = {stage.name: 0 for stage in stages}
+
+    def process(self, frame, frame_id=None):
+        """
+        Run the stages on `frame` and return every stage's output. Pass the
+        same `frame_id` for a frame that did not change (a still image) to
+        reuse cached outputs; None means a new frame each call.
+        """
+        if frame_id is None:
+            upstream = ('frame', self.next_token)
+            self.next_token += 1
+        else:
+            upstream = ('frame', frame_id)
+
+        outputs = {}
+        data = frame
+        for stage in self.stages:
+            versions, values = self.store.snapshot(stage.params)
+            key = (upstream, versions)
+            cached = self.cache.get(stage.name)
+
+            if cached is not None and cached[0] == key:
+                _, _, _, data, upstream = cached
+            else:
+                if cached is not None and cached[1] == versions:
+                    state = cached[2]
+                else:
+                    state = stage.prepare(values) if stage.prepare is not None else values
+                    self.prepares[stage.name] += 1
+                data = stage.run(data, state)
+                self.runs[stage.name] += 1
+                upstream = (stage.name, self.next_token)
+                self.next_token += 1
+                self.cache[stage.name] = (key, versions, state, data, upstream)
+            outputs[stage.name] = data
+        return outputs
+
+
+def bind_trackbar(store, name, window, maximum):
+    """Trackbar that writes `name` into `store`, created at the current value."""
+    cv2.createTrackbar(name, window, int(store.get(name)), maximum, lambda value: store.set(name, value))
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+class _ParameterHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            words = line.decode('utf-8').split(None, 2)
+            if not words:
+                continue
+            try:
+                if words[0] == 'set' and len(words) == 3:
+                    store.set(words[1], parse_value(words[2].strip()))
+                    reply = 'ok'
+                elif words[0] == 'get' and len(words) == 2:
+                    reply = json.dumps(store.get(words[1]))
+                elif words[0] == 'list':
+                    reply = json.dumps(store.as_dict(), sort_keys=True)
+                else:
+                    reply = 'error: expected "set NAME VALUE", "get NAME" or "list"'
+            except (KeyError, ValueError) as e:
+                reply = 'error: %s' % e.args[0]
+            self.wfile.write((reply + '\n').encode('utf-8'))
+
+
+class ParameterServer(socketserver.ThreadingTCPServer):
+    """Line-based TCP server writing into a `ParameterStore`, served from a daemon thread."""
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, store, host='127.0.0.1', port=0):
+        super().__init__((host, port), _ParameterHandler)
+        self.store = store
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+HSV_DEFAULTS = {
+    'blur': 2,
+    # object_tracking.py's bounds, hue wraps around when h_low > h_high
+    'h_low': 10, 's_low': 100, 'v_low': 100,
+    'h_high': 245, 's_high': 255, 'v_high': 255,
+}
+
+
+def hsv_lut(values):
+    """256x1x3 lookup table, 255 where each HSV channel lies inside its bounds."""
+    levels = np.arange(256)
+    lut = np.zeros((256, 1, 3), np.uint8)
+    for c, channel in enumerate('hsv'):
+        low, high = values[channel + '_low'], values[channel + '_high']
+        if channel == 'h' and low > high:
+            inside = (levels >= low) | (levels <= high)
+        else:
+            inside = (levels >= low) & (levels <= high)
+        lut[:, 0, c] = np.where(inside, 255, 0)
+    return lut
+
+
+def hsv_mask_pipeline(store):
+    """`object_tracking.py` as stages: blur, BGR to HSV, mask through a lookup table, masked frame."""
+    def blur(frame, values):
+        size = 2 * values['blur'] + 1
+        return cv2.GaussianBlur(frame, (size, size), 0) if size > 1 else frame
+
+    def mask(hsv, lut):
+        # every channel maps to 255 inside its bounds, the pixel is kept if all three do
+        return cv2.inRange(cv2.LUT(hsv, lut), (255, 255, 255), (255, 255, 255))
+
+    stages = [
+        Stage('blur', blur, params=['blur']),
+        Stage('hsv', lambda frame, state: cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)),
+        Stage('mask', mask, params=['h_low', 's_low', 'v_low', 'h_high', 's_high', 'v_high'], prepare=hsv_lut),
+    ]
+    pipeline = Pipeline(store, stages)
+
+    def process(frame, frame_id=None):
+        outputs = pipeline.process(frame, frame_id)
+        return outputs['mask'], cv2.bitwise_and(frame, frame, mask=outputs['mask'])
+
+    return pipeline, process
+
+
+def benchmark(num_frames, change_every, size='1080p'):
+    """
+    Tuning a still image: one bound changes every `change_every` frames.
+    Returns milliseconds per frame without and with the cache, and the
+    stage run counts.
+    """
+    image = synthetic_image(SIZES[size])
+    store = ParameterStore(**HSV_DEFAULTS)
+    pipeline, process = hsv_mask_pipeline(store)
+
+    lower = np.array([HSV_DEFAULTS['h_low'], HSV_DEFAULTS['s_low'], HSV_DEFAULTS['v_low']])
+    upper = np.array([HSV_DEFAULTS['h_high'], HSV_DEFAULTS['s_high'], HSV_DEFAULTS['v_high']])
+    start = time.perf_counter()
+    for _ in range(num_frames):
+        blurred = cv2.GaussianBlur(image, (5, 5), 0)
+        hsv = cv2.cvtColor(blurred, cv2.COLOR_BGR2HSV)
+        mask = cv2.inRange(hsv, lower, upper)
+        cv2.bitwise_and(image, image, mask=mask)
+    rerun_all = (time.perf_counter() - start) / num_frames
+
+    start = time.perf_counter()
+    for i in range(num_frames):
+        if i % change_every == 0:
+            store.set('s_low', 100 + i // change_every % 50)
+        process(image, frame_id=0)
+    cached = (time.perf_counter() - start) / num_frames
+    return rerun_all * 1e3, cached * 1e3, pipeline.runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--image')
+    parser.add_argument('--video', help='camera index or video file')
+    parser.add_argument('--port', type=int, help='also accept parameter changes on this local TCP port')
+    parser.add_argument('--benchmark', action='store_true')
+    parser.add_argument('--frames', type=int, default=300)
+    parser.add_argument('--change-every', type=int, default=30)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        rerun_all, cached, runs = benchmark(args.frames, args.change_every)
+        print('rerun every stage: %8.3f ms/frame' % rerun_all)
+        print('cached pipeline:   %8.3f ms/frame' % cached)
+        print('stage runs over %d frames: %s' % (args.frames, runs))
+        return
+
+    store = ParameterStore(**HSV_DEFAULTS)
+    pipeline, process = hsv_mask_pipeline(store)
+
+    cv2.namedWindow('res')
+    bind_trackbar(store, 'blur', 'res', 10)
+    for name in ('h_low', 'h_high'):
+        bind_trackbar(store, name, 'res', 179)
+    for name in ('s_low', 's_high', 'v_low', 'v_high'):
+        bind_trackbar(store, name, 'res', 255)
+
+    server = None
+    if args.port is not None:
+        server = ParameterServer(store, port=args.port)
+        print('parameters on %s:%d' % server.start())
+
+    if args.image:
+        image = cv2.imread(args.image)
+        read = lambda: image
+        frame_id = 0
+    else:
+        source = args.video if args.video is not None else '0'
+        cap = cv2.VideoCapture(int(source) if source.isdigit() else source)
+        read = lambda: cap.read()[1]
+        frame_id = None
+
+    while True:
+        frame = read()
+        if frame is None:
+            break
+        mask, res = process(frame, frame_id)
+        cv2.imshow('mask', mask)
+        cv2.imshow('res', res)
+        if cv2.waitKey(5) & 0xff == 27:
+            break
+
+    if server is not None:
+        server.stop()
+    cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
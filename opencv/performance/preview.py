@@ -0,0 +1,271 @@
+"""
+Double-buffered, rate-limited preview window for the interactive recipes.
+
+`mouse_event.py`, `mouse_event_adv.py` and `trackbar.py` call `cv2.imshow` on
+the whole canvas from a `waitKey(1)` loop whether or not anything changed,
+and `trackbar.py` polls every trackbar and refills `img[:]` on each pass.
+`PreviewWindow` turns that around:
+
+- callbacks draw into a back buffer and mark the rectangle they touched as dirty
+- `render` copies only the dirty rectangles to the front buffer and shows it,
+  at most `max_fps` times per second
+- with nothing dirty the loop just waits in `cv2.waitKey`, which keeps
+  dispatching mouse, trackbar and key events, so an idle tool uses next to no
+  CPU and still reacts right away
+- trackbar values arrive through their callbacks instead of being polled
+
+Usage:
+
+    python preview.py --demo trackbar
+    python preview.py --demo mouse
+    python preview.py --demo draw
+    python preview.py --simulate 5   # headless: idle CPU of the polling loop vs PreviewWindow
+"""
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from roi_views import Rect, clip_rect, rect_slices
+
+
+def rect_from_points(p0, p1):
+    """Rectangle covering both corner points, inclusive."""
+    x0, x1 = sorted((p0[0], p1[0]))
+    y0, y1 = sorted((p0[1], p1[1]))
+    return Rect(x0, y0, x1 - x0 + 1, y1 - y0 + 1)
+
+
+def rect_around(center, radius):
+    return Rect(center[0] - radius, center[1] - radius, 2 * radius + 1, 2 * radius + 1)
+
+
+class PreviewWindow:
+    def __init__(self, name, canvas, max_fps=60, idle_wait_ms=16, show=cv2.imshow, wait_key=cv2.waitKey):
+        """
+        `canvas`: back buffer, draw into it and call `mark_dirty`
+
+        `max_fps`: upper bound on the refresh rate
+
+        `idle_wait_ms`: how long each `waitKey` blocks while nothing is dirty
+
+        `show`/`wait_key`: replace `cv2.imshow`/`cv2.waitKey`, e.g. to run without a display
+        """
+        self.name = name
+        self.canvas = canvas
+        self.front = canvas.copy()
+        self.min_interval = 1.0 / max_fps
+        self.idle_wait_ms = idle_wait_ms
+        self.show = show
+        self.wait_key = wait_key
+
+        self.dirty = []
+        self.full_redraw = True
+        self.last_render = float('-inf')
+        self.values = {}
+        self.frames = 0
+        self.iterations = 0
+
+        if show is cv2.imshow:
+            cv2.namedWindow(name)
+
+    def mark_dirty(self, rect=None):
+        """Schedule a redraw of `rect` (x, y, w, h), or of the whole canvas."""
+        if rect is None:
+            self.full_redraw = True
+            return
+        rect = clip_rect(Rect(*rect), self.canvas.shape)
+        if rect is not None:
+            self.dirty.append(rect)
+
+    @property
+    def is_dirty(self):
+        return self.full_redraw or bool(self.dirty)
+
+    def on_mouse(self, callback):
+        """`callback(window, event, x, y, flags)`, it draws into `window.canvas` and marks what it touched."""
+        cv2.setMouseCallback(self.name, lambda event, x, y, flags, param: callback(self, event, x, y, flags))
+
+    def add_trackbar(self, name, maximum, initial=0, on_change=None):
+        """
+        Trackbar whose value is kept in `self.values[name]`. `on_change(window)`
+        runs whenever any value changes, instead of polling `getTrackbarPos`.
+        """
+        self.values[name] = initial
+
+        def changed(value):
+            if self.values[name] != value:
+                self.values[name] = value
+                if on_change is not None:
+                    on_change(self)
+
+        cv2.createTrackbar(name, self.name, initial, maximum, changed)
+
+    def render(self):
+        """Copy the dirty parts of the back buffer to the front buffer and show it."""
+        height, width = self.canvas.shape[:2]
+        dirty_area = sum(rect.width * rect.height for rect in self.dirty)
+        if self.full_redraw or dirty_area >= height * width:
+            np.copyto(self.front, self.canvas)
+        else:
+            for rect in self.dirty:
+                ys, xs = rect_slices(rect)
+                self.front[ys, xs] = self.canvas[ys, xs]
+
+        self.dirty = []
+        self.full_redraw = False
+        self.show(self.name, self.front)
+        self.last_render = time.perf_counter()
+        self.frames += 1
+
+    def poll(self):
+        """
+        One pass of the loop: render if something is dirty and the rate
+        limit allows it, then wait for events. Returns the key pressed or -1.
+        """
+        self.iterations += 1
+        wait_ms = self.idle_wait_ms
+        if self.is_dirty:
+            remaining = self.last_render + self.min_interval - time.perf_counter()
+            if remaining <= 0:
+                self.render()
+            else:
+                wait_ms = max(1, int(remaining * 1000))
+        return self.wait_key(wait_ms)
+
+    def run(self, on_key=None, quit_key='q'):
+        """Loop until `quit_key` is pressed or `on_key(window, key)` returns False."""
+        while True:
+            key = self.poll() & 0xff
+            if key == 0xff:
+                continue
+            if key == ord(quit_key):
+                break
+            if on_key is not None and on_key(self, key) is False:
+                break
+
+
+def trackbar_demo():
+    """`trackbar.py`: fill the canvas with the chosen color, redrawn only when a trackbar moves."""
+    window = PreviewWindow('image', np.zeros((300, 512, 3), np.uint8))
+    switch = '0 : OFF \n1 : ON'
+
+    def fill(window):
+        v = window.values
+        window.canvas[:] = [v['B'], v['G'], v['R']] if v[switch] else 0
+        window.mark_dirty()
+
+    for name in ('R', 'G', 'B'):
+        window.add_trackbar(name, 255, on_change=fill)
+    window.add_trackbar(switch, 1, on_change=fill)
+    window.run()
+
+
+def mouse_demo():
+    """`mouse_event.py`: double click draws a circle, only its bounding box is redrawn."""
+    window = PreviewWindow('image', np.zeros((512, 512, 3), np.uint8))
+
+    def draw_circle(window, event, x, y, flags):
+        if event == cv2.EVENT_LBUTTONDBLCLK:
+            cv2.circle(window.canvas, (x, y), 100, (255, 0, 0), -1)
+            window.mark_dirty(rect_around((x, y), 100))
+
+    window.on_mouse(draw_circle)
+    window.run()
+
+
+def draw_demo():
+    """`mouse_event_adv.py`: drag to draw rectangles, 'm' switches to curves."""
+    window = PreviewWindow('image', np.zeros((512, 512, 3), np.uint8))
+    state = {'drawing': False, 'mode': True, 'start': (-1, -1)}
+
+    def draw(window, x, y):
+        if state['mode']:
+            cv2.rectangle(window.canvas, state['start'], (x, y), (0, 255, 0), -1)
+            window.mark_dirty(rect_from_points(state['start'], (x, y)))
+        else:
+            cv2.circle(window.canvas, (x, y), 5, (0, 0, 255), -1)
+            window.mark_dirty(rect_around((x, y), 5))
+
+    def on_mouse(window, event, x, y, flags):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            state['drawing'] = True
+            state['start'] = (x, y)
+        elif event == cv2.EVENT_MOUSEMOVE and state['drawing']:
+            draw(window, x, y)
+        elif event == cv2.EVENT_LBUTTONUP:
+            state['drawing'] = False
+            draw(window, x, y)
+
+    def on_key(window, key):
+        if key == ord('m'):
+            state['mode'] = not state['mode']
+
+    window.on_mouse(on_mouse)
+    window.run(on_key)
+
+
+def simulate(seconds, events_per_second=5):
+    """
+    Without a display: the polling loop of `trackbar.py` against
+    `PreviewWindow`, with `waitKey` replaced by a sleep and `imshow` by a
+    copy of the frame (roughly what HighGUI does with it). Returns
+    (name, CPU seconds, frames shown) for both.
+    """
+    results = []
+    canvas = np.zeros((1080, 1920, 3), np.uint8)
+    shown = np.empty_like(canvas)
+
+    def show(name, image):
+        np.copyto(shown, image)
+
+    def wait_key(ms):
+        time.sleep(ms / 1000.0)
+        return -1
+
+    # polling loop: show and refill every pass
+    frames = 0
+    cpu = time.process_time()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        show('image', canvas)
+        frames += 1
+        wait_key(1)
+        canvas[:] = [10, 20, 30]
+    results.append(('waitKey(1) polling loop', time.process_time() - cpu, frames))
+
+    # same number of changes per second, each one marks the canvas dirty
+    window = PreviewWindow('image', canvas, show=show, wait_key=wait_key)
+    next_event = time.perf_counter()
+    cpu = time.process_time()
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if time.perf_counter() >= next_event:
+            canvas[:] = [10, 20, 30]
+            window.mark_dirty()
+            next_event += 1.0 / events_per_second
+        window.poll()
+    results.append(('PreviewWindow', time.process_time() - cpu, window.frames))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--demo', choices=['trackbar', 'mouse', 'draw'])
+    parser.add_argument('--simulate', type=float, metavar='SECONDS')
+    args = parser.parse_args()
+
+    if args.simulate:
+        print('%-26s %10s %8s' % ('loop', 'CPU s', 'frames'))
+        for name, cpu, frames in simulate(args.simulate):
+            print('%-26s %10.3f %8d' % (name, cpu, frames))
+        return
+
+    demos = {'trackbar': trackbar_demo, 'mouse': mouse_demo, 'draw': draw_demo}
+    demos[args.demo or 'trackbar']()
+    cv2.destroyAllWindows()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Rectangular regions of one frame buffer, processed in place.
+
+`image_roi.py` slices a single `img[100:300, 100:300]`, and `mask.py` builds a
+full-size mask (plus a `bitwise_and` over the whole image) only to restrict
+a histogram to one rectangle. `RoiManager` keeps one input and one output
+buffer per frame size and hands out named, possibly overlapping, views of
+them. OpenCV operators read from the input view and write into the output
+view through their `dst` argument, so no region is ever copied and no mask is
+built, e.g. to process every tracked object of a frame separately.
+
+Views share memory with the manager's buffers, so `load` copies each new
+frame into the existing input buffer instead of replacing it. Views handed
+out by `acquire` are reference counted, and a frame of a different size (which
+needs new buffers) is refused while any of them is still held.
+
+Operators see only their region: borders (blur, morphology) are extrapolated
+at the region edge, not read from the neighbouring pixels. Where regions
+overlap, the output of the region applied last wins.
+
+Usage (views vs full-frame masks):
+
+    python roi_views.py --size 1080p --regions 32
+"""
+import argparse
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+# OpenCV's (x, y, w, h) order, as returned by cv2.boundingRect
+Rect = namedtuple('Rect', 'x y width height')
+
+
+def clip_rect(rect, shape):
+    """`rect` clipped to an image of `shape`, None if nothing is left."""
+    height, width = shape[:2]
+    x0, y0 = max(rect.x, 0), max(rect.y, 0)
+    x1, y1 = min(rect.x + rect.width, width), min(rect.y + rect.height, height)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return Rect(x0, y0, x1 - x0, y1 - y0)
+
+
+def rect_slices(rect):
+    return slice(rect.y, rect.y + rect.height), slice(rect.x, rect.x + rect.width)
+
+
+class RoiManager:
+    def __init__(self, frame=None, output_channels=None, output_dtype=None):
+        """
+        `output_channels`: channels of the output buffer, defaults to the
+        frame's (e.g. 1 for thresholding a color frame after conversion)
+
+        `output_dtype`: dtype of the output buffer, defaults to the frame's
+        """
+        self.output_channels = output_channels
+        self.output_dtype = output_dtype
+        self.rects = {}
+        self.refcounts = {}
+        self.frame = None
+        self.output = None
+        if frame is not None:
+            self.load(frame)
+
+    def add(self, name, rect):
+        """Register (or move) region `name`, clipped to the frame. Returns the clipped rectangle."""
+        rect = Rect(*rect)
+        if self.frame is not None:
+            clipped = clip_rect(rect, self.frame.shape)
+            if clipped is None:
+                raise ValueError('region %s %s lies outside the frame' % (name, tuple(rect)))
+            rect = clipped
+        if self.refcounts.get(name):
+            raise RuntimeError('region %s is still acquired, release it before moving it' % name)
+        self.rects[name] = rect
+        return rect
+
+    def remove(self, name):
+        if self.refcounts.get(name):
+            raise RuntimeError('region %s is still acquired' % name)
+        del self.rects[name]
+        self.refcounts.pop(name, None)
+
+    def load(self, frame):
+        """Copy `frame` into the input buffer, allocating new buffers only when its shape changes."""
+        if self.frame is not None and self.frame.shape == frame.shape and self.frame.dtype == frame.dtype:
+            np.copyto(self.frame, frame)
+            return self.frame
+
+        held = [name for name, count in self.refcounts.items() if count]
+        if held:
+            raise RuntimeError('cannot reallocate the frame buffers while regions %s are acquired' % held)
+
+        self.frame = frame.copy()
+        output_shape = frame.shape[:2]
+        channels = self.output_channels if self.output_channels is not None else (
+            frame.shape[2] if frame.ndim == 3 else 1)
+        if channels > 1:
+            output_shape += (channels,)
+        self.output = np.zeros(output_shape, dtype=self.output_dtype or frame.dtype)
+
+        for name, rect in list(self.rects.items()):
+            clipped = clip_rect(rect, frame.shape)
+            if clipped is None:
+                del self.rects[name]
+            else:
+                self.rects[name] = clipped
+        return self.frame
+
+    def views(self, name):
+        """(input view, output view) of region `name`, without reference counting."""
+        ys, xs = rect_slices(self.rects[name])
+        return self.frame[ys, xs], self.output[ys, xs]
+
+    def acquire(self, name):
+        views = self.views(name)
+        self.refcounts[name] = self.refcounts.get(name, 0) + 1
+        return views
+
+    def release(self, name):
+        if not self.refcounts.get(name):
+            raise RuntimeError('region %s is not acquired' % name)
+        self.refcounts[name] -= 1
+
+    @contextmanager
+    def region(self, name):
+        src, dst = self.acquire(name)
+        try:
+            yield src, dst
+        finally:
+            self.release(name)
+
+    def apply(self, operator, names=None):
+        """
+        Call `operator(src, dst)` for every region (or the given `names`), it
+        should write its result into `dst`, e.g.
+
+            manager.apply(lambda src, dst: cv2.GaussianBlur(src, (5, 5), 0, dst=dst))
+        """
+        for name in self.rects if names is None else names:
+            with self.region(name) as (src, dst):
+                operator(src, dst)
+        return self.output
+
+    def histograms(self, channels=(0,), bins=(256,), ranges=(0, 256), names=None):
+        """`cv2.calcHist` of every region, computed on its view instead of through a mask."""
+        result = {}
+        for name in self.rects if names is None else names:
+            with self.region(name) as (src, dst):
+                result[name] = cv2.calcHist([src], list(channels), None, list(bins), list(ranges))
+        return result
+
+
+def random_rects(rng, shape, num_regions, min_size=32, max_size=256):
+    height, width = shape[:2]
+    sizes = rng.integers(min_size, max_size, size=(num_regions, 2))
+    xs = rng.integers(0, width - sizes[:, 0])
+    ys = rng.integers(0, height - sizes[:, 1])
+    return [Rect(int(x), int(y), int(w), int(h)) for x, y, (w, h) in zip(xs, ys, sizes)]
+
+
+def masked_histograms(gray, rects):
+    """What `mask.py` does, once per region."""
+    result = []
+    for rect in rects:
+        mask = np.zeros(gray.shape[:2], np.uint8)
+        ys, xs = rect_slices(rect)
+        mask[ys, xs] = 255
+        result.append(cv2.calcHist([gray], [0], mask, [256], [0, 256]))
+    return result
+
+
+def masked_blur(image, rects, output):
+    """Per-region blur through full-frame masks: blur the frame, then copy each region through its mask."""
+    blurred = cv2.GaussianBlur(image, (5, 5), 0)
+    for rect in rects:
+        mask = np.zeros(image.shape[:2], np.uint8)
+        ys, xs = rect_slices(rect)
+        mask[ys, xs] = 255
+        cv2.copyTo(blurred, mask, output)
+    return output
+
+
+def timed(fn, repeat):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=list(SIZES), default='1080p')
+    parser.add_argument('--regions', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    image = synthetic_image(SIZES[args.size], seed=args.seed)
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    rects = random_rects(rng, image.shape, args.regions)
+
+    color = RoiManager(image)
+    grays = RoiManager(gray)
+    for i, rect in enumerate(rects):
+        color.add(i, rect)
+        grays.add(i, rect)
+
+    # both approaches must agree on the histograms
+    for expected, actual in zip(masked_histograms(gray, rects), grays.histograms().values()):
+        assert np.array_equal(expected, actual)
+
+    output = np.zeros_like(image)
+    cases = [
+        ('calcHist with masks', lambda: masked_histograms(gray, rects)),
+        ('calcHist on views', lambda: grays.histograms()),
+        ('blur + copyTo with masks', lambda: masked_blur(image, rects, output)),
+        ('blur on views', lambda: color.apply(lambda src, dst: cv2.GaussianBlur(src, (5, 5), 0, dst=dst))),
+        ('threshold on views', lambda: grays.apply(
+            lambda src, dst: cv2.threshold(src, 127, 255, cv2.THRESH_BINARY, dst=dst))),
+    ]
+
+    print('%s frame, %d regions' % (args.size, args.regions))
+    print('%-28s %10s' % ('case', 'ms'))
+    for name, fn in cases:
+        print('%-28s %10.3f' % (name, timed(fn, args.repeat) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""
+Per-operator tracing for OpenCV pipelines.
+
+When a chain such as gray -> resize -> Canny -> HoughLines (`hough_line.py`)
+or HSV -> inRange -> bitwise_and (`object_tracking.py`) is slow, `Tracer`
+shows which call dominates. Wrap the modules the pipeline uses and mark its
+frames and stages:
+
+    tracer = Tracer(sample_every=10)
+    cv = tracer.wrap(cv2)
+    for i, frame in enumerate(frames):
+        with tracer.frame(i):
+            with tracer.stage('edges'):
+                edges = cv.Canny(cv.cvtColor(frame, cv2.COLOR_BGR2GRAY), 0, 80)
+
+Every traced call records its wall time, the shape and dtype of its first
+array argument and the bytes of the new arrays it returns (outputs that do not
+share memory with an input, which is what the call allocated for its
+result). Calls are aggregated per (stage, operator).
+
+Only every `sample_every`-th frame is traced, and in the other frames a
+wrapped call costs a single flag check, so tracing can stay on in
+production. The sampled frames also keep their events, up to `max_events`,
+which export as:
+
+- a Chrome trace (`chrome://tracing`, https://ui.perfetto.dev or speedscope
+  show it as a flame chart)
+- folded stacks (`frames;stage;operator microseconds`, all frames merged) for flamegraph.pl or speedscope
+
+Usage (traces both recipe pipelines on synthetic frames and reports the overhead):
+
+    python tracing.py --frames 100 --sample-every 10 --trace trace.json --folded trace.folded
+"""
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+from bench_recipes import SIZES, synthetic_image
+
+
+def _first_array(args, kwargs):
+    for value in args:
+        if isinstance(value, np.ndarray):
+            return value
+    for value in kwargs.values():
+        if isinstance(value, np.ndarray):
+            return value
+    return None
+
+
+def _allocated_bytes(result, inputs):
+    """Bytes of the arrays in `result` that are not views of an input."""
+    if isinstance(result, np.ndarray):
+        outputs = (result,)
+    elif isinstance(result, tuple):
+        outputs = [r for r in result if isinstance(r, np.ndarray)]
+    else:
+        return 0
+    total = 0
+    for output in outputs:
+        base = output if output.base is None else output.base
+        if not any(base is i or base is i.base for i in inputs):
+            total += output.nbytes
+    return total
+
+
+class _Stats:
+    __slots__ = ('count', 'total_ns', 'max_ns', 'bytes', 'shape', 'dtype')
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.bytes = 0
+        self.shape = None
+        self.dtype = None
+
+
+class _TracedModule:
+    """Attribute proxy that returns traced versions of the module's callables."""
+
+    def __init__(self, tracer, module, prefix):
+        self._tracer = tracer
+        self._module = module
+        self._prefix = prefix
+        self._cache = {}
+
+    def __getattr__(self, name):
+        try:
+            return self._cache[name]
+        except KeyError:
+            pass
+        value = getattr(self._module, name)
+        if callable(value) and not isinstance(value, type):
+            value = self._tracer.wrap_function(value, self._prefix + name)
+        self._cache[name] = value
+        return value
+
+
+class Tracer:
+    def __init__(self, sample_every=1, max_events=100000, process_name='pipeline'):
+        """
+        `sample_every`: trace one frame out of this many, 1 traces every frame
+
+        `max_events`: events kept for export, the oldest are dropped first
+        """
+        self.sample_every = sample_every
+        self.events = deque(maxlen=max_events)
+        self.stats = {}
+        self.frames = []
+        self.process_name = process_name
+        self.active = False
+        self.stack = []
+        self.frame_stats = None
+        self.frames_seen = 0
+
+    def wrap(self, module, prefix=None):
+        """Proxy of `module` (cv2, np, ...) whose functions are traced, e.g. `cv = tracer.wrap(cv2)`."""
+        if prefix is None:
+            prefix = getattr(module, '__name__', 'module') + '.'
+        return _TracedModule(self, module, prefix)
+
+    def wrap_function(self, function, name=None):
+        name = name or getattr(function, '__qualname__', repr(function))
+
+        def traced(*args, **kwargs):
+            if not self.active:
+                return function(*args, **kwargs)
+            start = time.perf_counter_ns()
+            result = function(*args, **kwargs)
+            duration = time.perf_counter_ns() - start
+            self._record_call(name, start, duration, args, kwargs, result)
+            return result
+
+        traced.__name__ = getattr(function, '__name__', name)
+        traced.__wrapped__ = function
+        return traced
+
+    def _record_call(self, name, start, duration, args, kwargs, result):
+        first = _first_array(args, kwargs)
+        # dst= and other keyword arrays count as inputs: results written into them are not allocations
+        inputs = [a for a in itertools.chain(args, kwargs.values()) if isinstance(a, np.ndarray)]
+        allocated = _allocated_bytes(result, inputs)
+
+        stage = self.stack[-1][0] if len(self.stack) > 1 else ''
+        stats = self.stats.get((stage, name))
+        if stats is None:
+            stats = self.stats[stage, name] = _Stats()
+        stats.count += 1
+        stats.total_ns += duration
+        stats.max_ns = max(stats.max_ns, duration)
+        stats.bytes += allocated
+        if first is not None:
+            stats.shape = first.shape
+            stats.dtype = str(first.dtype)
+
+        if self.frame_stats is not None:
+            self.frame_stats[stage] = self.frame_stats.get(stage, 0) + duration
+
+        event_args = {'bytes': allocated}
+        if first is not None:
+            event_args['shape'] = list(first.shape)
+            event_args['dtype'] = str(first.dtype)
+        self.events.append((name, 'op', start, duration, tuple(s[0] for s in self.stack), event_args))
+
+    @contextmanager
+    def frame(self, index=None):
+        """One frame of the pipeline; decides whether this frame is sampled."""
+        index = self.frames_seen if index is None else index
+        self.frames_seen += 1
+        if (self.frames_seen - 1) % self.sample_every:
+            yield False
+            return
+
+        start = time.perf_counter_ns()
+        self.active = True
+        self.frame_stats = {}
+        self.stack.append(('frame %s' % index, start))
+        try:
+            yield True
+        finally:
+            self.stack.pop()
+            end = time.perf_counter_ns()
+            self.events.append(('frame %s' % index, 'frame', start, end - start, (), {}))
+            self.frames.append({'frame': index, 'ms': (end - start) / 1e6,
+                                'stages_ms': {k: v / 1e6 for k, v in self.frame_stats.items()}})
+            self.active = False
+            self.frame_stats = None
+
+    @contextmanager
+    def stage(self, name):
+        """A named pipeline stage inside a frame; its calls are aggregated under `name`."""
+        if not self.active:
+            yield
+            return
+        start = time.perf_counter_ns()
+        parents = tuple(s[0] for s in self.stack)
+        self.stack.append((name, start))
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self.events.append((name, 'stage', start, time.perf_counter_ns() - start, parents, {}))
+
+    def report(self):
+        """Rows of (stage, operator, calls, total ms, mean ms, max ms, MiB allocated, last input shape, dtype), slowest first."""
+        rows = [
+            (stage, name, s.count, s.total_ns / 1e6, s.total_ns / 1e6 / s.count, s.max_ns / 1e6,
+             s.bytes / 2**20, s.shape, s.dtype)
+            for (stage, name), s in self.stats.items()
+        ]
+        return sorted(rows, key=lambda row: -row[3])
+
+    def print_report(self):
+        print('%-12s %-22s %7s %10s %9s %9s %9s  %s' % (
+            'stage', 'operator', 'calls', 'total ms', 'mean ms', 'max ms', 'MiB', 'input'))
+        for stage, name, count, total, mean, maximum, mib, shape, dtype in self.report():
+            print('%-12s %-22s %7d %10.2f %9.3f %9.3f %9.1f  %s %s' % (
+                stage or '-', name, count, total, mean, maximum, mib, shape or '', dtype or ''))
+
+    def chrome_trace(self):
+        pid = os.getpid()
+        tid = threading.get_ident() % 2**31
+        events = [{'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': self.process_name}}]
+        for name, category, start, duration, _, args in self.events:
+            events.append({'name': name, 'cat': category, 'ph': 'X', 'pid': pid, 'tid': tid,
+                           'ts': start / 1e3, 'dur': duration / 1e3, 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
+
+    def folded_stacks(self):
+        """{'frame;stage;operator': self time in microseconds} over the kept events, frames merged."""
+        totals = {}
+        for name, category, _, duration, parents, _ in self.events:
+            # every frame under one root so that the flame graph adds them up
+            path = tuple('frames' if p.startswith('frame ') else p for p in parents)
+            own = path + ('frames',) if category == 'frame' else path + (name,)
+            totals[own] = totals.get(own, 0) + duration
+            if path:
+                totals[path] = totals.get(path, 0) - duration
+        return {';'.join(path): ns / 1e3 for path, ns in totals.items() if ns > 0}
+
+    def export_folded(self, path):
+        with open(path, 'w') as f:
+            for stack, microseconds in sorted(self.folded_stacks().items()):
+                f.write('%s %d\n' % (stack, round(microseconds)))
+
+
+def hough_pipeline(cv, tracer, frame):
+    """`hough_line.py`: resize, gray, Canny, HoughLines."""
+    with tracer.stage('prepare'):
+        img = cv.resize(frame, None, fx=1.5, fy=1.5, interpolation=cv2.INTER_CUBIC)
+        gray = cv.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    with tracer.stage('edges'):
+        edges = cv.Canny(gray, 0, 80, apertureSize=3)
+    with tracer.stage('lines'):
+        lines = cv.HoughLines(edges, 1, np.pi / 180, 110)
+    return lines
+
+
+def hsv_pipeline(cv, tracer, frame):
+    """`object_tracking.py`: HSV, inRange, bitwise_and."""
+    with tracer.stage('hsv'):
+        hsv = cv.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    with tracer.stage('mask'):
+        mask = cv.inRange(hsv, np.array([10, 100, 100]), np.array([245, 255, 255]))
+        res = cv.bitwise_and(frame, frame, mask=mask)
+    return res
+
+
+def check_dst_accounting():
+    """A result written into `dst`, passed by position or by keyword, allocates nothing."""
+    tracer = Tracer()
+    cv = tracer.wrap(cv2)
+    src = np.zeros((1000, 1000), np.uint8)
+    out = np.empty_like(src)
+    with tracer.frame():
+        with tracer.stage('positional'):
+            cv.GaussianBlur(src, (5, 5), 0, out)
+        with tracer.stage('keyword'):
+            cv.GaussianBlur(src, (5, 5), 0, dst=out)
+        with tracer.stage('allocating'):
+            cv.GaussianBlur(src, (5, 5), 0)
+    allocated = {row[0]: row[6] * 2**20 for row in tracer.report()}
+    assert allocated == {'positional': 0, 'keyword': 0, 'allocating': src.nbytes}, allocated
+
+
+def run(pipeline, frames, tracer=None):
+    """Seconds per frame of `pipeline` over `frames`, traced if `tracer` is given."""
+    traced = tracer is not None
+    if traced:
+        cv = tracer.wrap(cv2)
+    else:
+        # never inside a frame, so the stages only cost their context manager
+        tracer = Tracer()
+        cv = cv2
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        if traced:
+            with tracer.frame(i):
+                pipeline(cv, tracer, frame)
+        else:
+            pipeline(cv, tracer, frame)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', choices=list(SIZES), default='vga')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--sample-every', type=int, default=10)
+    parser.add_argument('--trace', help='write a Chrome trace to this file')
+    parser.add_argument('--folded', help='write folded stacks to this file')
+    args = parser.parse_args()
+
+    check_dst_accounting()
+    frames = [synthetic_image(SIZES[args.size], seed=i) for i in range(8)]
+    frames = [frames[i % len(frames)] for i in range(args.frames)]
+    pipelines = (('hough_line', hough_pipeline), ('object_tracking', hsv_pipeline))
+
+    for name, pipeline in pipelines:
+        plain = run(pipeline, frames)
+        every = run(pipeline, frames, Tracer(sample_every=1))
+        tracer = Tracer(sample_every=args.sample_every)
+        sampled = run(pipeline, frames, tracer)
+
+        print('%s: %.3f ms/frame untraced, %+.1f%% tracing every frame, %+.1f%% tracing 1 in %d' % (
+            name, plain * 1e3, (every / plain - 1) * 100, (sampled / plain - 1) * 100, args.sample_every))
+        tracer.print_report()
+        print()
+
+    # both pipelines on every frame, each as a stage of its own
+    def both(cv, tracer, frame):
+        for name, pipeline in pipelines:
+            with tracer.stage(name):
+                pipeline(cv, tracer, frame)
+
+    tracer = Tracer(sample_every=args.sample_every)
+    run(both, frames, tracer)
+    print('last sampled frames:')
+    for frame in tracer.frames[-3:]:
+        print('  frame %s: %.2f ms (%s)' % (frame['frame'], frame['ms'], ', '.join(
+            '%s %.2f' % item for item in frame['stages_ms'].items())))
+
+    if args.trace:
+        tracer.export_chrome_trace(args.trace)
+        print('wrote %s' % args.trace)
+    if args.folded:
+        tracer.export_folded(args.folded)
+        print('wrote %s' % args.folded)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+"""
+Multi-seed Q-learning experiments on a process pool.
+
+Every combination of the given `alpha`, `gamma`, epsilon schedule and map
+is trained with `--seeds` independent seeds. Each run gets its own RNG stream
+spawned from one root `SeedSequence`, so results do not depend on which
+worker picks a run up. Finished runs are written to the checkpoint directory
+as they complete; rerunning the same command skips them, so an interrupted
+sweep resumes where it stopped.
+
+Learning curves (success rate per window of episodes) are aggregated over the
+seeds with a 95% confidence interval.
+
+Usage:
+
+    python experiments.py --alpha 0.1 0.2 --gamma 0.8 0.95 --seeds 30 --workers 8
+    python experiments.py --maps slippery not-slippery --schedule linear exponential
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from q_table import QTable
+from vector_frozen_lake import FrozenLakeTables, greedy_success_rate, run_episodes
+
+MAP_SETTINGS = {
+    # FrozenLake-v0
+    'slippery': True,
+    # FrozenLakeNotSlippery-v0 from the notebook
+    'not-slippery': False,
+}
+
+# normal approximation of the two-sided 95% interval
+Z_95 = 1.96
+
+
+def epsilon_schedule(name, epsilon, num_episodes, final_epsilon=0.01):
+    if name == 'linear':
+        # the notebook's schedule: decrease by epsilon / num_episodes every episode
+        return epsilon - epsilon / num_episodes * np.arange(num_episodes)
+    if name == 'exponential':
+        decay = (final_epsilon / epsilon) ** (1.0 / max(num_episodes - 1, 1))
+        return epsilon * decay ** np.arange(num_episodes)
+    if name == 'constant':
+        return np.full(num_episodes, epsilon)
+    raise ValueError('unknown epsilon schedule: %s' % name)
+
+
+def setting_key(setting):
+    encoded = json.dumps(setting, sort_keys=True).encode()
+    return hashlib.sha1(encoded).hexdigest()[:12]
+
+
+def run_one(setting, seed_sequence, num_episodes, num_timesteps, window):
+    rng = np.random.default_rng(seed_sequence)
+    tables = FrozenLakeTables.from_desc(map_name='4x4', is_slippery=MAP_SETTINGS[setting['map']])
+    q_table = QTable(tables.num_states, tables.num_actions, alpha=setting['alpha'], gamma=setting['gamma'])
+
+    epsilons = epsilon_schedule(setting['schedule'], setting['epsilon'], num_episodes)
+    success = run_episodes(tables, q_table, epsilons, rng, num_timesteps)
+
+    num_windows = num_episodes // window
+    curve = success[:num_windows * window].reshape(num_windows, window).mean(axis=1)
+    greedy = greedy_success_rate(tables, q_table, num_envs=1000, seed=rng.integers(2**32))
+
+    return curve, greedy, q_table.q_table
+
+
+def checkpoint_path(directory, setting, root_seed, seed_index):
+    return os.path.join(directory, '%s-%d-seed%03d.npz' % (setting_key(setting), root_seed, seed_index))
+
+
+def save_run(path, setting, curve, greedy, q_table):
+    tmp = path + '.tmp.npz'
+    np.savez(tmp, curve=curve, greedy=greedy, q_table=q_table, setting=json.dumps(setting, sort_keys=True))
+    # the rename is atomic, a run is either fully checkpointed or not at all
+    os.replace(tmp, path)
+
+
+def run_experiments(settings, num_seeds, num_episodes=1000, num_timesteps=128, window=50,
+                    root_seed=0, workers=None, checkpoint_dir='experiments'):
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    tasks = []
+    for setting in settings:
+        # one child sequence per setting, keyed by the setting itself so the
+        # streams stay the same when settings are added or reordered
+        spawn_key = (int(setting_key(setting), 16),)
+        seed_sequences = np.random.SeedSequence(root_seed, spawn_key=spawn_key).spawn(num_seeds)
+        for seed_index, seed_sequence in enumerate(seed_sequences):
+            path = checkpoint_path(checkpoint_dir, setting, root_seed, seed_index)
+            if not os.path.exists(path):
+                tasks.append((setting, seed_sequence, path))
+
+    print('%d runs, %d already checkpointed' % (len(settings) * num_seeds, len(settings) * num_seeds - len(tasks)))
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(run_one, setting, seed_sequence, num_episodes, num_timesteps, window): (setting, path)
+            for setting, seed_sequence, path in tasks
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            setting, path = futures[future]
+            save_run(path, setting, *future.result())
+            if done % 10 == 0 or done == len(futures):
+                print('%d/%d runs finished' % (done, len(futures)), flush=True)
+
+    return aggregate(settings, num_seeds, root_seed, checkpoint_dir)
+
+
+def confidence_interval(values):
+    """Mean and half-width of the 95% interval over the first axis."""
+    values = np.asarray(values, dtype=np.float64)
+    mean = values.mean(axis=0)
+    if len(values) < 2:
+        return mean, np.zeros_like(mean)
+    return mean, Z_95 * values.std(axis=0, ddof=1) / np.sqrt(len(values))
+
+
+def aggregate(settings, num_seeds, root_seed, checkpoint_dir):
+    summary = []
+    for setting in settings:
+        curves = []
+        greedy = []
+        for seed_index in range(num_seeds):
+            with np.load(checkpoint_path(checkpoint_dir, setting, root_seed, seed_index)) as run:
+                curves.append(run['curve'])
+                greedy.append(float(run['greedy']))
+
+        curve_mean, curve_ci = confidence_interval(curves)
+        greedy_mean, greedy_ci = confidence_interval(greedy)
+        summary.append({
+            'setting': setting,
+            'curve_mean': curve_mean,
+            'curve_ci': curve_ci,
+            'greedy_mean': float(greedy_mean),
+            'greedy_ci': float(greedy_ci),
+        })
+    return summary
+
+
+def print_summary(summary, window):
+    print('%-13s %6s %6s %8s %-12s %22s %22s' % (
+        'map', 'alpha', 'gamma', 'epsilon', 'schedule', 'last %d episodes' % window, 'greedy success'))
+    for row in sorted(summary, key=lambda r: -r['greedy_mean']):
+        s = row['setting']
+        print('%-13s %6.3g %6.3g %8.3g %-12s %14.3f +- %.3f %14.3f +- %.3f' % (
+            s['map'], s['alpha'], s['gamma'], s['epsilon'], s['schedule'],
+            row['curve_mean'][-1], row['curve_ci'][-1],
+            row['greedy_mean'], row['greedy_ci']))
+
+
+def save_curves(summary, path, window):
+    with open(path, 'w') as f:
+        f.write('map,alpha,gamma,epsilon,schedule,episode,success_mean,success_ci\n')
+        for row in summary:
+            s = row['setting']
+            for i, (mean, ci) in enumerate(zip(row['curve_mean'], row['curve_ci'])):
+                f.write('%s,%g,%g,%g,%s,%d,%f,%f\n' % (
+                    s['map'], s['alpha'], s['gamma'], s['epsilon'], s['schedule'], (i + 1) * window, mean, ci))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--maps', nargs='+', choices=sorted(MAP_SETTINGS), default=['slippery'])
+    parser.add_argument('--alpha', type=float, nargs='+', default=[0.2])
+    parser.add_argument('--gamma', type=float, nargs='+', default=[0.8])
+    parser.add_argument('--epsilon', type=float, nargs='+', default=[0.8])
+    parser.add_argument('--schedule', nargs='+', choices=['linear', 'exponential', 'constant'], default=['linear'])
+    parser.add_argument('--seeds', type=int, default=20)
+    parser.add_argument('--episodes', type=int, default=1000)
+    parser.add_argument('--window', type=int, default=50)
+    parser.add_argument('--root-seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--checkpoint-dir', default='experiments')
+    parser.add_argument('--curves', help='write the aggregated learning curves to this CSV file')
+    args = parser.parse_args()
+    if not 1 <= args.window <= args.episodes:
+        parser.error('--window must be between 1 and --episodes (%d)' % args.episodes)
+
+    settings = [
+        {'map': m, 'alpha': a, 'gamma': g, 'epsilon': e, 'schedule': s,
+         'episodes': args.episodes, 'window': args.window}
+        for m, a, g, e, s in itertools.product(args.maps, args.alpha, args.gamma, args.epsilon, args.schedule)
+    ]
+
+    summary = run_experiments(
+        settings, args.seeds,
+        num_episodes=args.episodes,
+        window=args.window,
+        root_seed=args.root_seed,
+        workers=args.workers,
+        checkpoint_dir=args.checkpoint_dir,
+    )
+    print_summary(summary, args.window)
+    if args.curves:
+        save_curves(summary, args.curves, args.window)
+
+
+if __name__ == '__main__':
+    main()
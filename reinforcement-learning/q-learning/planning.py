@@ -0,0 +1,180 @@
+"""
+Model-based planning on the FrozenLake transition tables.
+
+When the transition model is known (`env.P`), value iteration and policy
+iteration find the optimal Q-table directly instead of sampling episodes.
+The model is kept in the `(num_states, num_actions, num_outcomes)` layout of
+`FrozenLakeTables`, i.e. only the reachable next states of every
+state-action pair are stored. A dense `num_states x num_states` matrix per
+action would need 4 * 4096^2 entries already for a 64x64 map.
+
+Usage:
+
+    python planning.py --map 4x4
+    python planning.py --size 64 --gamma 0.99 --skip-sampling
+"""
+import argparse
+import time
+
+import numpy as np
+
+from q_table import QTable
+from vector_frozen_lake import FrozenLakeTables, VectorFrozenLake, MAPS, generate_random_map, \
+    greedy_success_rate, shaped_rewards, train_vectorized
+
+
+def shaped_reward_table(tables, hole_reward=-10, goal_reward=10, wall_reward=-1):
+    """Per-outcome rewards with the notebook's shaping, same shape as `tables.reward`."""
+    states = np.broadcast_to(np.arange(tables.num_states)[:, None, None], tables.next_state.shape)
+    shaped = shaped_rewards(
+        states.ravel(),
+        tables.next_state.ravel(),
+        tables.reward.ravel(),
+        tables.done.ravel(),
+        hole_reward, goal_reward, wall_reward
+    ).reshape(tables.next_state.shape)
+
+    # terminal states loop onto themselves, nothing more happens there
+    shaped[tables.terminal_states] = 0
+    return shaped
+
+
+class PlanningModel:
+    """
+    Expected rewards and discount-weighted outcome probabilities of a
+    transition model, precomputed so that every Bellman backup is two
+    gathers and a sum.
+    """
+
+    def __init__(self, tables, rewards=None, gamma=0.99):
+        rewards = tables.reward if rewards is None else rewards
+        self.tables = tables
+        self.gamma = gamma
+        self.next_state = tables.next_state
+        self.expected_reward = (tables.prob * rewards).sum(axis=2)
+        # terminal transitions do not bootstrap
+        self.weights = gamma * tables.prob * ~tables.done
+
+    def backup(self, V):
+        """Q(s, a) = R(s, a) + gamma * sum_k p_k * V(s'_k)"""
+        return self.expected_reward + (self.weights * V[self.next_state]).sum(axis=2)
+
+    def evaluate(self, policy, V, tol, max_iterations):
+        states = np.arange(len(policy))
+        next_state = self.next_state[states, policy]
+        weights = self.weights[states, policy]
+        reward = self.expected_reward[states, policy]
+        for i in range(max_iterations):
+            new_V = reward + (weights * V[next_state]).sum(axis=1)
+            delta = np.max(np.abs(new_V - V))
+            V = new_V
+            if delta < tol:
+                break
+        return V, i + 1
+
+
+def value_iteration(model, tol=1e-12, max_iterations=100000):
+    """Returns `(Q, V, num_iterations)`."""
+    V = np.zeros(model.tables.num_states)
+    for i in range(max_iterations):
+        Q = model.backup(V)
+        new_V = Q.max(axis=1)
+        delta = np.max(np.abs(new_V - V))
+        V = new_V
+        if delta < tol:
+            break
+    return model.backup(V), V, i + 1
+
+
+def policy_iteration(model, tol=1e-12, max_iterations=1000, max_eval_iterations=100000):
+    """
+    Policy iteration with iterative policy evaluation (a linear solve would
+    need the dense transition matrix). Returns `(Q, V, num_improvements,
+    num_evaluation_sweeps)`.
+    """
+    num_states = model.tables.num_states
+    policy = np.zeros(num_states, dtype=np.int64)
+    V = np.zeros(num_states)
+    sweeps = 0
+
+    for i in range(max_iterations):
+        V, n = model.evaluate(policy, V, tol, max_eval_iterations)
+        sweeps += n
+
+        Q = model.backup(V)
+        # keep the current action on ties so the loop terminates
+        best = Q.max(axis=1)
+        current = Q[np.arange(num_states), policy]
+        new_policy = np.where(current >= best - 1e-12, policy, Q.argmax(axis=1))
+        if np.array_equal(new_policy, policy):
+            break
+        policy = new_policy
+
+    return model.backup(V), V, i + 1, sweeps
+
+
+def to_q_table(Q, alpha=0.2, gamma=0.99):
+    num_states, num_actions = Q.shape
+    q_table = QTable(num_states, num_actions, alpha=alpha, gamma=gamma)
+    q_table.q_table[:] = Q
+    return q_table
+
+
+def model_nbytes(tables):
+    return tables.next_state.nbytes + tables.prob.nbytes + tables.reward.nbytes + tables.done.nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--map', default='4x4', choices=sorted(MAPS))
+    parser.add_argument('--size', type=int, help='generate a random size x size map instead')
+    parser.add_argument('--frozen-prob', type=float, default=0.9)
+    parser.add_argument('--not-slippery', action='store_true')
+    parser.add_argument('--gamma', type=float, default=0.99)
+    parser.add_argument('--shaped', action='store_true', help="plan on the notebook's shaped rewards")
+    parser.add_argument('--skip-sampling', action='store_true')
+    parser.add_argument('--sampling-episodes', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    desc = generate_random_map(args.size, args.frozen_prob, seed=args.seed) if args.size else MAPS[args.map]
+    tables = FrozenLakeTables.from_desc(desc, is_slippery=not args.not_slippery)
+    rewards = shaped_reward_table(tables) if args.shaped else None
+    # generous step budget for the slippery dynamics to cross the map
+    max_steps = 40 * len(desc)
+
+    dense_bytes = tables.num_actions * tables.num_states ** 2 * 8
+    print('%d states, model %.1f MiB (dense: %.1f MiB)' % (
+        tables.num_states, model_nbytes(tables) / 2**20, dense_bytes / 2**20))
+
+    results = []
+
+    start = time.perf_counter()
+    model = PlanningModel(tables, rewards, args.gamma)
+    Q, V, iterations = value_iteration(model)
+    seconds = time.perf_counter() - start
+    results.append(('value iteration', '%d sweeps' % iterations, seconds, to_q_table(Q, gamma=args.gamma)))
+
+    start = time.perf_counter()
+    model = PlanningModel(tables, rewards, args.gamma)
+    Q, V, improvements, sweeps = policy_iteration(model)
+    seconds = time.perf_counter() - start
+    results.append(('policy iteration', '%d/%d' % (improvements, sweeps), seconds, to_q_table(Q, gamma=args.gamma)))
+
+    if not args.skip_sampling:
+        q_table = QTable(tables.num_states, tables.num_actions)
+        env = VectorFrozenLake(1024, tables=tables, max_steps=128, seed=args.seed)
+        start = time.perf_counter()
+        train_vectorized(env, q_table, args.sampling_episodes)
+        seconds = time.perf_counter() - start
+        results.append(('q-learning (vectorized)', '%d episodes' % args.sampling_episodes, seconds, q_table))
+
+    print('%-24s %18s %10s %16s' % ('solver', 'iterations', 'seconds', 'greedy success'))
+    for name, iterations, seconds, q_table in results:
+        print('%-24s %18s %10.3f %16.3f' % (
+            name, iterations, seconds,
+            greedy_success_rate(tables, q_table, num_envs=2000, max_steps=max_steps, seed=args.seed)))
+
+
+if __name__ == '__main__':
+    main()
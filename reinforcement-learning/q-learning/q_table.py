@@ -0,0 +1,181 @@
+"""
+Tabular Q function used by the FrozenLake notebook and scripts.
+
+Besides the one-transition `update_table`/`get_next_action` calls,
+`update_batch` and `get_next_actions` work on whole arrays of transitions and
+states, for training from replay batches or vectorized environments.
+
+Usage (updates/sec benchmark):
+
+    python q_table.py --batch-size 65536
+"""
+import argparse
+import time
+
+import numpy as np
+
+
+def scatter_updates(flat_table, flat_index, targets, step, weighted=False):
+    """
+    `flat_table[flat_index] = (1 - step) * flat_table[flat_index] + step * targets`
+    with repeated indices applied one after the other in array order, see
+    `QTable.update_batch`. `step` is a scalar, or an array when `weighted`.
+    """
+    unique, inverse, counts = np.unique(flat_index, return_inverse=True, return_counts=True)
+    if len(unique) == len(flat_index):
+        # no repeated pairs, plain scatter
+        flat_table[flat_index] = (1 - step) * flat_table[flat_index] + step * targets
+        return
+
+    # transitions grouped by pair, in batch order within each group
+    order = np.argsort(inverse, kind='stable')
+    group_start = np.cumsum(counts) - counts
+
+    if not weighted:
+        # position inside the group counted from the last update (0 for the last one)
+        position = np.empty(len(flat_index), dtype=np.int64)
+        position[order] = np.arange(len(flat_index)) - group_start[inverse[order]]
+        from_last = counts[inverse] - 1 - position
+        scale = step * (1 - step) ** from_last
+        decay = (1 - step) ** counts
+    else:
+        # same products with a different step per transition, in log space:
+        # scale_i = step_i * prod_{j after i} (1 - step_j)
+        log_keep = np.log1p(-np.minimum(step, 1 - 1e-12))
+        inclusive = np.empty(len(flat_index))
+        inclusive[order] = np.cumsum(log_keep[order])
+        group_total = np.bincount(inverse, weights=log_keep, minlength=len(unique))
+        group_before = inclusive[order][group_start] - log_keep[order][group_start]
+        after = group_total[inverse] - (inclusive - group_before[inverse])
+        scale = step * np.exp(after)
+        decay = np.exp(group_total)
+
+    contribution = np.bincount(inverse, weights=scale * targets, minlength=len(unique))
+    flat_table[unique] = decay * flat_table[unique] + contribution
+
+
+class QTable:
+    def __init__(self, num_states, num_actions, alpha=0.2, gamma=0.8):
+        """
+        `alpha`: learning rate
+
+        `gamma`: discount factor
+        """
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.alpha = alpha  # learning rate
+        self.gamma = gamma  # discount factor
+        # Initialize Q table with 0
+        self.q_table = np.zeros((num_states, num_actions), dtype=np.float64)
+
+    def update_table(self, state, action, reward, new_state):
+        # self.q_table[state, action] = self.q_table[state, action] - self.alpha * (reward + self.gamma * np.max(self.q_table[new_state]) - self.q_table[state, action])
+
+        # or
+        self.q_table[state, action] = (1 - self.alpha) * self.q_table[state, action] + \
+            self.alpha * (reward + self.gamma *
+                          np.max(self.q_table[new_state]))
+
+    def update_batch(self, states, actions, rewards, new_states, dones=None, weights=None):
+        """
+        Apply `update_table` to arrays of transitions at once.
+
+        All targets bootstrap from the table as it was before the batch. When
+        the same (state, action) pair appears several times, its updates are
+        applied in batch order, so with k updates the entry becomes
+
+            (1 - alpha)^k * Q + sum_i alpha * (1 - alpha)^(k - i) * target_i
+
+        which is what k calls to `update_table` give when the targets do not
+        change in between.
+
+        `dones`: optional boolean array, terminal transitions do not bootstrap
+
+        `weights`: optional per-transition scale of the learning rate, e.g.
+        importance sampling weights from prioritized replay
+        """
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        if states.size == 0:
+            return
+
+        targets = self._targets(rewards, new_states, dones)
+        step = self.alpha if weights is None else self.alpha * np.asarray(weights, dtype=np.float64)
+
+        scatter_updates(self.q_table.reshape(-1), states * self.num_actions + actions, targets, step,
+                        weighted=weights is not None)
+
+    def td_errors(self, states, actions, rewards, new_states, dones=None):
+        """Target minus current value for arrays of transitions, e.g. as replay priorities."""
+        return self._targets(rewards, new_states, dones) - self.q_table[states, actions]
+
+    def _targets(self, rewards, new_states, dones):
+        bootstrap = self.q_table[new_states].max(axis=1)
+        if dones is not None:
+            bootstrap = np.where(dones, 0.0, bootstrap)
+        return rewards + self.gamma * bootstrap
+
+    def get_next_action(self, state):
+        return np.argmax(self.q_table[state])
+
+    def get_next_actions(self, states, epsilon=0.0, rng=None):
+        """
+        Epsilon-greedy actions for an array of states. Returns the actions and
+        a boolean array telling which of them were random.
+        """
+        actions = self.q_table[states].argmax(axis=1)
+        if epsilon <= 0:
+            return actions, np.zeros(len(actions), dtype=bool)
+
+        rng = rng if rng is not None else np.random.default_rng()
+        explore = rng.random(len(actions)) < epsilon
+        num_explore = int(np.count_nonzero(explore))
+        actions[explore] = rng.integers(self.num_actions, size=num_explore)
+        return actions, explore
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--num-states', type=int, default=16)
+    parser.add_argument('--num-actions', type=int, default=4)
+    parser.add_argument('--batch-size', type=int, default=65536)
+    parser.add_argument('--num-batches', type=int, default=50)
+    parser.add_argument('--num-scalar', type=int, default=100000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+
+    def transitions(n):
+        return (
+            rng.integers(args.num_states, size=n),
+            rng.integers(args.num_actions, size=n),
+            rng.standard_normal(n),
+            rng.integers(args.num_states, size=n),
+        )
+
+    q_table = QTable(args.num_states, args.num_actions)
+    states, actions, rewards, new_states = transitions(args.num_scalar)
+    start = time.perf_counter()
+    for i in range(args.num_scalar):
+        q_table.update_table(states[i], actions[i], rewards[i], new_states[i])
+    scalar_rate = args.num_scalar / (time.perf_counter() - start)
+
+    q_table = QTable(args.num_states, args.num_actions)
+    batches = [transitions(args.batch_size) for _ in range(args.num_batches)]
+    start = time.perf_counter()
+    for batch in batches:
+        q_table.update_batch(*batch)
+    batch_rate = args.batch_size * args.num_batches / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for batch in batches:
+        q_table.get_next_actions(batch[0], epsilon=0.1, rng=rng)
+    action_rate = args.batch_size * args.num_batches / (time.perf_counter() - start)
+
+    print('update_table:     %12.0f updates/sec' % scalar_rate)
+    print('update_batch:     %12.0f updates/sec (batch of %d)' % (batch_rate, args.batch_size))
+    print('get_next_actions: %12.0f actions/sec' % action_rate)
+
+
+if __name__ == '__main__':
+    main()
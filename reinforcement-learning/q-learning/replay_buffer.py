@@ -0,0 +1,266 @@
+"""
+Fixed-capacity experience replay with uniform and prioritized sampling.
+
+Transitions are stored column by column in preallocated NumPy arrays (a
+ring buffer), so the same buffer works for the tabular `QTable` (integer
+states) and for a neural Q-function (observation vectors): only the field
+specs change.
+
+`PrioritizedReplayBuffer` keeps the priorities in an array-backed sum tree,
+priority updates and sampling are O(log n) per transition and vectorized
+over the whole batch.
+
+Usage (sampling throughput benchmark):
+
+    python replay_buffer.py --capacity 1000000 --batch-size 256
+"""
+import argparse
+import time
+
+import numpy as np
+
+from q_table import QTable
+from vector_frozen_lake import FrozenLakeTables, VectorFrozenLake, greedy_success_rate, shaped_rewards
+
+# field name -> (shape of one transition, dtype)
+TABULAR_FIELDS = {
+    'state': ((), np.int64),
+    'action': ((), np.int64),
+    'reward': ((), np.float64),
+    'new_state': ((), np.int64),
+    'done': ((), np.bool_),
+}
+
+
+class ReplayBuffer:
+    def __init__(self, capacity, fields=TABULAR_FIELDS, seed=None):
+        self.capacity = capacity
+        self.fields = fields
+        self.columns = {
+            name: np.zeros((capacity,) + tuple(shape), dtype=dtype)
+            for name, (shape, dtype) in fields.items()
+        }
+        self.rng = np.random.default_rng(seed)
+        self.size = 0
+        self.position = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, **transition):
+        return self.add_batch(**{name: np.asarray(value)[None] for name, value in transition.items()})
+
+    def add_batch(self, **transitions):
+        """Append arrays of transitions, overwriting the oldest ones when full. Returns their indices."""
+        n = len(next(iter(transitions.values())))
+        if n > self.capacity:
+            # only the newest `capacity` transitions would survive anyway
+            transitions = {name: values[-self.capacity:] for name, values in transitions.items()}
+            n = self.capacity
+
+        indices = (self.position + np.arange(n)) % self.capacity
+        for name in self.fields:
+            self.columns[name][indices] = transitions[name]
+
+        self.position = (self.position + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+        return indices
+
+    def gather(self, indices):
+        return {name: column[indices] for name, column in self.columns.items()}
+
+    def sample(self, batch_size):
+        """Uniformly sampled transitions (with replacement) and their indices."""
+        indices = self.rng.integers(self.size, size=batch_size)
+        return self.gather(indices), indices
+
+
+class SumTree:
+    """
+    Binary tree over `capacity` leaves stored in one array: node `i` has
+    children `2i` and `2i + 1`, the leaves start at `self.leaf_start` and the
+    root (index 1) holds the sum of all priorities.
+    """
+
+    def __init__(self, capacity):
+        self.leaf_start = 1
+        while self.leaf_start < capacity:
+            self.leaf_start *= 2
+        self.depth = self.leaf_start.bit_length() - 1
+        self.tree = np.zeros(2 * self.leaf_start, dtype=np.float64)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def __getitem__(self, indices):
+        return self.tree[self.leaf_start + np.asarray(indices)]
+
+    def update(self, indices, priorities):
+        nodes = self.leaf_start + np.asarray(indices)
+        self.tree[nodes] = priorities
+        # recompute the parents level by level, each touched parent once
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, values):
+        """Leaf indices whose cumulative priority range contains each of `values`."""
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            left_sum = self.tree[left]
+            go_right = values >= left_sum
+            values = np.where(go_right, values - left_sum, values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.leaf_start
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Proportional prioritized replay: transition `i` is sampled with
+    probability `p_i^alpha / sum_k p_k^alpha` and comes with the importance
+    sampling weight `(N * P(i))^-beta`, normalized by the largest weight.
+
+    `alpha`: how much prioritization is used (0 is uniform)
+
+    `beta`: how much of the sampling bias is corrected (1 is fully)
+    """
+
+    def __init__(self, capacity, fields=TABULAR_FIELDS, alpha=0.6, beta=0.4, epsilon=1e-6, seed=None):
+        super().__init__(capacity, fields, seed)
+        self.alpha = alpha
+        self.beta = beta
+        self.epsilon = epsilon
+        self.tree = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def add_batch(self, **transitions):
+        indices = super().add_batch(**transitions)
+        # new transitions get the largest priority so they are replayed at least once
+        self.tree.update(indices, np.full(len(indices), self.max_priority ** self.alpha))
+        return indices
+
+    def sample(self, batch_size, beta=None):
+        """Returns the transitions, their indices and importance sampling weights."""
+        beta = self.beta if beta is None else beta
+        total = self.tree.total
+
+        # stratified: one uniform draw from each of `batch_size` equal segments
+        segment = total / batch_size
+        values = (np.arange(batch_size) + self.rng.random(batch_size)) * segment
+        indices = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+        # float round-off can land on an empty leaf past the end
+        indices = np.minimum(indices, self.size - 1)
+
+        probabilities = self.tree[indices] / total
+        weights = (self.size * probabilities) ** -beta
+        weights /= weights.max()
+
+        return self.gather(indices), indices, weights
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+
+def train_with_replay(tables, q_table, buffer, num_steps, num_envs=64, batch_size=256, epsilon=0.8, seed=None):
+    """
+    Collect transitions from vectorized environments into `buffer` and
+    update `q_table` from sampled batches instead of from the transitions
+    just observed.
+    """
+    env = VectorFrozenLake(num_envs, tables=tables, max_steps=128, seed=seed)
+    rng = np.random.default_rng(seed)
+    prioritized = isinstance(buffer, PrioritizedReplayBuffer)
+
+    states = env.reset()
+    for step in range(num_steps):
+        current_epsilon = epsilon * (1 - step / num_steps)
+        actions, _ = q_table.get_next_actions(states, current_epsilon, rng)
+        new_states, rewards, dones, _ = env.step(actions)
+
+        buffer.add_batch(
+            state=states,
+            action=actions,
+            reward=shaped_rewards(states, new_states, rewards, dones),
+            new_state=new_states,
+            done=dones,
+        )
+        states = env.states.copy()
+
+        if len(buffer) < batch_size:
+            continue
+
+        if prioritized:
+            batch, indices, weights = buffer.sample(batch_size, beta=buffer.beta + (1 - buffer.beta) * step / num_steps)
+            td_errors = q_table.td_errors(batch['state'], batch['action'], batch['reward'], batch['new_state'], batch['done'])
+            q_table.update_batch(batch['state'], batch['action'], batch['reward'], batch['new_state'], batch['done'], weights=weights)
+            buffer.update_priorities(indices, td_errors)
+        else:
+            batch, indices = buffer.sample(batch_size)
+            q_table.update_batch(batch['state'], batch['action'], batch['reward'], batch['new_state'], batch['done'])
+
+
+def benchmark(buffer, batch_size, num_batches, prioritized):
+    start = time.perf_counter()
+    for _ in range(num_batches):
+        if prioritized:
+            batch, indices, weights = buffer.sample(batch_size)
+        else:
+            batch, indices = buffer.sample(batch_size)
+    sample_rate = batch_size * num_batches / (time.perf_counter() - start)
+
+    update_rate = None
+    if prioritized:
+        td_errors = buffer.rng.standard_normal(batch_size)
+        start = time.perf_counter()
+        for _ in range(num_batches):
+            buffer.update_priorities(indices, td_errors)
+        update_rate = batch_size * num_batches / (time.perf_counter() - start)
+
+    return sample_rate, update_rate
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--capacity', type=int, default=1000000)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--num-batches', type=int, default=2000)
+    parser.add_argument('--train-steps', type=int, default=3000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    n = args.capacity
+    transitions = {
+        'state': rng.integers(16, size=n),
+        'action': rng.integers(4, size=n),
+        'reward': rng.standard_normal(n),
+        'new_state': rng.integers(16, size=n),
+        'done': rng.random(n) < 0.1,
+    }
+
+    print('%-12s %18s %22s %12s' % ('buffer', 'fill (trans/sec)', 'sample (trans/sec)', 'update/sec'))
+    for name, cls in (('uniform', ReplayBuffer), ('prioritized', PrioritizedReplayBuffer)):
+        buffer = cls(args.capacity, seed=args.seed)
+        start = time.perf_counter()
+        for i in range(0, n, 4096):
+            buffer.add_batch(**{k: v[i:i + 4096] for k, v in transitions.items()})
+        fill_rate = n / (time.perf_counter() - start)
+
+        sample_rate, update_rate = benchmark(buffer, args.batch_size, args.num_batches, cls is PrioritizedReplayBuffer)
+        print('%-12s %18.0f %22.0f %12s' % (
+            name, fill_rate, sample_rate, '-' if update_rate is None else '%.0f' % update_rate))
+
+    tables = FrozenLakeTables.from_desc(map_name='4x4', is_slippery=True)
+    for name, cls in (('uniform', ReplayBuffer), ('prioritized', PrioritizedReplayBuffer)):
+        q_table = QTable(tables.num_states, tables.num_actions)
+        train_with_replay(tables, q_table, cls(100000, seed=args.seed), args.train_steps, seed=args.seed)
+        print('%s replay: greedy success %.3f' % (name, greedy_success_rate(tables, q_table, seed=args.seed)))
+
+
+if __name__ == '__main__':
+    main()
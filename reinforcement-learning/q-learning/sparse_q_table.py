@@ -0,0 +1,273 @@
+"""
+Hash-backed Q table that stores only the states it has seen.
+
+`QTable` allocates `num_states x num_actions` values up front, which stops
+working once the states are the cells of a large generated map or a
+composite observation (several discrete features packed into one integer)
+where most states are never visited. `SparseQTable` has the same interface
+(`update_table`, `get_next_action`, `update_batch`, `get_next_actions`,
+`td_errors`) and keeps the rows of visited states in an open-addressing
+hash table:
+
+- keys (the states, any non-negative int64) and rows live in two flat
+  arrays, slots are found by a multiplicative hash and linear probing
+- the table doubles when it is more than `max_load` full, so inserts are
+  amortized O(1)
+- batched lookups and inserts probe all states of a batch together with
+  NumPy, one vectorized round per probe step
+- an unseen state reads as a row of zeros, like a fresh `QTable`, and is
+  only inserted when it gets updated
+
+Usage (memory and updates/sec against `QTable` on generated maps):
+
+    python sparse_q_table.py --sizes 64 256 512 --steps 2000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from q_table import QTable, scatter_updates
+from vector_frozen_lake import FrozenLakeTables, VectorFrozenLake, generate_random_map, shaped_rewards
+
+EMPTY = -1
+# 2^64 / golden ratio, spreads consecutive states over the whole table
+HASH_MULTIPLIER = 0x9E3779B97F4A7C15
+UINT64_MASK = (1 << 64) - 1
+
+
+class SparseQTable:
+    def __init__(self, num_states, num_actions, alpha=0.2, gamma=0.8, capacity=1024, max_load=0.5):
+        """
+        `num_states`: only informational, states can be any non-negative int64
+
+        `capacity`: initial number of slots, rounded up to a power of two
+
+        `max_load`: fraction of used slots above which the table doubles
+        """
+        self.num_states = num_states
+        self.num_actions = num_actions
+        self.alpha = alpha  # learning rate
+        self.gamma = gamma  # discount factor
+        self.max_load = max_load
+        self.size = 0
+        self._allocate(1 << max(int(capacity) - 1, 1).bit_length())
+
+    def _allocate(self, capacity):
+        self.capacity = capacity
+        self.bits = capacity.bit_length() - 1
+        self.mask = capacity - 1
+        self.keys = np.full(capacity, EMPTY, dtype=np.int64)
+        # one extra row that stays zero: slot -1 (not found) reads it
+        self.values = np.zeros((capacity + 1, self.num_actions), dtype=np.float64)
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        return self.keys.nbytes + self.values.nbytes
+
+    def _hash(self, states):
+        product = states.astype(np.uint64) * np.uint64(HASH_MULTIPLIER)
+        return (product >> np.uint64(64 - self.bits)).astype(np.int64)
+
+    def _slot(self, state):
+        """Slot of `state` or -1, one state at a time without NumPy overhead."""
+        state = int(state)
+        keys = self.keys
+        pos = ((state * HASH_MULTIPLIER) & UINT64_MASK) >> (64 - self.bits)
+        while True:
+            key = keys[pos]
+            if key == state:
+                return pos
+            if key == EMPTY:
+                return -1
+            pos = (pos + 1) & self.mask
+
+    def _insert_slot(self, state):
+        slot = self._slot(state)
+        if slot >= 0:
+            return slot
+        if self.size + 1 > self.max_load * self.capacity:
+            self._grow(self.size + 1)
+        return self._insert_new(np.array([state], dtype=np.int64))[0]
+
+    def find(self, states):
+        """Slots of an array of states, -1 for states not in the table."""
+        states = np.asarray(states, dtype=np.int64).reshape(-1)
+        slots = np.full(len(states), -1, dtype=np.int64)
+        active = np.arange(len(states))
+        pos = self._hash(states)
+        while len(active):
+            keys = self.keys[pos]
+            hit = keys == states[active]
+            slots[active[hit]] = pos[hit]
+            probing = ~hit & (keys != EMPTY)
+            active = active[probing]
+            pos = (pos[probing] + 1) & self.mask
+        return slots
+
+    def _insert_new(self, new_keys):
+        """Insert distinct keys that are not in the table yet, returns their slots."""
+        slots = np.empty(len(new_keys), dtype=np.int64)
+        active = np.arange(len(new_keys))
+        pos = self._hash(new_keys)
+        while len(active):
+            free = self.keys[pos] == EMPTY
+            # keys probing the same free slot all write it, one of them wins
+            self.keys[pos[free]] = new_keys[active[free]]
+            won = free & (self.keys[pos] == new_keys[active])
+            slots[active[won]] = pos[won]
+            active = active[~won]
+            pos = (pos[~won] + 1) & self.mask
+        self.size += len(new_keys)
+        return slots
+
+    def _grow(self, min_size):
+        capacity = self.capacity
+        while min_size > self.max_load * capacity:
+            capacity *= 2
+        keys, values = self.keys, self.values
+        used = keys != EMPTY
+        self._allocate(capacity)
+        self.size = 0
+        self.values[self._insert_new(keys[used])] = values[:-1][used]
+
+    def insert(self, states):
+        """Slots of an array of states, inserting the missing ones with zero rows."""
+        states = np.asarray(states, dtype=np.int64).reshape(-1)
+        slots = self.find(states)
+        missing = slots < 0
+        if not missing.any():
+            return slots
+
+        new_keys, inverse = np.unique(states[missing], return_inverse=True)
+        if self.size + len(new_keys) > self.max_load * self.capacity:
+            self._grow(self.size + len(new_keys))
+            slots = self.find(states)
+        slots[missing] = self._insert_new(new_keys)[inverse]
+        return slots
+
+    def lookup(self, states):
+        """Q values of an array of states, shape `(len(states), num_actions)`, zeros for unseen states."""
+        return self.values[self.find(states)]
+
+    def to_dense(self):
+        """The equivalent `QTable`, for small state spaces."""
+        q_table = QTable(self.num_states, self.num_actions, self.alpha, self.gamma)
+        used = self.keys != EMPTY
+        q_table.q_table[self.keys[used]] = self.values[:-1][used]
+        return q_table
+
+    def update_table(self, state, action, reward, new_state):
+        bootstrap = np.max(self.values[self._slot(new_state)])
+        # insert first, the insert may reallocate `values`
+        slot = self._insert_slot(state)
+        row = self.values[slot]
+        row[action] = (1 - self.alpha) * row[action] + self.alpha * (reward + self.gamma * bootstrap)
+
+    def update_batch(self, states, actions, rewards, new_states, dones=None, weights=None):
+        """Same as `QTable.update_batch`, unseen states are inserted first."""
+        states = np.asarray(states)
+        actions = np.asarray(actions)
+        if states.size == 0:
+            return
+
+        targets = self._targets(rewards, new_states, dones)
+        step = self.alpha if weights is None else self.alpha * np.asarray(weights, dtype=np.float64)
+
+        slots = self.insert(states)
+        # the live rows, without the zero row at the end
+        flat_table = self.values[:-1].reshape(-1)
+        scatter_updates(flat_table, slots * self.num_actions + actions, targets, step, weighted=weights is not None)
+
+    def td_errors(self, states, actions, rewards, new_states, dones=None):
+        """Target minus current value for arrays of transitions, e.g. as replay priorities."""
+        current = self.lookup(states)[np.arange(len(actions)), actions]
+        return self._targets(rewards, new_states, dones) - current
+
+    def _targets(self, rewards, new_states, dones):
+        bootstrap = self.lookup(new_states).max(axis=1)
+        if dones is not None:
+            bootstrap = np.where(dones, 0.0, bootstrap)
+        return rewards + self.gamma * bootstrap
+
+    def get_next_action(self, state):
+        return np.argmax(self.values[self._slot(state)])
+
+    def get_next_actions(self, states, epsilon=0.0, rng=None):
+        """Same as `QTable.get_next_actions`."""
+        actions = self.lookup(states).argmax(axis=1)
+        if epsilon <= 0:
+            return actions, np.zeros(len(actions), dtype=bool)
+
+        rng = rng if rng is not None else np.random.default_rng()
+        explore = rng.random(len(actions)) < epsilon
+        num_explore = int(np.count_nonzero(explore))
+        actions[explore] = rng.integers(self.num_actions, size=num_explore)
+        return actions, explore
+
+
+def train_steps(env, q_table, num_steps, epsilon=0.5):
+    """`num_steps` epsilon-greedy steps of all environments with the notebook's shaped rewards."""
+    states = env.reset()
+    for _ in range(num_steps):
+        actions, _ = q_table.get_next_actions(states, epsilon, env.rng)
+        new_states, rewards, dones, _ = env.step(actions)
+        q_table.update_batch(states, actions, shaped_rewards(states, new_states, rewards, dones), new_states)
+        states = env.states.copy()
+
+
+def scalar_rate(q_table, num_states, num_updates, seed=0):
+    rng = np.random.default_rng(seed)
+    # revisit a small working set, like an agent near the start of a large map
+    states = rng.integers(min(num_states, 4096), size=num_updates)
+    actions = rng.integers(q_table.num_actions, size=num_updates)
+    new_states = rng.integers(min(num_states, 4096), size=num_updates)
+    start = time.perf_counter()
+    for i in range(num_updates):
+        q_table.update_table(states[i], actions[i], -1.0, new_states[i])
+        q_table.get_next_action(new_states[i])
+    return num_updates / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[64, 256, 512], help='side of the generated maps')
+    parser.add_argument('--num-envs', type=int, default=1024)
+    parser.add_argument('--steps', type=int, default=2000)
+    parser.add_argument('--scalar-updates', type=int, default=100000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print('%-6s %9s %8s %12s %12s %15s %15s %14s %15s %9s' % (
+        'map', 'states', 'visited', 'dense MiB', 'sparse MiB', 'dense upd/s', 'sparse upd/s',
+        'dense scalar/s', 'sparse scalar/s', 'max diff'))
+    for size in args.sizes:
+        tables = FrozenLakeTables.from_desc(generate_random_map(size, 0.9, seed=args.seed))
+        num_states, num_actions = tables.num_states, tables.num_actions
+
+        rates = []
+        trained = []
+        for table_class in (QTable, SparseQTable):
+            q_table = table_class(num_states, num_actions)
+            env = VectorFrozenLake(args.num_envs, tables=tables, max_steps=40 * size, seed=args.seed)
+            start = time.perf_counter()
+            train_steps(env, q_table, args.steps)
+            rates.append(args.steps * args.num_envs / (time.perf_counter() - start))
+            trained.append(q_table)
+        dense, sparse = trained
+
+        # same seeds, same actions: both tables must hold the same values
+        difference = np.abs(sparse.lookup(np.arange(num_states)) - dense.q_table).max()
+        scalar = [scalar_rate(table_class(num_states, num_actions), num_states, args.scalar_updates, args.seed)
+                  for table_class in (QTable, SparseQTable)]
+
+        print('%-6s %9d %8d %12.2f %12.2f %15.0f %15.0f %14.0f %15.0f %9.2g' % (
+            '%dx%d' % (size, size), num_states, len(sparse), dense.q_table.nbytes / 2**20, sparse.nbytes / 2**20,
+            rates[0], rates[1], scalar[0], scalar[1], difference))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""
+Columnar log of Q-learning transitions.
+
+Every field (`state`, `action`, `is_rand`, `reward`, `new_state`) is a typed
+NumPy array that is preallocated and doubled when it fills up, and
+`episode_offsets` marks where each episode starts. Appending a step only
+writes into the arrays, and the analysis (returns, success rate, exploration
+ratio) is done with vectorized reductions over whole episodes.
+
+`save` writes one `.npy` file per column into a directory, `load` can
+memory-map them back.
+"""
+import json
+import os
+
+import numpy as np
+
+FIELDS = {
+    'state': np.int32,
+    'action': np.int16,
+    'is_rand': np.bool_,
+    'reward': np.float32,
+    'new_state': np.int32,
+}
+
+
+class TrainingLog:
+    def __init__(self, capacity=4096, episode_capacity=1024):
+        self.columns = {name: np.empty(capacity, dtype=dtype) for name, dtype in FIELDS.items()}
+        self.size = 0
+        # offsets[i] is the first step of episode i, offsets[num_episodes] the end of the last one
+        self.offsets = np.zeros(episode_capacity + 1, dtype=np.int64)
+        self.num_episodes = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def capacity(self):
+        return len(self.columns['state'])
+
+    def _grow(self, min_capacity):
+        capacity = max(self.capacity * 2, min_capacity)
+        for name, column in self.columns.items():
+            grown = np.empty(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def append(self, state, action, is_rand, reward, new_state):
+        if self.size == self.capacity:
+            self._grow(self.size + 1)
+
+        i = self.size
+        columns = self.columns
+        columns['state'][i] = state
+        columns['action'][i] = action
+        columns['is_rand'][i] = is_rand
+        columns['reward'][i] = reward
+        columns['new_state'][i] = new_state
+        self.size = i + 1
+
+    def extend(self, state, action, is_rand, reward, new_state):
+        """Append arrays of steps, e.g. a whole episode at once."""
+        n = len(state)
+        if self.size + n > self.capacity:
+            self._grow(self.size + n)
+
+        end = self.size + n
+        for name, values in zip(FIELDS, (state, action, is_rand, reward, new_state)):
+            self.columns[name][self.size:end] = values
+        self.size = end
+
+    def end_episode(self):
+        if self.num_episodes + 1 == len(self.offsets):
+            # a log of one offset (no episode capacity, or loaded with no episodes) must still grow
+            offsets = np.zeros(max(2 * len(self.offsets), self.num_episodes + 2), dtype=np.int64)
+            offsets[:len(self.offsets)] = self.offsets
+            self.offsets = offsets
+
+        self.num_episodes += 1
+        self.offsets[self.num_episodes] = self.size
+
+    def column(self, name):
+        """View of the logged values of `name`, steps of an unfinished episode included."""
+        return self.columns[name][:self.size]
+
+    @property
+    def episode_offsets(self):
+        return self.offsets[:self.num_episodes + 1]
+
+    def episode(self, i):
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return {name: column[start:end] for name, column in self.columns.items()}
+
+    def episode_lengths(self):
+        return np.diff(self.episode_offsets)
+
+    def _per_episode_sum(self, values):
+        # reduceat does not handle empty episodes, so go through the cumulative sum instead
+        cumulative = np.concatenate(([0], np.cumsum(values[:self.episode_offsets[-1]], dtype=np.float64)))
+        return np.diff(cumulative[self.episode_offsets])
+
+    def episode_returns(self):
+        return self._per_episode_sum(self.column('reward'))
+
+    def episode_success(self, goal_reward):
+        """Whether each episode ended with `goal_reward` on its last step."""
+        lengths = self.episode_lengths()
+        last = self.episode_offsets[1:] - 1
+        success = np.zeros(self.num_episodes, dtype=bool)
+        finished = lengths > 0
+        success[finished] = self.columns['reward'][last[finished]] == goal_reward
+        return success
+
+    def exploration_ratio(self):
+        """Fraction of random actions in each episode."""
+        lengths = self.episode_lengths()
+        random_steps = self._per_episode_sum(self.column('is_rand'))
+        return np.divide(random_steps, lengths, out=np.zeros(len(lengths)), where=lengths > 0)
+
+    def windowed(self, values, window):
+        """Mean of `values` over consecutive non-overlapping windows of `window` episodes."""
+        num_windows = len(values) // window
+        return np.asarray(values[:num_windows * window], dtype=np.float64).reshape(num_windows, window).mean(axis=1)
+
+    def success_rate(self, goal_reward, window=100):
+        return self.windowed(self.episode_success(goal_reward), window)
+
+    def nbytes(self):
+        return sum(column[:self.size].nbytes for column in self.columns.values()) + self.episode_offsets.nbytes
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        for name in FIELDS:
+            np.save(os.path.join(directory, name + '.npy'), self.column(name))
+        np.save(os.path.join(directory, 'episode_offsets.npy'), self.episode_offsets)
+        with open(os.path.join(directory, 'meta.json'), 'w') as f:
+            json.dump({'size': self.size, 'num_episodes': self.num_episodes}, f)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        """
+        Load a saved log. With the default `mmap_mode='r'` the columns are
+        read-only memory maps; pass `mmap_mode=None` to load them into memory
+        and keep appending.
+        """
+        log = cls.__new__(cls)
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        log.columns = {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode=mmap_mode) for name in FIELDS}
+        log.offsets = np.load(os.path.join(directory, 'episode_offsets.npy'), mmap_mode=mmap_mode)
+        log.size = meta['size']
+        log.num_episodes = meta['num_episodes']
+        return log
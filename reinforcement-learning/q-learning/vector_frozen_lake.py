@@ -0,0 +1,422 @@
+"""
+NumPy-vectorized FrozenLake.
+
+`VectorFrozenLake` steps thousands of independent FrozenLake environments at
+once from precomputed transition tables, with the same dynamics as gym's
+`FrozenLakeEnv` (including the slippery version where the agent moves in the
+intended direction or one of the two perpendicular ones with probability 1/3
+each).
+
+Usage:
+
+    python vector_frozen_lake.py --num-envs 1024 --num-episodes 100000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from q_table import QTable
+
+LEFT = 0
+DOWN = 1
+RIGHT = 2
+UP = 3
+
+# same maps as gym.envs.toy_text.frozen_lake
+MAPS = {
+    '4x4': [
+        'SFFF',
+        'FHFH',
+        'FFFH',
+        'HFFG'
+    ],
+    '8x8': [
+        'SFFFFFFF',
+        'FFFFFFFF',
+        'FFFHFFFF',
+        'FFFFFHFF',
+        'FFFHFFFF',
+        'FHHFFFHF',
+        'FHFFHFHF',
+        'FFFHFFFG'
+    ],
+}
+
+
+def generate_random_map(size=8, p=0.8, seed=None):
+    """Random `size`x`size` map with frozen probability `p` that always has a path from S to G."""
+    rng = np.random.default_rng(seed)
+
+    while True:
+        board = np.where(rng.random((size, size)) < p, 'F', 'H')
+        board[0, 0] = 'S'
+        board[-1, -1] = 'G'
+        if _has_path(board):
+            return [''.join(row) for row in board]
+
+
+def _has_path(board):
+    size = board.shape[0]
+    frontier = [(0, 0)]
+    seen = {(0, 0)}
+    while frontier:
+        r, c = frontier.pop()
+        for dr, dc in ((1, 0), (0, 1), (-1, 0), (0, -1)):
+            nr, nc = r + dr, c + dc
+            if 0 <= nr < size and 0 <= nc < size and (nr, nc) not in seen:
+                if board[nr, nc] == 'G':
+                    return True
+                if board[nr, nc] != 'H':
+                    seen.add((nr, nc))
+                    frontier.append((nr, nc))
+    return False
+
+
+class FrozenLakeTables:
+    """
+    Transition model of a FrozenLake map as dense arrays of shape
+    `(num_states, num_actions, num_outcomes)`: `next_state`, `prob`,
+    `reward` and `done`. This is `env.P` in array form.
+    """
+
+    def __init__(self, next_state, prob, reward, done, desc=None):
+        self.next_state = next_state
+        self.prob = prob
+        self.reward = reward
+        self.done = done
+        self.desc = desc
+        self.num_states, self.num_actions, self.num_outcomes = next_state.shape
+        self.cum_prob = np.cumsum(prob, axis=2)
+        # guard against float round-off in the last bucket
+        self.cum_prob[:, :, -1] = 1.0
+
+    @property
+    def terminal_states(self):
+        return np.flatnonzero(np.all(self.next_state == np.arange(self.num_states)[:, None, None], axis=(1, 2)) &
+                              np.any(self.done, axis=(1, 2)))
+
+    @classmethod
+    def from_desc(cls, desc=None, map_name='4x4', is_slippery=True):
+        if desc is None:
+            desc = MAPS[map_name]
+        board = np.asarray([list(row) for row in desc])
+        nrow, ncol = board.shape
+        num_states = nrow * ncol
+        num_outcomes = 3 if is_slippery else 1
+
+        rows, cols = np.divmod(np.arange(num_states), ncol)
+        tiles = board.ravel()
+        terminal = (tiles == 'H') | (tiles == 'G')
+
+        next_state = np.empty((num_states, 4, num_outcomes), dtype=np.int64)
+        for a in range(4):
+            moves = [(a - 1) % 4, a, (a + 1) % 4] if is_slippery else [a]
+            for k, move in enumerate(moves):
+                r, c = rows, cols
+                if move == LEFT:
+                    c = np.maximum(cols - 1, 0)
+                elif move == DOWN:
+                    r = np.minimum(rows + 1, nrow - 1)
+                elif move == RIGHT:
+                    c = np.minimum(cols + 1, ncol - 1)
+                elif move == UP:
+                    r = np.maximum(rows - 1, 0)
+                next_state[:, a, k] = r * ncol + c
+
+        # terminal states loop onto themselves with no reward
+        next_state[terminal] = np.arange(num_states)[terminal, None, None]
+
+        landing = tiles[next_state]
+        reward = (landing == 'G').astype(np.float64)
+        done = (landing == 'G') | (landing == 'H')
+        reward[terminal] = 0
+        done[terminal] = True
+
+        prob = np.full(next_state.shape, 1.0 / num_outcomes)
+
+        return cls(next_state, prob, reward, done, desc=list(desc))
+
+    @classmethod
+    def from_gym_env(cls, env):
+        """Build the tables from `env.P` of any discrete gym environment."""
+        P = env.unwrapped.P
+        num_states = len(P)
+        num_actions = len(P[0])
+        num_outcomes = max(len(P[s][a]) for s in P for a in P[s])
+
+        next_state = np.zeros((num_states, num_actions, num_outcomes), dtype=np.int64)
+        prob = np.zeros(next_state.shape)
+        reward = np.zeros(next_state.shape)
+        done = np.zeros(next_state.shape, dtype=bool)
+        for s in P:
+            for a in P[s]:
+                # pad shorter outcome lists with zero-probability copies of the first outcome
+                _, s_, r, d = P[s][a][0]
+                next_state[s, a, :] = s_
+                reward[s, a, :] = r
+                done[s, a, :] = d
+                for k, (p, s_, r, d) in enumerate(P[s][a]):
+                    next_state[s, a, k] = s_
+                    prob[s, a, k] = p
+                    reward[s, a, k] = r
+                    done[s, a, k] = d
+
+        desc = getattr(env.unwrapped, 'desc', None)
+        if desc is not None:
+            desc = [b''.join(row).decode() for row in desc]
+        return cls(next_state, prob, reward, done, desc=desc)
+
+
+class VectorFrozenLake:
+    """
+    `num_envs` independent FrozenLake environments stepped together.
+
+    Environments that finish (or run out of `max_steps`) are reset to the
+    start state automatically; `step` still returns the state they ended in.
+    """
+
+    def __init__(self, num_envs, tables=None, map_name='4x4', is_slippery=True, max_steps=100, seed=None):
+        self.num_envs = num_envs
+        self.tables = tables if tables is not None else FrozenLakeTables.from_desc(map_name=map_name, is_slippery=is_slippery)
+        self.max_steps = max_steps
+        self.rng = np.random.default_rng(seed)
+
+        self.num_states = self.tables.num_states
+        self.num_actions = self.tables.num_actions
+        self.start_state = 0
+
+        self.states = np.full(num_envs, self.start_state, dtype=np.int64)
+        self.timesteps = np.zeros(num_envs, dtype=np.int64)
+
+    def reset(self):
+        self.states[:] = self.start_state
+        self.timesteps[:] = 0
+        return self.states.copy()
+
+    def step(self, actions):
+        """Returns `(new_states, rewards, dones, truncated)` as arrays of length `num_envs`."""
+        t = self.tables
+        states = self.states
+
+        if t.num_outcomes == 1:
+            outcome = np.zeros(self.num_envs, dtype=np.int64)
+        else:
+            u = self.rng.random(self.num_envs)
+            outcome = (u[:, None] >= t.cum_prob[states, actions]).sum(axis=1)
+
+        new_states = t.next_state[states, actions, outcome]
+        rewards = t.reward[states, actions, outcome]
+        dones = t.done[states, actions, outcome]
+
+        self.timesteps += 1
+        truncated = ~dones & (self.timesteps >= self.max_steps) if self.max_steps else np.zeros_like(dones)
+
+        finished = dones | truncated
+        self.states = np.where(finished, self.start_state, new_states)
+        self.timesteps[finished] = 0
+
+        return new_states, rewards, dones, truncated
+
+
+def shaped_rewards(states, new_states, rewards, dones, hole_reward=-10, goal_reward=10, wall_reward=-1):
+    """The reward shaping used in the notebook: punish holes and bumping into walls, reward the goal."""
+    shaped = np.zeros(len(states))
+    shaped[dones & (rewards > 0)] = goal_reward
+    shaped[dones & (rewards <= 0)] = hole_reward
+    shaped[~dones & (states == new_states)] = wall_reward
+    return shaped
+
+
+def train_vectorized(env, q_table, num_episodes, epsilon=0.8, shaping=True):
+    """
+    Epsilon-greedy Q-learning on all environments of `env` at once. Epsilon
+    decays linearly with the number of finished episodes like in the notebook.
+    """
+    decrease_per_episode = epsilon / num_episodes
+    rng = env.rng
+
+    states = env.reset()
+    finished_episodes = 0
+    success_count = 0
+
+    while finished_episodes < num_episodes:
+        current_epsilon = max(epsilon - decrease_per_episode * finished_episodes, 0)
+
+        actions, _ = q_table.get_next_actions(states, current_epsilon, rng)
+
+        new_states, rewards, dones, truncated = env.step(actions)
+        if shaping:
+            targets = shaped_rewards(states, new_states, rewards, dones)
+        else:
+            targets = rewards
+
+        q_table.update_batch(states, actions, targets, new_states)
+
+        finished_episodes += int(np.count_nonzero(dones | truncated))
+        success_count += int(np.count_nonzero(dones & (rewards > 0)))
+        states = env.states.copy()
+
+    return finished_episodes, success_count
+
+
+def train_scalar(tables, q_table, num_episodes, epsilon=0.8, num_timesteps=128, seed=None):
+    """The notebook's loop, one environment and one transition at a time, on the same tables."""
+    rng = np.random.default_rng(seed)
+    epsilons = epsilon - epsilon / num_episodes * np.arange(num_episodes)
+    success = run_episodes(tables, q_table, epsilons, rng, num_timesteps)
+    return num_episodes, int(np.count_nonzero(success))
+
+
+def run_episodes(tables, q_table, epsilons, rng, num_timesteps=128):
+    """
+    One episode per entry of `epsilons`, with that exploration rate. Returns
+    a boolean array telling which episodes reached the goal.
+    """
+    success = np.zeros(len(epsilons), dtype=bool)
+
+    for episode, epsilon in enumerate(epsilons):
+        state = 0
+        for timestep in range(num_timesteps):
+            if rng.random() < epsilon:
+                action = int(rng.integers(tables.num_actions))
+            else:
+                action = q_table.get_next_action(state)
+
+            k = int(np.searchsorted(tables.cum_prob[state, action], rng.random(), side='right'))
+            new_state = tables.next_state[state, action, k]
+            reward = tables.reward[state, action, k]
+            done = tables.done[state, action, k]
+
+            if done and reward > 0:
+                mReward = 10
+                success[episode] = True
+            elif done:
+                mReward = -10
+            elif state == new_state:
+                mReward = -1
+            else:
+                mReward = 0
+
+            q_table.update_table(state, action, mReward, new_state)
+
+            state = new_state
+            if done:
+                break
+
+    return success
+
+
+def train_gym(env, q_table, num_episodes, epsilon=0.8, num_timesteps=128):
+    """The notebook's loop on a real gym environment (without the per-step printing)."""
+    decrease_per_episode = epsilon / num_episodes
+    success_count = 0
+    terminal = set(FrozenLakeTables.from_gym_env(env).terminal_states.tolist())
+
+    for episode in range(num_episodes):
+        state = env.reset()
+        if isinstance(state, tuple):
+            state = state[0]
+        for timestep in range(num_timesteps):
+            if np.random.uniform(0, 1) < epsilon:
+                action = env.action_space.sample()
+            else:
+                action = q_table.get_next_action(state)
+
+            result = env.step(action)
+            new_state, reward, done = result[0], result[1], result[2]
+
+            if done and new_state in terminal and reward > 0:
+                mReward = 10
+                success_count += 1
+            elif done and new_state in terminal:
+                mReward = -10
+            elif state == new_state:
+                mReward = -1
+            else:
+                mReward = 0
+
+            q_table.update_table(state, action, mReward, new_state)
+
+            state = new_state
+            if done:
+                break
+
+        epsilon -= decrease_per_episode
+
+    return num_episodes, success_count
+
+
+def make_gym_env(is_slippery):
+    import gym
+
+    for env_id in ('FrozenLake-v0', 'FrozenLake-v1'):
+        try:
+            return gym.make(env_id, is_slippery=is_slippery)
+        except gym.error.Error:
+            continue
+    raise RuntimeError('no FrozenLake environment registered in gym')
+
+
+def greedy_success_rate(tables, q_table, num_envs=10000, max_steps=100, seed=None):
+    """Fraction of episodes the greedy policy of `q_table` reaches the goal."""
+    env = VectorFrozenLake(num_envs, tables=tables, max_steps=None, seed=seed)
+    states = env.reset()
+    active = np.ones(num_envs, dtype=bool)
+    success = np.zeros(num_envs, dtype=bool)
+    for _ in range(max_steps):
+        actions, _ = q_table.get_next_actions(states)
+        new_states, rewards, dones, _ = env.step(actions)
+        success |= active & dones & (rewards > 0)
+        active &= ~dones
+        if not active.any():
+            break
+        states = env.states.copy()
+    return float(success.mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--map', default='4x4', choices=sorted(MAPS))
+    parser.add_argument('--not-slippery', action='store_true')
+    parser.add_argument('--num-envs', type=int, default=1024)
+    parser.add_argument('--num-episodes', type=int, default=100000)
+    parser.add_argument('--baseline-episodes', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    is_slippery = not args.not_slippery
+    tables = FrozenLakeTables.from_desc(map_name=args.map, is_slippery=is_slippery)
+
+    results = []
+
+    try:
+        gym_env = make_gym_env(is_slippery)
+    except ImportError:
+        gym_env = None
+    if gym_env is not None and args.map == '4x4':
+        q_table = QTable(tables.num_states, tables.num_actions)
+        start = time.perf_counter()
+        episodes, successes = train_gym(gym_env, q_table, args.baseline_episodes)
+        results.append(('gym loop', episodes, successes, time.perf_counter() - start, q_table))
+
+    q_table = QTable(tables.num_states, tables.num_actions)
+    start = time.perf_counter()
+    episodes, successes = train_scalar(tables, q_table, args.baseline_episodes, seed=args.seed)
+    results.append(('scalar loop', episodes, successes, time.perf_counter() - start, q_table))
+
+    q_table = QTable(tables.num_states, tables.num_actions)
+    env = VectorFrozenLake(args.num_envs, tables=tables, max_steps=128, seed=args.seed)
+    start = time.perf_counter()
+    episodes, successes = train_vectorized(env, q_table, args.num_episodes)
+    results.append(('vectorized x%d' % args.num_envs, episodes, successes, time.perf_counter() - start, q_table))
+
+    print('%-18s %10s %10s %10s %14s %14s' % ('trainer', 'episodes', 'successes', 'seconds', 'episodes/sec', 'greedy success'))
+    for name, episodes, successes, seconds, q_table in results:
+        print('%-18s %10d %10d %10.2f %14.0f %14.3f' % (
+            name, episodes, successes, seconds, episodes / seconds,
+            greedy_success_rate(tables, q_table, seed=args.seed)))
+
+
+if __name__ == '__main__':
+    main()
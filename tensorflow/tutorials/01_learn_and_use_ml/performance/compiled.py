@@ -0,0 +1,244 @@
+"""
+Compiled training and evaluation steps for the tutorial models.
+
+`model.fit` and `model.evaluate` go through Keras' generic train and test
+functions. `CompiledSteps` is an opt-in replacement with a custom training
+loop:
+
+- the train step (forward pass, loss, gradients and the Adam update) is one
+  `tf.function(jit_compile=True)`, so XLA fuses it into a single program
+- the eval step is a second jit-compiled function that returns the summed
+  loss and the number of correct predictions of a batch together, so
+  evaluation is one fused call per batch and the metrics are reduced once at
+  the end instead of per batch in Python
+- `configure_threads` sets the intra-op and inter-op thread pools; it has to
+  run before TensorFlow executes its first op
+
+XLA compiles once per input shape. `fit` drops the last partial batch so
+training compiles exactly once; `evaluate` keeps it, which costs one more
+compilation.
+
+The benchmark trains the same model for `--steps` steps in every mode and
+reports the first step (tracing and compilation) and steps/sec after it:
+
+- eager: `model.fit` with `run_eagerly=True`
+- keras: `model.fit` with the default compile settings
+- function: the custom loop in `tf.function` without XLA
+- xla: the custom loop with `jit_compile=True`
+
+Usage:
+
+    python compiled.py --model fashion_mnist --steps 300
+    python compiled.py --model imdb --batch-size 512 --intra-threads 4 --inter-threads 1
+"""
+import argparse
+import time
+
+import tensorflow as tf
+from tensorflow import keras
+
+import tutorial_models
+from instrumentation import TrainingInstrumentation
+
+MODES = ['eager', 'keras', 'function', 'xla']
+
+
+def configure_threads(intra_op=None, inter_op=None):
+    """
+    `intra_op`: threads a single op (a matmul, a reduction) may use, 0 lets TensorFlow choose
+
+    `inter_op`: independent ops run at the same time, 0 lets TensorFlow choose
+    """
+    if intra_op is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_op)
+    if inter_op is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_op)
+
+
+def correct_predictions(y_true, y_pred):
+    """Number of correct predictions, for softmax outputs (argmax) and sigmoid outputs (> 0.5)."""
+    if y_pred.shape[-1] == 1:
+        predicted = tf.cast(y_pred[:, 0] > 0.5, y_true.dtype)
+    else:
+        predicted = tf.cast(tf.argmax(y_pred, axis=-1), y_true.dtype)
+    return tf.reduce_sum(tf.cast(tf.equal(tf.reshape(y_true, [-1]), predicted), tf.float32))
+
+
+class CompiledSteps:
+    """
+    Training and evaluation of a model compiled with `tutorial_models.compile_*_model`,
+    reusing its optimizer and loss.
+
+    `jit_compile`: compile the steps with XLA; False keeps them as plain `tf.function` graphs
+    """
+
+    def __init__(self, model, jit_compile=True):
+        self.model = model
+        self.optimizer = model.optimizer
+        self.loss_fn = keras.losses.get(model.loss)
+        self.jit_compile = jit_compile
+        # the optimizer's slots must exist before the first (compiled) step
+        self.optimizer.build(model.trainable_variables)
+
+        self.train_step = tf.function(self._train_step, jit_compile=jit_compile)
+        self.eval_step = tf.function(self._eval_step, jit_compile=jit_compile)
+
+    def loss(self, y, y_pred):
+        if y_pred.shape[-1] == 1 and y.shape.rank == y_pred.shape.rank - 1:
+            # binary labels against the (batch, 1) sigmoid output
+            y = y[:, None]
+        return self.loss_fn(y, y_pred)
+
+    def _train_step(self, x, y):
+        with tf.GradientTape() as tape:
+            y_pred = self.model(x, training=True)
+            loss = tf.reduce_mean(self.loss(y, y_pred))
+        variables = self.model.trainable_variables
+        gradients = tape.gradient(loss, variables)
+        self.optimizer.apply_gradients(zip(gradients, variables))
+        return loss
+
+    def _eval_step(self, x, y):
+        y_pred = self.model(x, training=False)
+        return tf.reduce_sum(self.loss(y, y_pred)), correct_predictions(y, y_pred)
+
+    def fit(self, dataset, epochs=1, steps_per_epoch=None, verbose=True):
+        """Train on `dataset` (batches of `(x, y)`). Returns the mean loss per epoch."""
+        history = []
+        for epoch in range(epochs):
+            start = time.perf_counter()
+            total = tf.constant(0.0)
+            steps = 0
+            for x, y in dataset.take(steps_per_epoch) if steps_per_epoch else dataset:
+                total += self.train_step(x, y)
+                steps += 1
+            history.append(float(total) / max(steps, 1))
+            if verbose:
+                print('epoch %d: loss %.4f, %d steps, %.1f s' % (
+                    epoch + 1, history[-1], steps, time.perf_counter() - start))
+        return history
+
+    def evaluate(self, dataset):
+        """`(loss, accuracy)` over `dataset`."""
+        loss_sum = tf.constant(0.0)
+        correct = tf.constant(0.0)
+        count = 0
+        for x, y in dataset:
+            batch_loss, batch_correct = self.eval_step(x, y)
+            loss_sum += batch_loss
+            correct += batch_correct
+            count += int(x.shape[0])
+        return float(loss_sum) / count, float(correct) / count
+
+
+def fit_compiled(model, x, y, batch_size=32, epochs=1, jit_compile=True, verbose=True):
+    """`model.fit(x, y, ...)` through `CompiledSteps`. Returns the `CompiledSteps` for evaluation."""
+    steps = CompiledSteps(model, jit_compile)
+    steps.fit(make_train_dataset(x, y, batch_size), epochs, verbose=verbose)
+    return steps
+
+
+def make_train_dataset(x, y, batch_size):
+    # fixed batch shape, so the compiled train step is built once
+    return tf.data.Dataset.from_tensor_slices((x, y)) \
+        .shuffle(len(x)) \
+        .batch(batch_size, drop_remainder=True) \
+        .prefetch(tf.data.AUTOTUNE)
+
+
+def make_eval_dataset(x, y, batch_size):
+    return tf.data.Dataset.from_tensor_slices((x, y)).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def load(model_name):
+    if model_name == 'fashion_mnist':
+        return tutorial_models.load_fashion_mnist()
+    return tutorial_models.load_imdb()
+
+
+def build(model_name):
+    if model_name == 'fashion_mnist':
+        return tutorial_models.compile_fashion_mnist_model(tutorial_models.build_fashion_mnist_model())
+    return tutorial_models.compile_imdb_model(tutorial_models.build_imdb_model())
+
+
+def benchmark_keras(model_name, dataset, num_steps, batch_size, run_eagerly):
+    """First step seconds and steps/sec after it for `model.fit`."""
+    model = build(model_name)
+    if run_eagerly:
+        model.run_eagerly = True
+    instrumentation = TrainingInstrumentation(batch_size)
+    model.fit(dataset.repeat(), epochs=1, steps_per_epoch=num_steps, callbacks=[instrumentation], verbose=0)
+    report = instrumentation.report()
+    return report['first_step_seconds'], report['examples_per_sec'] / batch_size, model
+
+
+def benchmark_custom(model_name, dataset, num_steps, jit_compile):
+    """First step seconds and steps/sec after it for the custom loop."""
+    model = build(model_name)
+    steps = CompiledSteps(model, jit_compile)
+    iterator = iter(dataset.repeat())
+
+    x, y = next(iterator)
+    start = time.perf_counter()
+    steps.train_step(x, y).numpy()
+    first = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(num_steps - 1):
+        x, y = next(iterator)
+        loss = steps.train_step(x, y)
+    loss.numpy()
+    return first, (num_steps - 1) / (time.perf_counter() - start), steps
+
+
+def timed_evaluation(evaluate):
+    """(seconds of the first call, seconds of a second call, (loss, accuracy))."""
+    start = time.perf_counter()
+    evaluate()
+    first = time.perf_counter() - start
+    start = time.perf_counter()
+    result = evaluate()
+    return first, time.perf_counter() - start, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=['fashion_mnist', 'imdb'], default='fashion_mnist')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    parser.add_argument('--steps', type=int, default=300)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--intra-threads', type=int, help='intra-op thread pool size, default is TensorFlow\'s')
+    parser.add_argument('--inter-threads', type=int, help='inter-op thread pool size, default is TensorFlow\'s')
+    args = parser.parse_args()
+    if args.steps < 2:
+        parser.error('--steps must be at least 2, the first step is timed on its own')
+
+    configure_threads(args.intra_threads, args.inter_threads)
+
+    (x_train, y_train), (x_test, y_test) = load(args.model)
+    dataset = make_train_dataset(x_train, y_train, args.batch_size)
+    test_dataset = make_eval_dataset(x_test, y_test, 1024)
+
+    print('%s, batch size %d, %d steps, threads intra %s inter %s' % (
+        args.model, args.batch_size, args.steps,
+        tf.config.threading.get_intra_op_parallelism_threads() or 'default',
+        tf.config.threading.get_inter_op_parallelism_threads() or 'default'))
+    print('%-10s %16s %12s %10s %20s %18s %10s' % (
+        'mode', 'first step ms', 'steps/sec', 'speedup', 'eval first call s', 'eval s (warm)', 'accuracy'))
+    baseline = None
+    for mode in args.modes:
+        if mode in ('eager', 'keras'):
+            first, rate, model = benchmark_keras(args.model, dataset, args.steps, args.batch_size, mode == 'eager')
+            eval_first, eval_seconds, (_, accuracy) = timed_evaluation(
+                lambda: model.evaluate(test_dataset, verbose=0))
+        else:
+            first, rate, steps = benchmark_custom(args.model, dataset, args.steps, mode == 'xla')
+            eval_first, eval_seconds, (_, accuracy) = timed_evaluation(lambda: steps.evaluate(test_dataset))
+        baseline = baseline or rate
+        print('%-10s %16.1f %12.1f %9.2fx %20.2f %18.2f %10.3f' % (
+            mode, first * 1e3, rate, rate / baseline, eval_first, eval_seconds, accuracy))
+
+
+if __name__ == '__main__':
+    main()
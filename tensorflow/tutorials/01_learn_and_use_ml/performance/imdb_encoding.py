@@ -0,0 +1,54 @@
+"""
+IMDB id conventions and the review tokenizer, without TensorFlow.
+
+`tutorial_models` re-exports the constants. `text_shards` workers import only
+this module, so starting one costs a NumPy import instead of a TensorFlow one.
+"""
+import itertools
+import re
+
+import numpy as np
+
+IMDB_VOCAB_SIZE = 10000
+IMDB_MAXLEN = 256
+
+# The first indices of the IMDB word index are reserved
+PAD = 0
+START = 1
+UNK = 2
+UNUSED = 3
+INDEX_FROM = 3
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:'[a-z]+)*")
+
+
+def tokenize(text):
+    return TOKEN_PATTERN.findall(text.lower().replace('<br />', ' '))
+
+
+def vocabulary(word_index, num_words):
+    # only the ids the model sees, everything else becomes UNK
+    return {word: i for word, i in word_index.items() if i < num_words}
+
+
+def encode(text, word_index):
+    get = word_index.get
+    return [START] + [get(word, UNK) for word in tokenize(text)]
+
+
+# set in every worker by init_worker
+_word_index = None
+
+
+def init_worker(word_index, num_words):
+    global _word_index
+    _word_index = vocabulary(word_index, num_words)
+
+
+def encode_chunk(reviews):
+    """`(tokens, lengths, labels)` arrays for a list of `(label, text)`."""
+    sequences = [encode(text, _word_index) for _, text in reviews]
+    lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+    tokens = np.fromiter(itertools.chain.from_iterable(sequences), dtype=np.int32, count=int(lengths.sum()))
+    labels = np.array([label for label, _ in reviews], dtype=np.int8)
+    return tokens, lengths, labels
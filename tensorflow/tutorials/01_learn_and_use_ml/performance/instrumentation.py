@@ -0,0 +1,229 @@
+"""
+Training performance instrumentation for `model.fit`.
+
+`TrainingInstrumentation` records per-step and per-epoch wall time,
+examples/sec, the host-side time between steps versus the time spent inside
+the train step, and peak host memory. It can also capture a TensorFlow
+profiler trace for a range of steps.
+
+Keras fetches the next batch inside the train function, so a slow input
+pipeline shows up as step time rather than as a gap between steps.
+`probe_input_pipeline` times the input pipeline on its own; comparing that
+against the step time tells whether a run is input-bound.
+
+Usage:
+
+    python instrumentation.py --model imdb --profile-steps 10 20 --logdir logs/profile
+"""
+import argparse
+import json
+import resource
+import sys
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+import tutorial_models
+
+
+def peak_host_memory():
+    """Peak resident set size of this process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def probe_input_pipeline(dataset, num_steps=50):
+    """Seconds per batch to pull `num_steps` batches out of `dataset` with no training attached."""
+    iterator = iter(dataset)
+    next(iterator)
+
+    start = time.perf_counter()
+    count = 0
+    for _ in range(num_steps):
+        try:
+            next(iterator)
+        except StopIteration:
+            break
+        count += 1
+    return (time.perf_counter() - start) / max(count, 1)
+
+
+class TrainingInstrumentation(keras.callbacks.Callback):
+    """
+    `batch_size`: examples per step, used for examples/sec
+
+    `profile_steps`: optional `(start, stop)` global step range to trace with the TensorFlow profiler
+
+    `logdir`: directory the profiler trace is written to
+
+    `input_seconds_per_step`: optional result of `probe_input_pipeline`
+    """
+
+    def __init__(self, batch_size, profile_steps=None, logdir='logs/profile', input_seconds_per_step=None):
+        super().__init__()
+        self.batch_size = batch_size
+        self.profile_steps = profile_steps
+        self.logdir = logdir
+        self.input_seconds_per_step = input_seconds_per_step
+
+        self.step_times = []
+        self.gap_times = []
+        self.epoch_times = []
+        self.epoch_steps = []
+
+        self._global_step = 0
+        self._profiling = False
+        self._last_batch_end = None
+
+    def on_train_begin(self, logs=None):
+        self._train_start = time.perf_counter()
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self._epoch_start = time.perf_counter()
+        self._epoch_first_step = len(self.step_times)
+        self._last_batch_end = None
+
+    def on_train_batch_begin(self, batch, logs=None):
+        if self.profile_steps and self._global_step == self.profile_steps[0]:
+            tf.profiler.experimental.start(self.logdir)
+            self._profiling = True
+
+        now = time.perf_counter()
+        if self._last_batch_end is not None:
+            self.gap_times.append(now - self._last_batch_end)
+        self._batch_start = now
+
+    def on_train_batch_end(self, batch, logs=None):
+        now = time.perf_counter()
+        self.step_times.append(now - self._batch_start)
+        self._last_batch_end = now
+        self._global_step += 1
+
+        if self._profiling and self._global_step >= self.profile_steps[1]:
+            self._stop_profiler()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.epoch_times.append(time.perf_counter() - self._epoch_start)
+        self.epoch_steps.append(len(self.step_times) - self._epoch_first_step)
+
+    def on_train_end(self, logs=None):
+        self.total_time = time.perf_counter() - self._train_start
+        if self._profiling:
+            self._stop_profiler()
+
+    def _stop_profiler(self):
+        tf.profiler.experimental.stop()
+        self._profiling = False
+
+    def report(self, skip_first=1):
+        """
+        Summary of the run. The first `skip_first` steps are left out of the
+        step statistics because they include tracing and graph compilation.
+        Without any train step (e.g. an empty dataset) the step statistics
+        are NaN and `first_step_seconds` and `bottleneck` are None.
+        """
+        steps = np.array(self.step_times[skip_first:] or self.step_times or [np.nan])
+        gaps = np.array(self.gap_times or [0.0])
+
+        step_mean = float(np.mean(steps))
+        gap_mean = float(np.mean(gaps))
+        wall_per_step = step_mean + gap_mean
+
+        result = {
+            'steps': len(self.step_times),
+            'first_step_seconds': self.step_times[0] if self.step_times else None,
+            'step_seconds_mean': step_mean,
+            'step_seconds_p50': float(np.percentile(steps, 50)),
+            'step_seconds_p99': float(np.percentile(steps, 99)),
+            'between_steps_seconds_mean': gap_mean,
+            'examples_per_sec': self.batch_size / wall_per_step,
+            'epoch_seconds': self.epoch_times,
+            'epoch_examples_per_sec': [
+                n * self.batch_size / t for n, t in zip(self.epoch_steps, self.epoch_times)
+            ],
+            # time in an epoch outside the train steps: callbacks, validation, python overhead
+            'epoch_overhead_seconds': [
+                t - sum(self.step_times[s:s + n])
+                for t, n, s in zip(self.epoch_times, self.epoch_steps, np.cumsum([0] + self.epoch_steps[:-1]))
+            ],
+            'total_seconds': getattr(self, 'total_time', None),
+            'peak_host_memory_bytes': peak_host_memory(),
+            'input_seconds_per_step': self.input_seconds_per_step,
+        }
+        result['bottleneck'] = self.bottleneck(step_mean, gap_mean)
+        return result
+
+    def bottleneck(self, step_mean, gap_mean):
+        if not self.step_times:
+            return None
+        if self.input_seconds_per_step is not None and self.input_seconds_per_step >= 0.8 * step_mean:
+            # producing a batch alone takes about as long as a whole step
+            return 'input'
+        if gap_mean >= 0.25 * (step_mean + gap_mean):
+            return 'python-overhead'
+        return 'compute'
+
+    def print_report(self):
+        r = self.report()
+        print('steps:                %d' % r['steps'])
+        if r['first_step_seconds'] is None:
+            print('first step:           no train steps ran')
+        else:
+            print('first step:           %.2f ms' % (r['first_step_seconds'] * 1e3))
+        print('step time:            %.3f ms mean, %.3f ms p50, %.3f ms p99' % (
+            r['step_seconds_mean'] * 1e3, r['step_seconds_p50'] * 1e3, r['step_seconds_p99'] * 1e3))
+        print('between steps:        %.3f ms mean' % (r['between_steps_seconds_mean'] * 1e3))
+        if r['input_seconds_per_step'] is not None:
+            print('input pipeline alone: %.3f ms per step' % (r['input_seconds_per_step'] * 1e3))
+        print('examples/sec:         %.0f' % r['examples_per_sec'])
+        for i, (t, eps, overhead) in enumerate(zip(r['epoch_seconds'], r['epoch_examples_per_sec'], r['epoch_overhead_seconds'])):
+            print('epoch %-3d             %.2f s, %.0f examples/sec, %.2f s outside train steps' % (i + 1, t, eps, overhead))
+        print('peak host memory:     %.1f MiB' % (r['peak_host_memory_bytes'] / 2**20))
+        print('bottleneck:           %s' % r['bottleneck'])
+
+
+def make_dataset(x, y, batch_size):
+    return tf.data.Dataset.from_tensor_slices((x, y)) \
+        .shuffle(len(x)) \
+        .batch(batch_size) \
+        .prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=['fashion_mnist', 'imdb'], default='fashion_mnist')
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--profile-steps', type=int, nargs=2, metavar=('START', 'STOP'))
+    parser.add_argument('--logdir', default='logs/profile')
+    parser.add_argument('--json', help='also write the report to this file')
+    args = parser.parse_args()
+
+    if args.model == 'fashion_mnist':
+        (x_train, y_train), _ = tutorial_models.load_fashion_mnist()
+        model = tutorial_models.compile_fashion_mnist_model(tutorial_models.build_fashion_mnist_model())
+    else:
+        (x_train, y_train), _ = tutorial_models.load_imdb()
+        model = tutorial_models.compile_imdb_model(tutorial_models.build_imdb_model())
+
+    dataset = make_dataset(x_train, y_train, args.batch_size)
+
+    instrumentation = TrainingInstrumentation(
+        args.batch_size,
+        profile_steps=args.profile_steps,
+        logdir=args.logdir,
+        input_seconds_per_step=probe_input_pipeline(dataset),
+    )
+    model.fit(dataset, epochs=args.epochs, callbacks=[instrumentation])
+
+    instrumentation.print_report()
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(instrumentation.report(), f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
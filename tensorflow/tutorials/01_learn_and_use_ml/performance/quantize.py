@@ -0,0 +1,324 @@
+"""
+Post-training quantization and magnitude pruning for the tutorial models.
+
+Trains the float32 baseline, then converts it to TensorFlow Lite as
+
+- `float32`: plain conversion, the reference for the converted models
+- `dynamic`: int8 weights, float activations (no calibration data needed)
+- `int8`: full integer quantization calibrated on training examples
+- `pruned-int8`: magnitude pruned, fine-tuned, then full integer quantized
+
+and reports model size, CPU latency/throughput and the accuracy drop against
+the float baseline on the test set.
+
+Usage:
+
+    python quantize.py --model fashion_mnist --sparsity 0.5
+"""
+import argparse
+import gzip
+import os
+import time
+
+import numpy as np
+import tensorflow as tf
+from tensorflow import keras
+
+import tutorial_models
+
+FLOAT32 = 'float32'
+DYNAMIC = 'dynamic'
+INT8 = 'int8'
+
+
+def prunable_weights(model):
+    # the kernels hold nearly all of the parameters, biases are left alone
+    weights = []
+    for layer in model.layers:
+        if isinstance(layer, keras.layers.Dense):
+            weights.append(layer.kernel)
+        elif isinstance(layer, keras.layers.Embedding):
+            weights.append(layer.embeddings)
+    return weights
+
+
+def magnitude_prune(model, sparsity):
+    """
+    Zero the `sparsity` fraction of smallest magnitude values of every
+    prunable weight in place and return the masks that were applied.
+    """
+    masks = []
+    for weight in prunable_weights(model):
+        value = weight.numpy()
+        k = int(value.size * sparsity)
+        mask = np.ones(value.shape, dtype=value.dtype)
+        if k > 0:
+            threshold = np.partition(np.abs(value).ravel(), k - 1)[k - 1]
+            mask[np.abs(value) <= threshold] = 0
+        weight.assign(value * mask)
+        masks.append(mask)
+    return masks
+
+
+class PruningMask(keras.callbacks.Callback):
+    """Re-apply the pruning masks after every batch so pruned weights stay at zero."""
+
+    def __init__(self, masks):
+        super().__init__()
+        self.masks = masks
+
+    def on_train_batch_end(self, batch, logs=None):
+        for weight, mask in zip(prunable_weights(self.model), self.masks):
+            weight.assign(weight * mask)
+
+
+def prune(model, compile_fn, x, y, sparsity, epochs=1, batch_size=512):
+    """Clone `model`, prune it to `sparsity` and fine-tune with the masks held fixed."""
+    pruned = keras.models.clone_model(model)
+    pruned.set_weights(model.get_weights())
+    compile_fn(pruned)
+
+    masks = magnitude_prune(pruned, sparsity)
+    if epochs > 0:
+        pruned.fit(x, y, epochs=epochs, batch_size=batch_size, verbose=0, callbacks=[PruningMask(masks)])
+
+    return pruned
+
+
+def measured_sparsity(model):
+    weights = [w.numpy() for w in prunable_weights(model)]
+    total = sum(w.size for w in weights)
+    zeros = sum(int(np.sum(w == 0)) for w in weights)
+    return zeros / total
+
+
+def convert(model, mode=FLOAT32, representative_data=None, num_calibration=200):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+
+    if mode in (DYNAMIC, INT8):
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if mode == INT8:
+        if representative_data is None:
+            raise ValueError('full integer quantization needs representative data')
+
+        def representative_dataset():
+            for sample in representative_data[:num_calibration]:
+                yield [np.expand_dims(sample, 0)]
+
+        converter.representative_dataset = representative_dataset
+        # keep float/int32 model inputs so the same test arrays can be fed
+        converter.target_spec.supported_ops = [
+            tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+            tf.lite.OpsSet.TFLITE_BUILTINS
+        ]
+
+    return converter.convert()
+
+
+def model_size(model_content):
+    # pruned weights only shrink the file once it is compressed
+    return len(model_content), len(gzip.compress(model_content))
+
+
+def keras_model_size(model):
+    return sum(w.size * w.dtype.itemsize for w in model.get_weights())
+
+
+class TFLiteRunner:
+    def __init__(self, model_content, num_threads=1):
+        self.interpreter = tf.lite.Interpreter(model_content=model_content, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self.input_dtype = self.interpreter.get_input_details()[0]['dtype']
+        self.batch_size = None
+
+    def _resize(self, batch_size, sample_shape):
+        if batch_size != self.batch_size:
+            self.interpreter.resize_tensor_input(self.input_index, [batch_size] + list(sample_shape))
+            self.interpreter.allocate_tensors()
+            self.batch_size = batch_size
+
+    def predict_batch(self, batch):
+        self._resize(len(batch), batch.shape[1:])
+        self.interpreter.set_tensor(self.input_index, batch.astype(self.input_dtype, copy=False))
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_index)
+
+    def predict(self, x, batch_size=256):
+        outputs = []
+        for start in range(0, len(x), batch_size):
+            batch = x[start:start + batch_size]
+            if len(batch) != batch_size:
+                # pad the last batch instead of reallocating the tensors
+                padded = np.zeros((batch_size,) + x.shape[1:], dtype=x.dtype)
+                padded[:len(batch)] = batch
+                outputs.append(self.predict_batch(padded)[:len(batch)])
+            else:
+                outputs.append(self.predict_batch(batch))
+        return np.concatenate(outputs)
+
+
+def accuracy(predictions, labels):
+    if predictions.shape[-1] == 1:
+        predicted = (predictions[:, 0] > 0.5).astype(labels.dtype)
+    else:
+        predicted = np.argmax(predictions, axis=-1)
+    return float(np.mean(predicted == labels))
+
+
+def latency(predict_batch, x, num_runs=200, warmup=20):
+    samples = x[:1]
+    for _ in range(warmup):
+        predict_batch(samples)
+
+    timings = np.empty(num_runs)
+    for i in range(num_runs):
+        start = time.perf_counter()
+        predict_batch(samples)
+        timings[i] = time.perf_counter() - start
+
+    return {
+        'p50_ms': float(np.percentile(timings, 50) * 1e3),
+        'p90_ms': float(np.percentile(timings, 90) * 1e3),
+        'p99_ms': float(np.percentile(timings, 99) * 1e3),
+    }
+
+
+def throughput(predict, x, batch_size=256):
+    predict(x[:batch_size], batch_size)
+    start = time.perf_counter()
+    predict(x, batch_size)
+    return len(x) / (time.perf_counter() - start)
+
+
+def benchmark(name, model, compile_fn, train, test, sparsity=0.5, finetune_epochs=1, num_threads=1, batch_size=256,
+              output_dir=None):
+    """
+    Table rows for the Keras baseline and every TensorFlow Lite variant.
+
+    `output_dir`: if set, the converted models are written there as `<name>_<variant>.tflite`
+    """
+    (x_train, y_train), (x_test, y_test) = train, test
+
+    rows = []
+
+    baseline_predictions = model.predict(x_test, batch_size=batch_size, verbose=0)
+    baseline_accuracy = accuracy(baseline_predictions, y_test)
+    rows.append({
+        'model': name,
+        'variant': 'keras-float32',
+        'size_bytes': keras_model_size(model),
+        'gzip_bytes': None,
+        'accuracy': baseline_accuracy,
+        'accuracy_drop': 0.0,
+        'examples_per_sec': throughput(lambda x, bs: model.predict(x, batch_size=bs, verbose=0), x_test, batch_size),
+        **latency(lambda x: model(x, training=False), x_test),
+    })
+
+    pruned = prune(model, compile_fn, x_train, y_train, sparsity, epochs=finetune_epochs)
+    print('%s: pruned to %.1f%% sparsity' % (name, 100 * measured_sparsity(pruned)))
+
+    variants = [
+        (FLOAT32, model),
+        (DYNAMIC, model),
+        (INT8, model),
+        ('pruned-' + INT8, pruned),
+    ]
+
+    for variant, source in variants:
+        mode = INT8 if variant.endswith(INT8) else variant
+        content = convert(source, mode, representative_data=x_train)
+        if output_dir:
+            with open(os.path.join(output_dir, '%s_%s.tflite' % (name, variant)), 'wb') as f:
+                f.write(content)
+        runner = TFLiteRunner(content, num_threads=num_threads)
+
+        predictions = runner.predict(x_test, batch_size)
+        size, gzip_size = model_size(content)
+        variant_accuracy = accuracy(predictions, y_test)
+
+        rows.append({
+            'model': name,
+            'variant': 'tflite-' + variant,
+            'size_bytes': size,
+            'gzip_bytes': gzip_size,
+            'accuracy': variant_accuracy,
+            'accuracy_drop': baseline_accuracy - variant_accuracy,
+            'examples_per_sec': throughput(runner.predict, x_test, batch_size),
+            **latency(runner.predict_batch, x_test),
+        })
+
+    return rows
+
+
+def print_table(rows):
+    header = '%-14s %-20s %12s %12s %9s %8s %12s %9s %9s' % (
+        'model', 'variant', 'size', 'gzip', 'acc', 'drop', 'examples/s', 'p50 ms', 'p99 ms')
+    print(header)
+    print('-' * len(header))
+    for row in rows:
+        print('%-14s %-20s %12d %12s %9.4f %8.4f %12.0f %9.3f %9.3f' % (
+            row['model'],
+            row['variant'],
+            row['size_bytes'],
+            '-' if row['gzip_bytes'] is None else row['gzip_bytes'],
+            row['accuracy'],
+            row['accuracy_drop'],
+            row['examples_per_sec'],
+            row['p50_ms'],
+            row['p99_ms'],
+        ))
+
+
+def train_fashion_mnist(epochs):
+    train, test = tutorial_models.load_fashion_mnist()
+    model = tutorial_models.compile_fashion_mnist_model(tutorial_models.build_fashion_mnist_model())
+    model.fit(train[0], train[1], epochs=epochs)
+    return model, tutorial_models.compile_fashion_mnist_model, train, test
+
+
+def train_imdb(epochs):
+    train, test = tutorial_models.load_imdb()
+    (x_train, y_train), validation = tutorial_models.split_validation(*train)
+    model = tutorial_models.compile_imdb_model(tutorial_models.build_imdb_model())
+    model.fit(x_train, y_train, epochs=epochs, batch_size=512, validation_data=validation)
+    return model, tutorial_models.compile_imdb_model, train, test
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=['fashion_mnist', 'imdb', 'all'], default='all')
+    parser.add_argument('--fashion-epochs', type=int, default=5)
+    parser.add_argument('--imdb-epochs', type=int, default=40)
+    parser.add_argument('--sparsity', type=float, default=0.5)
+    parser.add_argument('--finetune-epochs', type=int, default=1)
+    parser.add_argument('--num-threads', type=int, default=1)
+    parser.add_argument('--output-dir', help='write the converted .tflite models here')
+    args = parser.parse_args()
+
+    jobs = []
+    if args.model in ('fashion_mnist', 'all'):
+        jobs.append(('fashion_mnist', lambda: train_fashion_mnist(args.fashion_epochs)))
+    if args.model in ('imdb', 'all'):
+        jobs.append(('imdb', lambda: train_imdb(args.imdb_epochs)))
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    rows = []
+    for name, train_fn in jobs:
+        model, compile_fn, train, test = train_fn()
+        rows.extend(benchmark(
+            name, model, compile_fn, train, test,
+            sparsity=args.sparsity,
+            finetune_epochs=args.finetune_epochs,
+            num_threads=args.num_threads,
+            output_dir=args.output_dir,
+        ))
+
+    print_table(rows)
+
+
+if __name__ == '__main__':
+    main()
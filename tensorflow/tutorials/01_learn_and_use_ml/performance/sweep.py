@@ -0,0 +1,205 @@
+"""
+Hyperparameter sweep over the tutorial models on a process pool.
+
+The data is preprocessed once and cached as `.npy` files; every worker
+memory-maps the same files, so the page cache holds a single copy. Each
+configuration trains with early stopping on `val_loss` and the results are
+ranked by that best validation loss (the test accuracy is only reported, it
+must not pick the configuration) and printed against training time.
+
+Usage:
+
+    python sweep.py --model imdb --workers 4
+    python sweep.py --model fashion_mnist --random 12 --seed 0 --csv results.csv
+"""
+import argparse
+import csv
+import itertools
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+SEARCH_SPACES = {
+    'fashion_mnist': {
+        'units': [64, 128, 256],
+        'learning_rate': [1e-3, 3e-4],
+        'batch_size': [32, 128],
+    },
+    'imdb': {
+        'embedding_dim': [8, 16, 32],
+        'units': [8, 16, 32],
+        'learning_rate': [1e-3, 3e-3],
+        'batch_size': [128, 512],
+    },
+}
+
+SPLITS = ['x_train', 'y_train', 'x_val', 'y_val', 'x_test', 'y_test']
+
+
+def grid(space):
+    keys = sorted(space)
+    return [dict(zip(keys, values)) for values in itertools.product(*(space[k] for k in keys))]
+
+
+def sample(space, n, seed=None):
+    configs = grid(space)
+    if n >= len(configs):
+        return configs
+    return random.Random(seed).sample(configs, n)
+
+
+def prepare_cache(model_name, cache_dir):
+    """Preprocess the data for `model_name` once and store every split as `.npy`."""
+    directory = os.path.join(cache_dir, model_name)
+    if all(os.path.exists(os.path.join(directory, name + '.npy')) for name in SPLITS):
+        return directory
+
+    # only the parent process needs TensorFlow to download and pad the data
+    import tutorial_models
+
+    if model_name == 'fashion_mnist':
+        train, test = tutorial_models.load_fashion_mnist()
+    else:
+        train, test = tutorial_models.load_imdb()
+    (x_train, y_train), (x_val, y_val) = tutorial_models.split_validation(*train)
+
+    os.makedirs(directory, exist_ok=True)
+    arrays = dict(zip(SPLITS, [x_train, y_train, x_val, y_val, test[0], test[1]]))
+    for name, array in arrays.items():
+        path = os.path.join(directory, name + '.npy')
+        # a complete file or none: an interrupted run must not leave a truncated split behind
+        tmp = '%s.%d.tmp.npy' % (path[:-len('.npy')], os.getpid())
+        np.save(tmp, np.ascontiguousarray(array))
+        os.replace(tmp, path)
+
+    return directory
+
+
+def load_cache(directory):
+    return {name: np.load(os.path.join(directory, name + '.npy'), mmap_mode='r') for name in SPLITS}
+
+
+def init_worker(num_threads):
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def train_config(model_name, directory, config, max_epochs, patience, seed):
+    from tensorflow import keras
+
+    import tutorial_models
+
+    keras.utils.set_random_seed(seed)
+    data = load_cache(directory)
+
+    if model_name == 'fashion_mnist':
+        model = tutorial_models.build_fashion_mnist_model(units=config['units'])
+        tutorial_models.compile_fashion_mnist_model(model, config['learning_rate'])
+    else:
+        model = tutorial_models.build_imdb_model(embedding_dim=config['embedding_dim'], units=config['units'])
+        tutorial_models.compile_imdb_model(model, config['learning_rate'])
+
+    early_stopping = keras.callbacks.EarlyStopping(monitor='val_loss', patience=patience, restore_best_weights=True)
+
+    start = time.perf_counter()
+    history = model.fit(
+        data['x_train'],
+        data['y_train'],
+        epochs=max_epochs,
+        batch_size=config['batch_size'],
+        validation_data=(data['x_val'], data['y_val']),
+        callbacks=[early_stopping],
+        verbose=0
+    )
+    train_seconds = time.perf_counter() - start
+
+    # older tf.keras only restores the best weights when it actually stops
+    # early, not when a run reaches max_epochs; restore them in every case so
+    # that test_acc always comes from the best val_loss epoch
+    if early_stopping.best_weights is not None:
+        model.set_weights(early_stopping.best_weights)
+    best_epoch = int(np.argmin(history.history['val_loss']))
+    test_loss, test_acc = model.evaluate(data['x_test'], data['y_test'], batch_size=1024, verbose=0)
+
+    return {
+        **config,
+        'epochs': len(history.history['loss']),
+        'best_epoch': best_epoch + 1,
+        'best_val_loss': float(history.history['val_loss'][best_epoch]),
+        'best_val_acc': float(history.history['val_accuracy'][best_epoch]),
+        'test_acc': float(test_acc),
+        'train_seconds': train_seconds,
+    }
+
+
+def run_sweep(model_name, configs, cache_dir='sweep_cache', workers=None, max_epochs=40, patience=3, seed=0):
+    workers = workers or max(1, os.cpu_count() // 2)
+    threads_per_worker = max(1, os.cpu_count() // workers)
+    directory = prepare_cache(model_name, cache_dir)
+
+    # TensorFlow does not survive fork, so the workers are spawned
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn'),
+                             initializer=init_worker, initargs=(threads_per_worker,)) as executor:
+        futures = [
+            executor.submit(train_config, model_name, directory, config, max_epochs, patience, seed)
+            for config in configs
+        ]
+        results = []
+        for future in futures:
+            result = future.result()
+            print('%s -> val_loss=%.4f val_acc=%.4f in %.1f s' % (
+                {k: result[k] for k in configs[0]}, result['best_val_loss'], result['best_val_acc'],
+                result['train_seconds']))
+            results.append(result)
+
+    # selected on the validation split only, the test split stays held out
+    return sorted(results, key=lambda r: (r['best_val_loss'], -r['best_val_acc']))
+
+
+def print_table(results):
+    keys = list(results[0])
+    widths = [max(len(k), 10) for k in keys]
+    print(' '.join(k.rjust(w) for k, w in zip(keys, widths)))
+    for result in results:
+        cells = []
+        for k, w in zip(keys, widths):
+            value = result[k]
+            cells.append(('%.4g' % value if isinstance(value, float) else str(value)).rjust(w))
+        print(' '.join(cells))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', choices=sorted(SEARCH_SPACES), default='imdb')
+    parser.add_argument('--random', type=int, metavar='N', help='sample N configurations instead of the full grid')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--max-epochs', type=int, default=40)
+    parser.add_argument('--patience', type=int, default=3)
+    parser.add_argument('--cache-dir', default='sweep_cache')
+    parser.add_argument('--csv', help='also write the results to this file')
+    args = parser.parse_args()
+
+    space = SEARCH_SPACES[args.model]
+    configs = sample(space, args.random, args.seed) if args.random else grid(space)
+    print('%d configurations' % len(configs))
+
+    results = run_sweep(args.model, configs, args.cache_dir, args.workers, args.max_epochs, args.patience, args.seed)
+    print_table(results)
+    print('best by validation loss: %s (test_acc %.4f)' % (
+        {k: results[0][k] for k in space}, results[0]['test_acc']))
+
+    if args.csv:
+        with open(args.csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,375 @@
+"""
+Streaming ingestion of raw review text into int32 shards for the IMDB model.
+
+`02_text-classification/code.py` gets its data from
+`keras.datasets.imdb.load_data(num_words=10000)`, which holds the whole
+pre-tokenized corpus as Python lists of lists. This script builds the same
+kind of data from raw text of any size:
+
+- reviews are streamed from aclImdb-style directories (`pos/*.txt`,
+  `neg/*.txt`) or from dump files with one `label<TAB>text` review per line
+  (optionally gzipped); the input is never read more than a few chunks ahead
+- chunks of reviews are tokenized and mapped to ids on a process pool with the
+  `word_index` convention of `tutorial_models.get_word_index`: every review
+  starts with START, words outside the `num_words` most frequent are UNK,
+  PAD is 0
+- the ids are appended to flat int32 shard files, with an int64 offsets array
+  (review i is `tokens[offsets[i]:offsets[i + 1]]`) and an int8 labels array
+  per shard, and an `index.json` manifest
+- `ShardedReviews` memory-maps the shards and `make_dataset` feeds padded
+  batches (`padding='post'`, keeping the last `maxlen` ids like `pad`) to
+  `tf.data`, so training only touches the batches it reads; the reviews are
+  shuffled over the whole corpus, so a batch mixes shards and labels
+
+The tokenizer (lowercase, `<br />` removed, words and contractions) is an
+approximation of how the Keras IMDB arrays were made, ids for the same review
+can differ slightly from `load_data`.
+
+Usage:
+
+    python text_shards.py aclImdb/train --shards shards/train --workers 4
+    python text_shards.py aclImdb/test --shards shards/test
+    python text_shards.py --shards shards/train --test-shards shards/test --epochs 10
+    python text_shards.py --benchmark --reviews 20000
+"""
+import argparse
+import gzip
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+import tracemalloc
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# no TensorFlow at module level: spawned workers import this module again, and
+# a TensorFlow import would cost each of them seconds before the first chunk
+from imdb_encoding import (IMDB_MAXLEN, IMDB_VOCAB_SIZE, INDEX_FROM, PAD, START, UNK, UNUSED, encode, encode_chunk,
+                           init_worker, vocabulary)
+
+LABELS = {'neg': 0, 'pos': 1}
+MANIFEST = 'index.json'
+
+
+def iter_reviews(paths, skipped=None):
+    """
+    `(label, text)` of every review under `paths`, one at a time.
+
+    `skipped`: list that collects the `path:line` of dump lines that are not
+    `0|1<TAB>text` (a header row, a bad label); without it such a line raises
+    ValueError. Blank lines are ignored.
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for name, label in LABELS.items():
+                directory = os.path.join(path, name)
+                if not os.path.isdir(directory):
+                    continue
+                for filename in sorted(os.listdir(directory)):
+                    if filename.endswith('.txt'):
+                        with open(os.path.join(directory, filename), encoding='utf-8', errors='replace') as f:
+                            yield label, f.read()
+        else:
+            opener = gzip.open if path.endswith('.gz') else open
+            with opener(path, 'rt', encoding='utf-8', errors='replace') as f:
+                for number, line in enumerate(f, 1):
+                    line = line.rstrip('\n')
+                    if not line.strip():
+                        continue
+                    label, _, text = line.partition('\t')
+                    if label.strip() in ('0', '1') and text:
+                        yield int(label), text
+                    elif skipped is not None:
+                        skipped.append('%s:%d' % (path, number))
+                    else:
+                        raise ValueError('%s:%d: expected label<TAB>text with label 0 or 1, got %.40r' % (
+                            path, number, line))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class ShardWriter:
+    def __init__(self, directory, shard_tokens=1 << 24):
+        """
+        `shard_tokens`: ids per shard (4 bytes each) after which the next
+        chunk starts a new shard
+        """
+        self.directory = directory
+        self.shard_tokens = shard_tokens
+        self.shards = []
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+
+    def _open(self):
+        self.name = 'shard-%05d' % len(self.shards)
+        self.file = open(os.path.join(self.directory, self.name + '.int32'), 'wb')
+        self.lengths = []
+        self.labels = []
+        self.num_tokens = 0
+
+    def add(self, tokens, lengths, labels):
+        tokens.astype('<i4', copy=False).tofile(self.file)
+        self.lengths.append(lengths)
+        self.labels.append(labels)
+        self.num_tokens += len(tokens)
+        if self.num_tokens >= self.shard_tokens:
+            self._finish()
+            self._open()
+
+    def _finish(self):
+        self.file.close()
+        if not self.lengths:
+            os.remove(self.file.name)
+            return
+        lengths = np.concatenate(self.lengths)
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        np.save(os.path.join(self.directory, self.name + '.offsets.npy'), offsets)
+        np.save(os.path.join(self.directory, self.name + '.labels.npy'), np.concatenate(self.labels))
+        self.shards.append({'name': self.name, 'reviews': len(lengths), 'tokens': int(offsets[-1])})
+
+    def close(self, **info):
+        """Finish the last shard and write the manifest. Returns the manifest."""
+        self._finish()
+        manifest = {
+            'dtype': 'int32',
+            'reserved': {'PAD': PAD, 'START': START, 'UNK': UNK, 'UNUSED': UNUSED},
+            'index_from': INDEX_FROM,
+            'reviews': sum(shard['reviews'] for shard in self.shards),
+            'tokens': sum(shard['tokens'] for shard in self.shards),
+            'shards': self.shards,
+            **info,
+        }
+        with open(os.path.join(self.directory, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        return manifest
+
+
+def ingest(paths, directory, word_index, num_words=IMDB_VOCAB_SIZE, workers=None, chunk_size=1000,
+           shard_tokens=1 << 24):
+    """
+    Tokenize every review under `paths` into shards in `directory`. Returns
+    the manifest, malformed dump lines are skipped and listed in its
+    `skipped_lines`.
+    """
+    workers = workers or os.cpu_count()
+    writer = ShardWriter(directory, shard_tokens)
+    skipped = []
+    if workers == 1:
+        # a pool of one only adds the spawn and the pickling of every chunk
+        init_worker(word_index, num_words)
+        for chunk in chunked(iter_reviews(paths, skipped), chunk_size):
+            writer.add(*encode_chunk(chunk))
+        return writer.close(num_words=num_words, skipped_lines=skipped)
+
+    # TensorFlow may be imported already and does not survive fork, so the workers are spawned
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker, initargs=(word_index, num_words)) as executor:
+        pending = deque()
+        for chunk in chunked(iter_reviews(paths, skipped), chunk_size):
+            pending.append(executor.submit(encode_chunk, chunk))
+            # a bounded number of chunks in flight, results are written in input order
+            if len(pending) >= 2 * workers:
+                writer.add(*pending.popleft().result())
+        while pending:
+            writer.add(*pending.popleft().result())
+    return writer.close(num_words=num_words, skipped_lines=skipped)
+
+
+class ShardedReviews:
+    """Read side of the shards in `directory`; token files are memory-mapped on first use."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest['shards']
+        self.offsets = [np.load(self._path(shard, '.offsets.npy'), mmap_mode='r') for shard in self.shards]
+        self.labels = [np.load(self._path(shard, '.labels.npy')) for shard in self.shards]
+        self._tokens = [None] * len(self.shards)
+        self.starts = np.cumsum([0] + [shard['reviews'] for shard in self.shards])
+
+    def _path(self, shard, suffix):
+        return os.path.join(self.directory, shard['name'] + suffix)
+
+    def __len__(self):
+        return int(self.starts[-1])
+
+    def tokens(self, shard):
+        if self._tokens[shard] is None:
+            self._tokens[shard] = np.memmap(self._path(self.shards[shard], '.int32'), dtype='<i4', mode='r')
+        return self._tokens[shard]
+
+    def review(self, i):
+        """`(ids, label)` of review `i`."""
+        shard = int(np.searchsorted(self.starts, i, side='right')) - 1
+        local = i - self.starts[shard]
+        offsets = self.offsets[shard]
+        return np.asarray(self.tokens(shard)[offsets[local]:offsets[local + 1]]), int(self.labels[shard][local])
+
+    def padded_batch(self, indices, maxlen=IMDB_MAXLEN):
+        """`(x, y)` for the reviews at the global `indices`, which may come from any shards."""
+        indices = np.asarray(indices)
+        x = np.full((len(indices), maxlen), PAD, dtype=np.int32)
+        y = np.empty(len(indices), dtype=np.float32)
+        shard_of = np.searchsorted(self.starts, indices, side='right') - 1
+        for shard in np.unique(shard_of):
+            rows = np.flatnonzero(shard_of == shard)
+            local = indices[rows] - self.starts[shard]
+            tokens = self.tokens(shard)
+            offsets = self.offsets[shard]
+            for row, i in zip(rows, local):
+                # longer reviews keep their end, like pad_sequences' default truncating='pre'
+                sequence = tokens[max(offsets[i], offsets[i + 1] - maxlen):offsets[i + 1]]
+                x[row, :len(sequence)] = sequence
+            y[rows] = self.labels[shard][local]
+        return x, y
+
+    def batches(self, batch_size, maxlen=IMDB_MAXLEN, rng=None):
+        """
+        `(x, y)` batches over all reviews. With `rng` the reviews are shuffled
+        over the whole corpus, so batches mix shards: shards written from
+        aclImdb directories hold all `neg` reviews before the `pos` ones, and
+        a batch from a single shard would often hold a single label.
+        """
+        order = rng.permutation(len(self)) if rng is not None else np.arange(len(self))
+        for start in range(0, len(order), batch_size):
+            yield self.padded_batch(order[start:start + batch_size], maxlen)
+
+
+def make_dataset(directory, batch_size=512, maxlen=IMDB_MAXLEN, shuffle=True, seed=None):
+    """`tf.data` pipeline of padded batches read lazily from the shards; reshuffled every epoch."""
+    import tensorflow as tf
+
+    reviews = ShardedReviews(directory)
+    rng = np.random.default_rng(seed) if shuffle else None
+
+    def generate():
+        yield from reviews.batches(batch_size, maxlen, rng)
+
+    # the number of batches is known, tell Keras so it does not have to find the end of an epoch
+    num_batches = -(-len(reviews) // batch_size)
+    return tf.data.Dataset.from_generator(generate, output_signature=(
+        tf.TensorSpec((None, maxlen), tf.int32),
+        tf.TensorSpec((None,), tf.float32),
+    )).apply(tf.data.experimental.assert_cardinality(num_batches)).prefetch(tf.data.AUTOTUNE)
+
+
+def synthetic_corpus(path, vocabulary_path, num_reviews, vocab_size=50000, mean_words=230, seed=0):
+    """A TSV dump of Zipf-distributed words and the matching word index, for the benchmark."""
+    rng = np.random.default_rng(seed)
+    words = np.array(['word%d' % i for i in range(vocab_size)])
+    with open(vocabulary_path, 'w') as f:
+        json.dump({word: rank + 1 for rank, word in enumerate(words)}, f)
+    with open(path, 'w') as f:
+        for _ in range(num_reviews):
+            length = max(int(rng.exponential(mean_words)), 1)
+            ranks = np.minimum(rng.zipf(1.2, length) - 1, vocab_size - 1)
+            f.write('%d\t%s<br /><br />%s\n' % (rng.integers(2), ' '.join(words[ranks[:length // 2]]),
+                                                ' '.join(words[ranks[length // 2:]])))
+
+
+def benchmark(num_reviews, workers, chunk_size):
+    import tutorial_models
+
+    with tempfile.TemporaryDirectory() as directory:
+        dump = os.path.join(directory, 'reviews.tsv')
+        vocabulary_path = os.path.join(directory, 'word_index.json')
+        synthetic_corpus(dump, vocabulary_path, num_reviews)
+        word_index = tutorial_models.get_word_index(vocabulary_path)
+        dump_bytes = os.path.getsize(dump)
+
+        # what load_data hands over: a Python list of id lists for the whole corpus
+        word_ids = vocabulary(word_index, IMDB_VOCAB_SIZE)
+        start = time.perf_counter()
+        sequences = [encode(text, word_ids) for _, text in iter_reviews([dump])]
+        list_seconds = time.perf_counter() - start
+        del sequences
+        # again with tracemalloc, which slows the allocations down too much to time them
+        tracemalloc.start()
+        sequences = [encode(text, word_ids) for _, text in iter_reviews([dump])]
+        list_bytes = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del sequences
+
+        print('%d reviews, %.1f MiB of text, %d CPUs' % (num_reviews, dump_bytes / 2**20, os.cpu_count()))
+        print('%-26s %10s %14s %10s %12s' % ('ingestion', 'seconds', 'reviews/sec', 'MiB/s', 'MiB kept'))
+        print('%-26s %10.2f %14.0f %10.1f %12.1f' % ('in-memory lists', list_seconds, num_reviews / list_seconds,
+                                                     dump_bytes / 2**20 / list_seconds, list_bytes / 2**20))
+        for num_workers in sorted({1, workers}):
+            shards = os.path.join(directory, 'shards-%d' % num_workers)
+            start = time.perf_counter()
+            manifest = ingest([dump], shards, word_index, workers=num_workers, chunk_size=chunk_size,
+                              shard_tokens=1 << 22)
+            seconds = time.perf_counter() - start
+            shard_bytes = sum(os.path.getsize(os.path.join(shards, name)) for name in os.listdir(shards))
+            print('%-26s %10.2f %14.0f %10.1f %12.1f' % (
+                'shards, %d worker%s' % (num_workers, 's' if num_workers > 1 else ''), seconds,
+                num_reviews / seconds, dump_bytes / 2**20 / seconds, shard_bytes / 2**20))
+
+        reviews = ShardedReviews(shards)
+        start = time.perf_counter()
+        count = sum(len(x) for x, _ in reviews.batches(512, rng=np.random.default_rng(0)))
+        seconds = time.perf_counter() - start
+        print('%d shards, %d ids; padded batches of 512: %.0f reviews/sec' % (
+            len(manifest['shards']), manifest['tokens'], count / seconds))
+
+
+def main():
+    # TensorFlow only in the parent process, for the word index download and training
+    import tutorial_models
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('inputs', nargs='*', help='aclImdb-style directories or label<TAB>text dump files to ingest')
+    parser.add_argument('--shards', help='shard directory to write (with inputs) or to train on')
+    parser.add_argument('--test-shards', help='shard directory to evaluate on after training')
+    parser.add_argument('--vocab', help='word index JSON (word to frequency rank), default is the Keras IMDB index')
+    parser.add_argument('--num-words', type=int, default=IMDB_VOCAB_SIZE)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--chunk-size', type=int, default=1000, help='reviews per task sent to a worker')
+    parser.add_argument('--shard-tokens', type=int, default=1 << 24)
+    parser.add_argument('--epochs', type=int, default=0, help='train on --shards for this many epochs')
+    parser.add_argument('--batch-size', type=int, default=512)
+    parser.add_argument('--benchmark', action='store_true', help='ingest a synthetic corpus and report throughput')
+    parser.add_argument('--reviews', type=int, default=20000, help='size of the benchmark corpus')
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.reviews, args.workers, args.chunk_size)
+        return
+    if not args.shards:
+        parser.error('--shards is required')
+
+    if args.inputs:
+        start = time.perf_counter()
+        manifest = ingest(args.inputs, args.shards, tutorial_models.get_word_index(args.vocab), args.num_words,
+                          args.workers, args.chunk_size, args.shard_tokens)
+        seconds = time.perf_counter() - start
+        print('%d reviews, %d ids in %d shards, %.1f s (%.0f reviews/sec)' % (
+            manifest['reviews'], manifest['tokens'], len(manifest['shards']), seconds, manifest['reviews'] / seconds))
+        if manifest['skipped_lines']:
+            print('skipped %d malformed lines: %s' % (
+                len(manifest['skipped_lines']), ', '.join(manifest['skipped_lines'][:5])
+                + (', ...' if len(manifest['skipped_lines']) > 5 else '')))
+
+    if args.epochs:
+        num_words = ShardedReviews(args.shards).manifest['num_words']
+        model = tutorial_models.compile_imdb_model(tutorial_models.build_imdb_model(vocab_size=num_words))
+        model.fit(make_dataset(args.shards, args.batch_size), epochs=args.epochs)
+        if args.test_shards:
+            loss, accuracy = model.evaluate(make_dataset(args.test_shards, args.batch_size, shuffle=False))
+            print('test loss %.4f, accuracy %.4f' % (loss, accuracy))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Data loading and model definitions shared by the performance scripts.
+
+The models are the same as the ones in `01_basic-classification/code.py` and
+`02_text-classification/code.py`, with the legacy `tf.train.AdamOptimizer`
+replaced by `keras.optimizers.Adam`.
+"""
+import json
+
+from tensorflow import keras
+
+import numpy as np
+
+from imdb_encoding import IMDB_MAXLEN, IMDB_VOCAB_SIZE, INDEX_FROM, PAD, START, UNK, UNUSED
+
+
+def load_fashion_mnist():
+    (train_images, train_labels), (test_images, test_labels) = \
+        keras.datasets.fashion_mnist.load_data()
+
+    train_images = (train_images / 255.0).astype(np.float32)
+    test_images = (test_images / 255.0).astype(np.float32)
+
+    return (train_images, train_labels), (test_images, test_labels)
+
+
+def load_imdb(num_words=IMDB_VOCAB_SIZE, maxlen=IMDB_MAXLEN):
+    (train_data, train_labels), (test_data, test_labels) = \
+        keras.datasets.imdb.load_data(num_words=num_words)
+
+    train_data = pad(train_data, maxlen)
+    test_data = pad(test_data, maxlen)
+
+    return (train_data, train_labels), (test_data, test_labels)
+
+
+def pad(sequences, maxlen=IMDB_MAXLEN):
+    return keras.preprocessing.sequence.pad_sequences(
+        sequences,
+        value=PAD,
+        padding='post',
+        maxlen=maxlen
+    )
+
+
+def get_word_index(path=None):
+    """
+    `path`: optional JSON file mapping words to their frequency rank (from 1),
+    in the format of the IMDB index Keras downloads, which is the default
+    """
+    if path is None:
+        word_index = keras.datasets.imdb.get_word_index()
+    else:
+        with open(path) as f:
+            word_index = json.load(f)
+    word_index = {k: (v + INDEX_FROM) for k, v in word_index.items()}
+    word_index['<PAD>'] = PAD
+    word_index['<START>'] = START
+    word_index['<UNK>'] = UNK
+    word_index['<UNUSED>'] = UNUSED
+    return word_index
+
+
+def build_fashion_mnist_model(units=128):
+    return keras.Sequential([
+        keras.Input(shape=(28, 28)),
+        keras.layers.Flatten(),
+        keras.layers.Dense(units, activation='relu'),
+        keras.layers.Dense(10, activation='softmax')
+    ])
+
+
+def build_imdb_model(vocab_size=IMDB_VOCAB_SIZE, embedding_dim=16, units=16, maxlen=IMDB_MAXLEN):
+    return keras.Sequential([
+        keras.Input(shape=(maxlen,), dtype='int32'),
+        keras.layers.Embedding(vocab_size, embedding_dim),
+        keras.layers.GlobalAveragePooling1D(),
+        keras.layers.Dense(units, activation='relu'),
+        keras.layers.Dense(1, activation='sigmoid')
+    ])
+
+
+def compile_fashion_mnist_model(model, learning_rate=1e-3):
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate),
+        loss='sparse_categorical_crossentropy',
+        metrics=['accuracy']
+    )
+    return model
+
+
+def compile_imdb_model(model, learning_rate=1e-3):
+    model.compile(
+        optimizer=keras.optimizers.Adam(learning_rate),
+        loss='binary_crossentropy',
+        metrics=['accuracy']
+    )
+    return model
+
+
+def split_validation(data, labels, num_val=10000):
+    # same split as the text classification tutorial
+    return (data[num_val:], labels[num_val:]), (data[:num_val], labels[:num_val])